@@ -22,6 +22,10 @@ from .properties.properties_extract_model import Properties_ExtractModel
 
 from .migoto.migoto_import import *
 
+from .generate_mod.m_export import ExportExecutor
+from .migoto.migoto_binary_file import MigotoBinaryFile
+from .migoto.import_executor import ImportExecutor
+
 
 bl_info = {
     "name": "TheHerta",
@@ -244,6 +248,13 @@ def unregister():
         SpaceView3D.draw_handler_remove(migoto_draw_handler, 'WINDOW')
         migoto_draw_handler = None
 
+    # 关闭导出计算线程池
+    ExportExecutor.shutdown()
+
+    # 关闭导入读取线程池，释放导入时的内存映射
+    ImportExecutor.shutdown()
+    MigotoBinaryFile.clear_memory_map_cache()
+
 
 if __name__ == "__main__":
     register()
@@ -0,0 +1,220 @@
+'''
+MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm_blendweights 的性质测试和吞吐量测试，只需要numpy，不需要Blender
+
+性质测试: 在4、8、12、16个权重一行的随机数据上(包含0、NaN、相同权重、小于1/255的权重、总和为0的行)
+- 和之前循环最多255次逐次分配误差的实现逐位相同
+- 4个一行时，总和不为0的行和_bk2逐行的标量实现逐位相同，总和为0的行当前实现全部分配给第一个位置，_bk2为全0
+- 8个以上一行时，_bk2用sum()从左到右累加，numpy按块累加，行总和可能相差一个ulp，
+  少数行的量化结果会和_bk2不同，这里只统计不同的行数，之前的循环实现在这些行上和当前实现相同
+- 含有NaN的行结果为全0
+- 不含NaN、总和不为0的行量化后总和为255
+
+吞吐量测试: 每行4个权重时当前实现和之前循环实现每秒处理的行数
+
+用法: python benchmarks/bench_blendweights_unorm8.py [--rows 600000] [--cases 200] [--repeat 3]
+'''
+import argparse
+import math
+import time
+
+import numpy
+
+from source_loader import load_method
+
+converter_namespace = {"numpy": numpy, "math": math}
+convert_blendweights = load_method("generate_mod/mesh_format_converter.py", "MeshFormatConverter", "convert_4x_float32_to_r8g8b8a8_unorm_blendweights", converter_namespace)
+convert_blendweights_bk2 = load_method("generate_mod/mesh_format_converter.py", "MeshFormatConverter", "convert_4x_float32_to_r8g8b8a8_unorm_blendweights_bk2", converter_namespace)
+
+
+def convert_blendweights_loop(input_array):
+    '''
+    之前的实现，每次给每行ticket最大的位置加1，ticket用完后给当前权重最大的位置加1，最多循环255次
+    '''
+    # 创建结果数组
+    result = numpy.zeros_like(input_array, dtype=numpy.uint8)
+
+    # 处理NaN值
+    nan_mask = numpy.isnan(input_array).any(axis=1)
+    valid_mask = ~nan_mask
+
+    # 只处理非NaN行
+    valid_input = input_array[valid_mask]
+    if valid_input.size == 0:
+        return result
+
+    # 计算每行总和
+    row_sums = valid_input.sum(axis=1, keepdims=True)
+
+    # 处理零和行
+    zero_sum_mask = (row_sums[:, 0] == 0)
+    non_zero_mask = ~zero_sum_mask
+
+    # 归一化权重
+    normalized = numpy.zeros_like(valid_input)
+    normalized[non_zero_mask] = valid_input[non_zero_mask] / row_sums[non_zero_mask] * 255.0
+
+    # 计算整数部分和小数部分
+    int_part = numpy.floor(normalized).astype(numpy.int32)
+    fractional = normalized - int_part
+
+    # 设置小于1的权重为0
+    small_weight_mask = (normalized < 1) & non_zero_mask[:, numpy.newaxis]
+    int_part[small_weight_mask] = 0
+    fractional[small_weight_mask] = 0
+
+    # 计算精度误差
+    precision_error = 255 - int_part.sum(axis=1)
+
+    # 计算tickets
+    tickets = numpy.zeros_like(normalized)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        tickets[non_zero_mask] = numpy.where(
+            (normalized[non_zero_mask] >= 1) & (fractional[non_zero_mask] > 0),
+            255 * fractional[non_zero_mask] / normalized[non_zero_mask],
+            0
+        )
+
+    # 分配精度误差
+    output = int_part.copy()
+    for i in range(precision_error.max()):
+        # 找出需要分配的行
+        need_allocation = (precision_error > 0)
+        if not numpy.any(need_allocation):
+            break
+
+        # 找出当前行中ticket最大的位置
+        max_ticket_mask = numpy.zeros_like(tickets, dtype=bool)
+        rows = numpy.where(need_allocation)[0]
+
+        # 对于有ticket的行
+        has_ticket = (tickets[rows] > 0).any(axis=1)
+        if numpy.any(has_ticket):
+            ticket_rows = rows[has_ticket]
+            row_indices = ticket_rows[:, numpy.newaxis]
+            col_indices = tickets[ticket_rows].argmax(axis=1)
+            max_ticket_mask[ticket_rows, col_indices] = True
+            tickets[ticket_rows, col_indices] = 0
+
+        # 对于没有ticket的行
+        no_ticket = ~has_ticket & need_allocation[rows]
+        if numpy.any(no_ticket):
+            no_ticket_rows = rows[no_ticket]
+            # 找出当前权重最大的位置
+            max_weight_mask = numpy.zeros_like(tickets, dtype=bool)
+            row_indices = no_ticket_rows[:, numpy.newaxis]
+            col_indices = output[no_ticket_rows].argmax(axis=1)
+            max_weight_mask[no_ticket_rows, col_indices] = True
+            max_ticket_mask |= max_weight_mask
+
+        # 应用分配
+        output[max_ticket_mask] += 1
+        precision_error[need_allocation] -= 1
+
+    # 将结果存回
+    result[valid_mask] = output.astype(numpy.uint8)
+
+    return result
+
+
+def make_weight_rows(row_count:int, row_width:int, rng:numpy.random.Generator) -> numpy.ndarray:
+    '''
+    随机生成一批float32权重，混入导出时会遇到的各种特殊情况
+    '''
+    weights = rng.random((row_count, row_width), dtype=numpy.float32)
+
+    # 一部分位置为0，模拟影响的骨骼数少于列数的顶点
+    weights[rng.random((row_count, row_width)) < 0.4] = 0
+    # 小于1/255的权重，量化后应该被忽略
+    tiny_rows = rng.random(row_count) < 0.1
+    weights[tiny_rows, -1] = numpy.float32(1e-4)
+    # 相同的权重，检查ticket相同时的分配顺序
+    tie_rows = rng.random(row_count) < 0.2
+    weights[tie_rows, 1] = weights[tie_rows, 0]
+    # 只影响一个骨骼、平均分配等常见情况
+    single_rows = rng.random(row_count) < 0.05
+    weights[single_rows] = 0
+    weights[single_rows, 0] = 1
+    even_rows = rng.random(row_count) < 0.05
+    weights[even_rows] = numpy.float32(1) / row_width
+    # 已经是UNORM8精度的权重
+    unorm_rows = rng.random(row_count) < 0.1
+    weights[unorm_rows] = numpy.round(weights[unorm_rows] * 255) / 255
+    # 总和为0和含有NaN的行
+    weights[rng.random(row_count) < 0.03] = 0
+    weights[rng.random(row_count) < 0.02, 0] = numpy.nan
+    return weights
+
+
+def check_properties(cases:int, rng:numpy.random.Generator):
+    checked_rows = 0
+    bk2_mismatch_dict = {}
+    bk2_row_count_dict = {}
+    for case_index in range(cases):
+        row_width = (4, 8, 12, 16)[case_index % 4]
+        row_count = int(rng.integers(1, 400))
+        weights = make_weight_rows(row_count, row_width, rng)
+
+        result = convert_blendweights(None, weights)
+        assert result.dtype == numpy.uint8 and result.shape == weights.shape
+
+        loop_result = convert_blendweights_loop(weights.copy())
+        assert numpy.array_equal(result, loop_result), "mismatch with the previous loop, case " + str(case_index)
+
+        nan_rows = numpy.isnan(weights).any(axis=1)
+        zero_sum_rows = ~nan_rows & (numpy.nan_to_num(weights).sum(axis=1) == 0)
+        # _bk2遇到NaN时固定写入4个0，只有4个一行时才能处理含有NaN的行
+        bk2_rows = ~zero_sum_rows if row_width == 4 else ~zero_sum_rows & ~nan_rows
+        bk2_result = convert_blendweights_bk2(None, weights[bk2_rows])
+        bk2_mismatch_rows = int(numpy.count_nonzero((result[bk2_rows] != bk2_result).any(axis=1)))
+        if row_width == 4:
+            assert bk2_mismatch_rows == 0, "mismatch with _bk2, case " + str(case_index)
+        else:
+            bk2_mismatch_dict[row_width] = bk2_mismatch_dict.get(row_width, 0) + bk2_mismatch_rows
+            bk2_row_count_dict[row_width] = bk2_row_count_dict.get(row_width, 0) + int(numpy.count_nonzero(bk2_rows))
+
+        valid_rows = ~nan_rows & ~zero_sum_rows
+        assert numpy.all(result[valid_rows].sum(axis=1, dtype=numpy.int64) == 255)
+        assert numpy.all(result[nan_rows] == 0)
+        checked_rows += row_count
+
+    print("property test: " + str(cases) + " cases, " + str(checked_rows) + " rows, identical to the previous loop, 4-wide rows identical to _bk2")
+    for row_width in sorted(bk2_mismatch_dict.keys()):
+        print("  " + str(row_width) + "-wide rows differing from _bk2 (row sum order): " + str(bk2_mismatch_dict[row_width]) + " / " + str(bk2_row_count_dict[row_width]))
+
+
+def best_time(function, argument, repeat:int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_throughput(row_count:int, repeat:int, rng:numpy.random.Generator):
+    weights = make_weight_rows(row_count, 4, rng)
+
+    new_time = best_time(lambda array: convert_blendweights(None, array), weights, repeat)
+    loop_time = best_time(convert_blendweights_loop, weights, repeat)
+
+    print("rows".rjust(10) + "loop(s)".rjust(10) + "current(s)".rjust(12) + "loop rows/s".rjust(14) + "current rows/s".rjust(16))
+    print(str(row_count).rjust(10) + ("%.3f" % loop_time).rjust(10) + ("%.3f" % new_time).rjust(12)
+        + ("%.0f" % (row_count / loop_time)).rjust(14) + ("%.0f" % (row_count / new_time)).rjust(16))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=600000)
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(args.seed)
+    check_properties(args.cases, rng)
+    benchmark_throughput(args.rows, args.repeat, rng)
+
+
+if __name__ == "__main__":
+    main()
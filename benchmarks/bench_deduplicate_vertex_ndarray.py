@@ -0,0 +1,105 @@
+'''
+BufferModel.deduplicate_vertex_ndarray 的正确性检查和规模测试，只需要numpy，不需要Blender
+
+和之前逐个loop执行tobytes()再OrderedDict.setdefault的实现比较:
+- IndexBuffer逐个相同，唯一顶点逐字节相同，唯一顶点按第一次出现的顺序排列
+- 不同loop数量下两种实现的耗时
+
+用法: python benchmarks/bench_deduplicate_vertex_ndarray.py [--sizes 1000 10000 100000 690000] [--repeat 3]
+'''
+import argparse
+import collections
+import time
+
+import numpy
+
+from source_loader import load_method
+
+deduplicate_vertex_ndarray = load_method("generate_mod/buffer_model.py", "BufferModel", "deduplicate_vertex_ndarray", {"numpy": numpy})
+
+# 和常见GameType中一个loop的数据类型相近
+VERTEX_DTYPE = numpy.dtype([
+    ("POSITION", numpy.float32, 3),
+    ("NORMAL", numpy.float32, 3),
+    ("TANGENT", numpy.float32, 4),
+    ("COLOR", numpy.uint8, 4),
+    ("TEXCOORD", numpy.float16, 2),
+    ("BLENDWEIGHTS", numpy.uint8, 4),
+    ("BLENDINDICES", numpy.uint8, 4),
+])
+
+
+def deduplicate_vertex_ndarray_ordered_dict(vertex_ndarray:numpy.ndarray):
+    '''
+    之前calc_index_vertex_buffer_universal中的实现
+    '''
+    indexed_vertices = collections.OrderedDict()
+    ib = [indexed_vertices.setdefault(vertex_ndarray[i].tobytes(), len(indexed_vertices)) for i in range(len(vertex_ndarray))]
+    return ib, b"".join(indexed_vertices.keys())
+
+
+def make_loop_ndarray(loop_count:int, rng:numpy.random.Generator) -> numpy.ndarray:
+    '''
+    模拟导出时的loop数组: 大约每6个loop共用一个顶点，UV接缝处同一个位置有多个不同的顶点，
+    另外混入少量只差一个字节的顶点和-0.0，检查是否严格按字节去重
+    '''
+    unique_count = max(1, loop_count // 6)
+    unique_vertices = numpy.zeros(unique_count, dtype=VERTEX_DTYPE)
+    raw_bytes = unique_vertices.view(numpy.uint8).reshape(unique_count, -1)
+    raw_bytes[:] = rng.integers(0, 256, raw_bytes.shape, dtype=numpy.uint8)
+
+    if unique_count > 8:
+        # 只有最后一个字节不同的顶点
+        near_rows = rng.choice(unique_count, unique_count // 8, replace=False)
+        unique_vertices[near_rows] = unique_vertices[near_rows - 1]
+        unique_vertices["BLENDINDICES"][near_rows, 3] ^= 1
+        # 0.0和-0.0数值相等但字节不同
+        signed_zero_rows = rng.choice(unique_count, unique_count // 16, replace=False)
+        unique_vertices["POSITION"][signed_zero_rows, 0] = -0.0
+        unique_vertices["POSITION"][signed_zero_rows - 1] = unique_vertices["POSITION"][signed_zero_rows]
+        unique_vertices["POSITION"][signed_zero_rows - 1, 0] = 0.0
+
+    return unique_vertices[rng.integers(0, unique_count, loop_count)]
+
+
+def best_time(function, argument, repeat:int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000, 100000, 690000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(args.seed)
+    print("loops".rjust(10) + "unique".rjust(10) + "OrderedDict(s)".rjust(16) + "numpy(s)".rjust(12) + "speedup".rjust(10))
+    for loop_count in args.sizes:
+        loop_ndarray = make_loop_ndarray(loop_count, rng)
+
+        reference_time, (reference_ib, reference_vertex_bytes) = best_time(deduplicate_vertex_ndarray_ordered_dict, loop_ndarray, args.repeat)
+        new_time, (ib, unique_vertex_ndarray, first_indices) = best_time(lambda ndarray: deduplicate_vertex_ndarray(None, ndarray), loop_ndarray, args.repeat)
+
+        assert ib.dtype == numpy.uint32
+        assert ib.tolist() == reference_ib, "IndexBuffer mismatch at " + str(loop_count) + " loops"
+        assert unique_vertex_ndarray.tobytes() == reference_vertex_bytes, "vertex bytes mismatch at " + str(loop_count) + " loops"
+        # 随机字节中有NaN，按字节比较
+        assert loop_ndarray[first_indices].tobytes() == unique_vertex_ndarray.tobytes()
+
+        print(str(loop_count).rjust(10) + str(len(unique_vertex_ndarray)).rjust(10)
+            + ("%.4f" % reference_time).rjust(16) + ("%.4f" % new_time).rjust(12)
+            + ("%.1fx" % (reference_time / new_time if new_time > 0 else float("inf"))).rjust(10))
+
+    print("IndexBuffer and vertex bytes identical at all sizes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+'''
+从插件源码中取出单个方法的定义，在不安装Blender的环境中直接运行
+
+插件中的模块都会导入bpy，所以这里不导入模块，而是用ast找到对应类中的方法，
+去掉@classmethod后作为普通函数执行，调用时第一个参数cls传None即可。
+这样基准测试检查的始终是仓库中当前的实现，而不是一份复制出来的代码。
+'''
+import ast
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_method(relative_path:str, class_name:str, method_name:str, namespace:dict):
+    '''
+    relative_path: 相对于仓库根目录的源码路径，例如 generate_mod/buffer_model.py
+    namespace: 方法执行时使用的全局变量，例如 {"numpy": numpy}
+    '''
+    source_path = os.path.join(REPO_ROOT, relative_path)
+    with open(source_path, "r", encoding="utf-8") as source_file:
+        source = source_file.read()
+
+    for node in ast.parse(source).body:
+        if not isinstance(node, ast.ClassDef) or node.name != class_name:
+            continue
+        for class_node in node.body:
+            if isinstance(class_node, ast.FunctionDef) and class_node.name == method_name:
+                class_node.decorator_list = []
+                module = ast.Module(body=[class_node], type_ignores=[])
+                exec(compile(module, source_path, "exec"), namespace)
+                return namespace[method_name]
+
+    raise LookupError(class_name + "." + method_name + " not found in " + relative_path)
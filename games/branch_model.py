@@ -1,15 +1,19 @@
 import bpy
 import copy
 
+from concurrent.futures import Future
+
 from ..utils.obj_utils import ObjUtils
 from ..utils.log_utils import LOG
 from ..utils.collection_utils import CollectionUtils, CollectionColor
 from ..utils.config_utils import ConfigUtils
 
-from ..migoto.migoto_format import M_Key, ObjDataModel, M_Condition, D3D11GameType
+from ..migoto.migoto_format import M_Key, ObjDataModel, ObjBufferData, M_Condition, D3D11GameType
 from ..generate_mod.m_counter import M_Counter
 
-from ..generate_mod.m_export import get_buffer_ib_vb_fast
+from ..generate_mod.export_cache import ExportCache
+from ..generate_mod.m_export import ExportExecutor
+from ..generate_mod.category_buffer_writer import CategoryBufferWriter
 
 '''
 分支模型
@@ -198,56 +202,82 @@ class BranchModel:
                 # LOG.newline()
 
 
-    def get_buffered_obj_data_model_list_by_draw_ib_and_game_type(self,draw_ib:str,d3d11_game_type:D3D11GameType):
+    def get_buffered_obj_data_model_list_by_draw_ib_and_game_type(self,draw_ib:str,d3d11_game_type:D3D11GameType,part_name_list:list[str] = None,category_buffer_writer:CategoryBufferWriter = None):
         '''
         (1) 读取obj的category_buffer
         (2) 读取obj的ib
         (3) 设置到最终的ordered_draw_obj_model_list
-        '''
-        __obj_name_ib_dict:dict[str,list] = {} 
-        __obj_name_category_buffer_list_dict:dict[str,list] =  {} 
-
-        obj_name_obj_model_cache_dict:dict[str,ObjDataModel] = {}
 
-        for obj_model in self.ordered_draw_obj_data_model_list:
+        流式导出时传入part_name_list和category_buffer_writer，
+        按Component顺序提交obj，每个obj计算完成后直接把CategoryBuffer追加写入文件并释放，同时在计算中的obj数量也有上限
+        '''
+        # 同一个obj在多个位置绘制时共享同一份ObjBufferData
+        __obj_name_buffer_data_dict:dict[str,ObjBufferData] = {} 
+
+        # 主线程依次读取每个obj的数据并提交计算，计算在线程池中同时进行
+        obj_name_future_dict:dict[str,Future] = {}
+        # 已提交但还没有取回结果的obj，按提交顺序排列
+        pending_obj_name_list:list[str] = []
+
+        draw_ib_obj_data_model_list = [obj_model for obj_model in self.ordered_draw_obj_data_model_list if obj_model.draw_ib == draw_ib]
+
+        # 流式导出时限制同时在计算中的obj数量，其它情况全部提交后再统一取回
+        max_in_flight = None
+        submit_obj_data_model_list = draw_ib_obj_data_model_list
+        # 需要写入CategoryBuffer的obj，不属于任何Component的obj只计算不写入
+        streaming_obj_name_set = set()
+        if category_buffer_writer is not None:
+            max_in_flight = ExportExecutor.get_max_in_flight()
+
+            # 写入顺序必须和parse_categoryname_bytelist_dict_3一样，所以按Component顺序提交，剩下的obj放在最后
+            submit_obj_data_model_list = []
+            for part_name in part_name_list:
+                for obj_model in draw_ib_obj_data_model_list:
+                    if part_name == str(obj_model.component_count):
+                        submit_obj_data_model_list.append(obj_model)
+                        streaming_obj_name_set.add(obj_model.obj_name)
+            for obj_model in draw_ib_obj_data_model_list:
+                if obj_model.obj_name not in streaming_obj_name_set:
+                    submit_obj_data_model_list.append(obj_model)
+
+        def collect_result(obj_name:str):
+            # 按提交顺序取回计算结果，计算中的报错也会在这里抛出
+            ib, category_buffer_dict, index_vertex_id_ndarray = obj_name_future_dict[obj_name].result()
+            # 结果已经取回，Future不再持有这个obj的数据
+            obj_name_future_dict[obj_name] = None
+            unique_vertex_count = ObjBufferData.get_unique_vertex_count(ib, category_buffer_dict)
+
+            if obj_name in streaming_obj_name_set:
+                category_buffer_writer.append(obj_name, category_buffer_dict)
+                category_buffer_dict = None
+            __obj_name_buffer_data_dict[obj_name] = ObjBufferData(ib=ib, category_buffer_dict=category_buffer_dict, index_vertex_id_ndarray=None, unique_vertex_count=unique_vertex_count)
+
+        for obj_model in submit_obj_data_model_list:
+            obj_name = obj_model.obj_name
 
-            # 只统计给定DrawIB的数据
-            if obj_model.draw_ib != draw_ib:
+            if obj_name in obj_name_future_dict:
+                LOG.info("Using cached model for " + obj_name)
                 continue
 
-            obj_name = obj_model.obj_name
-
             obj = bpy.data.objects[obj_name]
-            
-            obj_model = obj_name_obj_model_cache_dict.get(obj_name,None)
-            if obj_model is not None:
-                LOG.info("Using cached model for " + obj_name)
-                __obj_name_ib_dict[obj.name] = obj_model.ib
-                __obj_name_category_buffer_list_dict[obj.name] = obj_model.category_buffer_dict
-            else:
-                # 选中当前obj对象
-                bpy.context.view_layer.objects.active = obj
 
-                # XXX 我们在导出具体数据之前，先对模型整体的权重进行normalize_all预处理，才能让后续的具体每一个权重的normalize_all更好的工作
-                # 使用这个的前提是当前obj中没有锁定的顶点组，所以这里要先进行判断。
-                if "Blend" in d3d11_game_type.OrderedCategoryNameList:
-                    all_vgs_locked = ObjUtils.is_all_vertex_groups_locked(obj)
-                    if not all_vgs_locked:
-                        ObjUtils.normalize_all(obj)
+            # 选中当前obj对象
+            bpy.context.view_layer.objects.active = obj
 
-                ib, category_buffer_dict, index_vertex_id_dict = get_buffer_ib_vb_fast(d3d11_game_type)
-                
-                __obj_name_ib_dict[obj.name] = ib
-                __obj_name_category_buffer_list_dict[obj.name] = category_buffer_dict
+            # XXX 我们在导出具体数据之前，先对模型整体的权重进行normalize_all预处理，才能让后续的具体每一个权重的normalize_all更好的工作
+            # 这里不再调用bpy.ops，而是在计算权重时按Normalize All的规则直接规格化，不修改obj本身，锁定的顶点组同样保持不变
+            obj_name_future_dict[obj_name] = ExportCache.submit_buffer_ib_vb(obj, d3d11_game_type, normalize_weights=True)
+            pending_obj_name_list.append(obj_name)
 
-                obj_model = ObjDataModel(obj_name=obj.name)
-                obj_model.ib = ib
-                obj_model.category_buffer_dict = category_buffer_dict
-                obj_name_obj_model_cache_dict[obj_name] = obj_model
+            while max_in_flight is not None and len(pending_obj_name_list) > max_in_flight:
+                collect_result(pending_obj_name_list.pop(0))
+
+        for obj_name in pending_obj_name_list:
+            collect_result(obj_name)
         
         final_ordered_draw_obj_model_list:list[ObjDataModel] = [] 
 
-        print(__obj_name_ib_dict.keys())
+        print(__obj_name_buffer_data_dict.keys())
         
         for obj_model in self.ordered_draw_obj_data_model_list:
 
@@ -257,9 +287,11 @@ class BranchModel:
 
             obj_name = obj_model.obj_name
 
-            obj_model.ib = __obj_name_ib_dict[obj_name]
-            obj_model.category_buffer_dict = __obj_name_category_buffer_list_dict[obj_name]
+            # 全局的obj_model列表会被每个DrawIB使用，所以这里复制一份再设置，
+            # 复制时只复制生效条件等元数据，几何数据仍然引用共享的ObjBufferData
+            draw_obj_model = copy.deepcopy(obj_model)
+            draw_obj_model.buffer_data = __obj_name_buffer_data_dict[obj_name]
 
-            final_ordered_draw_obj_model_list.append(copy.deepcopy(obj_model))
+            final_ordered_draw_obj_model_list.append(draw_obj_model)
         
         return final_ordered_draw_obj_model_list
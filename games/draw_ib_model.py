@@ -12,7 +12,7 @@ from ..utils.collection_utils import *
 from ..config.main_config import *
 from ..utils.json_utils import *
 from ..utils.timer_utils import *
-from ..utils.migoto_utils import Fatal
+from ..utils.migoto_utils import Fatal, MigotoUtils
 from ..utils.obj_utils import ObjUtils
 
 from ..utils.obj_utils import ExtractedObject, ExtractedObjectHelper
@@ -20,6 +20,9 @@ from ..migoto.migoto_format import M_DrawIndexed, TextureReplace,ObjModel
 from ..config.import_config import ImportConfig
 
 from ..generate_mod.m_counter import M_Counter
+from ..generate_mod.category_buffer_writer import CategoryBufferWriter
+from ..utils.memory_utils import MemoryUtils
+from ..properties.properties_generate_mod import Properties_GenerateMod
 from .branch_model import BranchModel
 
 class ComponentModel:
@@ -58,7 +61,13 @@ class DrawIBModel:
         这里是要得到每个Component对应的obj_data_model列表
         在这一步之前，需要对当前DrawIB的所有的obj_data_model填充ib和category_buf_dict属性
         '''
-        self.draw_ib_ordered_obj_data_model_list:list[ObjDataModel] = branch_model.get_buffered_obj_data_model_list_by_draw_ib_and_game_type(draw_ib=draw_ib,d3d11_game_type=self.import_config.d3d11GameType)
+        # 流式导出时在读取obj数据的同时把每个obj的CategoryBuffer依次写入文件并释放
+        use_streaming_export = Properties_GenerateMod.use_streaming_export()
+        streaming_vertex_count = 0
+        if use_streaming_export:
+            self.draw_ib_ordered_obj_data_model_list, streaming_vertex_count = self.get_buffered_obj_data_model_list_streaming(branch_model)
+        else:
+            self.draw_ib_ordered_obj_data_model_list:list[ObjDataModel] = branch_model.get_buffered_obj_data_model_list_by_draw_ib_and_game_type(draw_ib=draw_ib,d3d11_game_type=self.import_config.d3d11GameType)
         self.component_model_list:list[ComponentModel] = []
         self.component_name_component_model_dict:dict[str,ComponentModel] = {}
         for part_name in self.import_config.part_name_list:
@@ -84,64 +93,89 @@ class DrawIBModel:
         self.total_index_count = 0 # 每个DrawIB都有总的IndexCount数，也就是所有的Component中的所有顶点索引数量
         self.__obj_name_drawindexed_dict:dict[str,M_DrawIndexed] = {} 
 
+        # 流式导出时CategoryBuffer已经写入文件
+        if use_streaming_export:
+            self.draw_number = streaming_vertex_count
+
         if GlobalConfig.gamename == "IdentityV":
             self.__read_component_ib_buf_dict_merged()
         else:
             self.__read_component_ib_buf_dict_seperated_single()
-            
-        self.parse_categoryname_bytelist_dict_3()
+
+        if not use_streaming_export:
+            self.parse_categoryname_bytelist_dict_3()
 
         # (5) 导出Buffer文件，Export Index Buffer files, Category Buffer files. (And Export ShapeKey Buffer Files.(WWMI))
         # 用于写出IB时使用
         self.PartName_IBResourceName_Dict = {}
         self.PartName_IBBufferFileName_Dict = {}
+        # 每个IB根据最大索引选择R16_UINT或R32_UINT，写出IB时确定
+        self.PartName_IBFormat_Dict = {}
         self.combine_partname_ib_resource_and_filename_dict()
         self.write_buffer_files()
 
+        MemoryUtils.sample("DrawIB " + self.draw_ib)
+
+    def get_buffered_obj_data_model_list_streaming(self,branch_model:BranchModel):
+        '''
+        按parse_categoryname_bytelist_dict_3相同的顺序，每个obj计算完成后就把它的CategoryBuffer直接追加写入文件，
+        写入后不再保留，返回obj_data_model列表和写入的总顶点数
+        '''
+        with CategoryBufferWriter(draw_ib=self.draw_ib, d3d11GameType=self.d3d11GameType) as category_buffer_writer:
+            draw_ib_ordered_obj_data_model_list = branch_model.get_buffered_obj_data_model_list_by_draw_ib_and_game_type(
+                draw_ib=self.draw_ib,
+                d3d11_game_type=self.d3d11GameType,
+                part_name_list=self.import_config.part_name_list,
+                category_buffer_writer=category_buffer_writer)
+
+        return draw_ib_ordered_obj_data_model_list, category_buffer_writer.vertex_count
 
     def parse_categoryname_bytelist_dict_3(self):
-        processed_obj_name_list = [] # 用于记录已经处理过的obj_name，避免重复处理
+        '''
+        拼接所有obj的CategoryBuffer
+
+        第一遍统计每个obj的顶点数，每个CategoryBuffer只分配一次；第二遍把每个obj的数据直接写到对应的位置，
+        不再每个obj都concatenate一次，obj数量很多时(比如大量头发、饰品的小部件)不会变成平方级别的复制
+        '''
+        processed_obj_name_set = set() # 用于记录已经处理过的obj_name，避免重复处理
 
+        # (1) 按顺序收集需要拼接的CategoryBuffer，并统计总顶点数
+        category_buffer_dict_list:list[dict] = []
+        total_vertex_count = 0
         for component_model in self.component_model_list:
             for obj_model in component_model.final_ordered_draw_obj_model_list:
                 obj_name = obj_model.obj_name
                 # 如果obj_name已经被处理过了，则跳过
-                if obj_name in processed_obj_name_list:
+                if obj_name in processed_obj_name_set:
                     continue
                 
                 # 否则加入已处理列表，并进行处理
-                processed_obj_name_list.append(obj_name)
+                processed_obj_name_set.add(obj_name)
                 # 下面的流程是对当前obj处理得到CategoryBuffer，所以如果obj_name已经被处理过，那就不需要继续处理了
-                category_buffer_list = obj_model.category_buffer_dict
+                category_buffer_dict = obj_model.category_buffer_dict
                 
-                if category_buffer_list is None:
+                if category_buffer_dict is None:
                     print("Can't find vb object for " + obj_name +",skip this obj process.")
                     continue
 
-                for category_name in self.d3d11GameType.OrderedCategoryNameList:
-                    if category_name not in self.__categoryname_bytelist_dict:
-                        self.__categoryname_bytelist_dict[category_name] =  category_buffer_list[category_name]
-                    else:
-                        existing_array = self.__categoryname_bytelist_dict[category_name]
-                        buffer_array = category_buffer_list[category_name]
+                category_buffer_dict_list.append(category_buffer_dict)
+                total_vertex_count += len(category_buffer_dict["Position"])
 
-                        # 确保两个数组都是NumPy数组
-                        existing_array = numpy.asarray(existing_array)
-                        buffer_array = numpy.asarray(buffer_array)
+        # (2) 每个CategoryBuffer都是(顶点数, 步长)形状的uint8数组，一次分配后按顺序填充
+        for category_name in self.d3d11GameType.OrderedCategoryNameList:
+            category_stride = self.d3d11GameType.CategoryStrideDict[category_name]
+            category_array = numpy.empty((total_vertex_count, category_stride), dtype=numpy.uint8)
 
-                        # 使用 concatenate 连接两个数组，确保传递的是一个序列（如列表或元组）
-                        concatenated_array = numpy.concatenate((existing_array, buffer_array))
+            vertex_offset = 0
+            for category_buffer_dict in category_buffer_dict_list:
+                buffer_array = category_buffer_dict[category_name]
+                category_array[vertex_offset:vertex_offset + len(buffer_array)] = buffer_array
+                vertex_offset += len(buffer_array)
 
-                        # 更新字典中的值
-                        self.__categoryname_bytelist_dict[category_name] = concatenated_array
+            self.__categoryname_bytelist_dict[category_name] = category_array
 
-                        # self.__categoryname_bytelist_dict[category_name] = numpy.concatenate(self.__categoryname_bytelist_dict[category_name],category_buffer_list[category_name])
-
-        # 顺便计算一下步长得到总顶点数
-        # print(self.d3d11GameType.CategoryStrideDict)
-        position_stride = self.d3d11GameType.CategoryStrideDict["Position"]
-        position_bytelength = len(self.__categoryname_bytelist_dict["Position"])
-        self.draw_number = int(position_bytelength/position_stride)
+        # 总顶点数就是Position的行数
+        self.draw_number = total_vertex_count
 
     def __read_component_ib_buf_dict_merged(self):
         '''
@@ -156,7 +190,8 @@ class DrawIBModel:
         obj_name_drawindexedobj_cache_dict:dict[str,M_DrawIndexed] = {}
 
         vertex_number_ib_offset = 0
-        ib_buf = []
+        # 每个obj偏移后的IB，全部处理完后一次性拼接
+        offset_ib_list:list[numpy.ndarray] = []
         draw_offset = 0
 
         new_component_model_list = []
@@ -175,19 +210,17 @@ class DrawIBModel:
                 else:
                     # print("processing: " + obj_name)
                     ib = obj_model.ib
-                    # ib的数据类型是list[int]
-                    unique_vertex_number_set = set(ib)
-                    unique_vertex_number = len(unique_vertex_number_set)
 
                     if ib is None:
                         print("Can't find ib object for " + obj_name +",skip this obj process.")
                         continue
-                    
+
+                    # ib是uint32数组，唯一顶点数在去重时已经统计好
+                    unique_vertex_number = obj_model.buffer_data.unique_vertex_count
+
                     # 扩充总IB Buffer
-                    offset_ib = []
-                    for ib_number in ib:
-                        offset_ib.append(ib_number + vertex_number_ib_offset)
-                    ib_buf.extend(offset_ib)
+                    offset_ib = ib + numpy.uint32(vertex_number_ib_offset)
+                    offset_ib_list.append(offset_ib)
                     # Add UniqueVertexNumber to show vertex count in mod ini.
                     # print("Draw Number: " + str(unique_vertex_number))
                     vertex_number_ib_offset = vertex_number_ib_offset + unique_vertex_number
@@ -209,11 +242,14 @@ class DrawIBModel:
             
             component_model.final_ordered_draw_obj_model_list = new_final_ordered_draw_obj_model_list
             new_component_model_list.append(component_model)
-            self.component_name_component_model_dict[component_model.component_name] = copy.deepcopy(component_model)
+            # 之后不会再修改component_model，直接引用即可，不需要复制一份obj_model及其几何数据
+            self.component_name_component_model_dict[component_model.component_name] = component_model
 
         # 累加完毕后draw_offset的值就是总的index_count的值，正好作为WWMI的$object_id
         self.total_index_count = draw_offset
 
+        ib_buf = numpy.concatenate(offset_ib_list) if len(offset_ib_list) != 0 else numpy.empty(0, dtype=numpy.uint32)
+
         for component_model in self.component_model_list:
             # Only export if it's not empty.
             if len(ib_buf) != 0:
@@ -229,7 +265,8 @@ class DrawIBModel:
 
         new_component_model_list = []
         for component_model in self.component_model_list:
-            ib_buf = []
+            # 每个obj偏移后的IB，当前Component处理完后一次性拼接
+            offset_ib_list:list[numpy.ndarray] = []
             offset = 0
 
             new_final_ordered_draw_obj_model_list:list[ObjModel] = [] 
@@ -245,21 +282,18 @@ class DrawIBModel:
                     # print("processing: " + obj_name)
                     ib =  obj_model.ib
 
-                    # ib的数据类型是list[int]
-                    unique_vertex_number_set = set(ib)
-                    unique_vertex_number = len(unique_vertex_number_set)
-
                     if ib is None:
                         print("Can't find ib object for " + obj_name +",skip this obj process.")
                         continue
 
-                    offset_ib = []
-                    for ib_number in ib:
-                        offset_ib.append(ib_number + vertex_number_ib_offset)
+                    # ib是uint32数组，唯一顶点数在去重时已经统计好
+                    unique_vertex_number = obj_model.buffer_data.unique_vertex_count
+
+                    offset_ib = ib + numpy.uint32(vertex_number_ib_offset)
                     
                     # print("Component name: " + component_name)
                     # print("Draw Offset: " + str(vertex_number_ib_offset))
-                    ib_buf.extend(offset_ib)
+                    offset_ib_list.append(offset_ib)
 
                     drawindexed_obj = M_DrawIndexed()
                     draw_number = len(offset_ib)
@@ -286,9 +320,11 @@ class DrawIBModel:
 
             component_model.final_ordered_draw_obj_model_list = new_final_ordered_draw_obj_model_list
             new_component_model_list.append(component_model)
-            self.component_name_component_model_dict[component_model.component_name] = copy.deepcopy(component_model)
+            # 之后不会再修改component_model，直接引用即可，不需要复制一份obj_model及其几何数据
+            self.component_name_component_model_dict[component_model.component_name] = component_model
 
             # Only export if it's not empty.
+            ib_buf = numpy.concatenate(offset_ib_list) if len(offset_ib_list) != 0 else numpy.empty(0, dtype=numpy.uint32)
             if len(ib_buf) == 0:
                 LOG.warning(self.draw_ib + " collection: " + component_model.component_name + " is hide, skip export ib buf.")
             else:
@@ -310,6 +346,7 @@ class DrawIBModel:
             ib_buf_filename = self.draw_ib + "-" + style_part_name + ".buf"
             self.PartName_IBResourceName_Dict[partname] = ib_resource_name
             self.PartName_IBBufferFileName_Dict[partname] = ib_buf_filename
+            self.PartName_IBFormat_Dict[partname] = "DXGI_FORMAT_R32_UINT"
 
     def write_buffer_files(self):
         '''
@@ -327,9 +364,12 @@ class DrawIBModel:
             else:
                 ib_path = buf_output_folder + self.PartName_IBBufferFileName_Dict[partname]
 
-                packed_data = struct.pack(f'<{len(ib_buf)}I', *ib_buf)
+                # 最大索引不超过R16_UINT的范围时按uint16写出，否则按uint32写出，都是小端序一次性写出
+                ib_format = MigotoUtils.get_index_buffer_format(ib_buf)
+                self.PartName_IBFormat_Dict[partname] = ib_format
+                ib_dtype = numpy.dtype(MigotoUtils.get_nptype_from_format(ib_format)).newbyteorder("<")
                 with open(ib_path, 'wb') as ibf:
-                    ibf.write(packed_data) 
+                    numpy.asarray(ib_buf, dtype=ib_dtype).tofile(ibf)
             
         # print("Export Category Buffers::")
         # Export category buffer files.
@@ -342,5 +382,8 @@ class DrawIBModel:
             with open(buf_path, 'wb') as ibf:
                 category_buf.tofile(ibf)
 
+        # 写出后不再需要，DrawIBModel会一直保留到生成ini结束，这里提前释放拼接后的CategoryBuffer
+        self.__categoryname_bytelist_dict = {}
+
 
 
@@ -251,8 +251,6 @@ class ModHSRModel:
 
         '''
         Add Resource IB Section
-
-        We default use R32_UINT because R16_UINT have a very small number limit.
         '''
         for count_i in range(len(draw_ib_model.import_config.part_name_list)):
             partname = draw_ib_model.import_config.part_name_list[count_i]
@@ -262,7 +260,7 @@ class ModHSRModel:
             
             resource_vb_section.append("[" + ib_resource_name + "]")
             resource_vb_section.append("type = Buffer")
-            resource_vb_section.append("format = DXGI_FORMAT_R32_UINT")
+            resource_vb_section.append("format = " + draw_ib_model.PartName_IBFormat_Dict.get(partname,"DXGI_FORMAT_R32_UINT"))
             resource_vb_section.append("filename = Buffer/" + draw_ib_model.draw_ib + "-" + style_partname + ".buf")
             resource_vb_section.new_line()
         
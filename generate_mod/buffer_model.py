@@ -1,26 +1,51 @@
 import bpy
 import numpy
-import collections
 
 from ..migoto.migoto_format import D3D11GameType,ObjModel
 from .mesh_data import MeshData
 from .mesh_format_converter import MeshFormatConverter
-from ..utils.migoto_utils import MigotoUtils, Fatal
-from ..config.main_config import GlobalConfig
+from .export_layout_plan import ExportLayoutPlan, ExportElementPlan
+from ..utils.migoto_utils import Fatal
+from ..utils.obj_utils import ObjUtils
 
-from ..config.main_config import GlobalConfig, GameCategory
+from ..config.main_config import GlobalConfig
 
 class BufferModel:
     '''
     BufferModel用于抽象每一个obj的mesh对象中的数据，加快导出速度。
     '''
+
+    # 向量类型的数据来源对应的Blender属性
+    # Notice: 'undeformed_co' is static, don't need dynamic calculate like 'co' so it is faster.
+    # YYSLS的BINORMAL全部翻转即可得到和游戏中一样的效果，也就是直接读取bitangent
+    VECTOR_SOURCE_ATTRIBUTE_DICT = {
+        "POSITION": "undeformed_co",
+        "NORMAL": "normal",
+        "TANGENT": "tangent",
+        "BINORMAL": "bitangent",
+    }
     
     def __init__(self,d3d11GameType:D3D11GameType) -> None:
         self.d3d11GameType:D3D11GameType = d3d11GameType
+        # 编译好的导出布局，按数据类型和游戏缓存，所有obj共用
+        self.layout_plan:ExportLayoutPlan = ExportLayoutPlan.get_plan(d3d11GameType)
 
         self.dtype = None
         self.element_vertex_ndarray  = None
-        
+
+        # gather_mesh_source_data在主线程中读取的数据
+        self.mesh_loops_length = 0
+        self.mesh_vertices_length = 0
+        self.loop_vertex_indices = None
+        self.loop_indices = None
+        self.element_source_dict = None
+        self.vertex_group_triples = None
+        self.vertex_group_lock_flags = None
+        self.recalculate_tangent = False
+        self.recalculate_color = False
+        self.optimize_vertex_cache = False
+        self.obj_name = ""
+
     def check_and_verify_attributes(self,obj:bpy.types.Object):
         '''
         校验并补全部分元素
@@ -50,497 +75,345 @@ class BufferModel:
                 if not obj.vertex_groups:
                     raise Fatal("your object [" +obj.name + "] need at leat one valid Vertex Group, Please check if your model's Vertex Group is correct.")
 
-    def parse_elementname_ravel_ndarray_dict(self,mesh:bpy.types.Mesh) -> dict:
+    def gather_mesh_source_data(self,obj:bpy.types.Object,mesh:bpy.types.Mesh,normalize_weights:bool = False,vertex_group_triples = None):
         '''
+        读取导出需要的全部bpy数据，必须在主线程中调用
+
         - 注意这里是从mesh.loops中获取数据，而不是从mesh.vertices中获取数据
         - 所以后续使用的时候要用mesh.loop里的索引来进行获取数据
 
-        TODO 
-        目前的权重导出架构，无法处理存在多个BLENDWEIGHTS的清空
-        需要重新开发权重导出代码
+        读取完之后BufferModel不再持有任何bpy对象，后续的格式转换、权重量化、去重和重计算
+        都只使用这里读取出的numpy数组，可以放到线程池中执行
+
+        normalize_weights为True时记录每个顶点组的锁定状态，在计算权重时按Normalize All的规则规格化，
+        和之前一样，所有顶点组都被锁定时不做规格化
+
+        vertex_group_triples是已经从同一个mesh读取过的顶点组数据，传入时不再重复读取
         '''
+        layout_plan = self.layout_plan
 
         mesh_loops = mesh.loops
         mesh_loops_length = len(mesh_loops)
-        mesh_vertices = mesh.vertices
-        mesh_vertices_length = len(mesh.vertices)
-
-        loop_vertex_indices = numpy.empty(mesh_loops_length, dtype=int)
-        mesh_loops.foreach_get("vertex_index", loop_vertex_indices)
-
-        self.dtype = numpy.dtype([])
-
-        blendweights_formatlen = 0
-        for d3d11_element_name in self.d3d11GameType.OrderedFullElementList:
-            d3d11_element = self.d3d11GameType.ElementNameD3D11ElementDict[d3d11_element_name]
-            np_type = MigotoUtils.get_nptype_from_format(d3d11_element.Format)
-            format_len = MigotoUtils.format_components(d3d11_element.Format)
-
-            # 因为YYSLS出现了多个BLENDWEIGHTS的情况，所以这里只能用这个StartWith判断
-            if d3d11_element_name.startswith("BLENDWEIGHT"):
-                blendweights_formatlen = format_len
-
-            # XXX 长度为1时必须手动指定为(1,)否则会变成1维数组
-            if format_len == 1:
-                self.dtype = numpy.dtype(self.dtype.descr + [(d3d11_element_name, (np_type, (1,)))])
-            else:
-                self.dtype = numpy.dtype(self.dtype.descr + [(d3d11_element_name, (np_type, format_len))])
+        self.mesh_loops_length = mesh_loops_length
 
-        self.element_vertex_ndarray = numpy.zeros(mesh_loops_length,dtype=self.dtype)
+        self.loop_vertex_indices = numpy.empty(mesh_loops_length, dtype=numpy.int64)
+        mesh_loops.foreach_get("vertex_index", self.loop_vertex_indices)
 
+        self.loop_indices = self.get_polygon_loop_indices(mesh)
 
-        mesh_data = MeshData(mesh=mesh)
+        # 每个Element转换前的原始数据，key是ElementName
+        self.element_source_dict = {}
+        for element_plan in layout_plan.element_plan_list:
+            d3d11_element_name = element_plan.element_name
+            source = element_plan.source
 
-        normalize_weights = "Blend" in self.d3d11GameType.OrderedCategoryNameList
-
-        blendweights_dict, blendindices_dict = mesh_data.get_blendweights_blendindices_v1(normalize_weights = normalize_weights)
-
-
-        # 对每一种Element都获取对应的数据
-        for d3d11_element_name in self.d3d11GameType.OrderedFullElementList:
-            d3d11_element = self.d3d11GameType.ElementNameD3D11ElementDict[d3d11_element_name]
-
-            if d3d11_element_name == 'POSITION':
-                # TimerUtils.Start("Position Get")
-                vertex_coords = numpy.empty(mesh_vertices_length * 3, dtype=numpy.float32)
-                # Notice: 'undeformed_co' is static, don't need dynamic calculate like 'co' so it is faster.
-                mesh_vertices.foreach_get('undeformed_co', vertex_coords)
-                
-                positions = vertex_coords.reshape(-1, 3)[loop_vertex_indices]
-                if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                    positions = positions.astype(numpy.float16)
-                    new_array = numpy.zeros((positions.shape[0], 4))
-                    new_array[:, :3] = positions
-                    positions = new_array
-
-                self.element_vertex_ndarray[d3d11_element_name] = positions
-                # TimerUtils.End("Position Get") # 0:00:00.057535 
-
-            elif d3d11_element_name == 'NORMAL':
-                if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                    result = numpy.ones(mesh_loops_length * 4, dtype=numpy.float32)
-                    normals = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', normals)
-                    result[0::4] = normals[0::3]
-                    result[1::4] = normals[1::3]
-                    result[2::4] = normals[2::3]
-                    result = result.reshape(-1, 4)
-
-                    result = result.astype(numpy.float16)
-                    self.element_vertex_ndarray[d3d11_element_name] = result
-
-                elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                    result = numpy.ones(mesh_loops_length * 4, dtype=numpy.float32)
-                    normals = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', normals)
-                    result[0::4] = normals[0::3]
-                    result[1::4] = normals[1::3]
-                    result[2::4] = normals[2::3]
-                    
-
-                    if GlobalConfig.get_game_category() == GameCategory.UnrealVS or GlobalConfig.get_game_category() == GameCategory.UnrealCS:
-                        bitangent_signs = numpy.empty(mesh_loops_length, dtype=numpy.float32)
-                        mesh_loops.foreach_get("bitangent_sign", bitangent_signs)
-                        result[3::4] = bitangent_signs * -1
-
-                        # print("Unreal: Set NORMAL.W to bitangent_sign")
-                    
-                    result = result.reshape(-1, 4)
-
-                    self.element_vertex_ndarray[d3d11_element_name] = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_snorm(result)
-
-
-                elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                    # 因为法线数据是[-1,1]如果非要导出成UNORM，那一定是进行了归一化到[0,1]
-                    
-                    result = numpy.ones(mesh_loops_length * 4, dtype=numpy.float32)
-                    
-
-                    # 燕云十六声的最后一位w固定为0
-                    if GlobalConfig.gamename == "YYSLS":
-                        result = numpy.zeros(mesh_loops_length * 4, dtype=numpy.float32)
-                        
-                    normals = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', normals)
-                    result[0::4] = normals[0::3]
-                    result[1::4] = normals[1::3]
-                    result[2::4] = normals[2::3]
-                    result = result.reshape(-1, 4)
-                    
-                    # if GlobalConfig.gamename == "YYSLS":
-                    #     result *= -1
-
-                    # 归一化 (此处感谢 球球 的代码开发)
-                    def DeConvert(nor):
-                        return (nor + 1) * 0.5
-
-                    for i in range(len(result)):
-                        result[i][0] = DeConvert(result[i][0])
-                        result[i][1] = DeConvert(result[i][1])
-                        result[i][2] = DeConvert(result[i][2])
-
-                    self.element_vertex_ndarray[d3d11_element_name] = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm(result)
-                
-                else:
-                    result = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                    mesh_loops.foreach_get('normal', result)
-                    # 将一维数组 reshape 成 (mesh_loops_length, 3) 形状的二维数组
-                    result = result.reshape(-1, 3)
-                    self.element_vertex_ndarray[d3d11_element_name] = result
-
-
-            elif d3d11_element_name == 'TANGENT':
-
-                result = numpy.empty(mesh_loops_length * 4, dtype=numpy.float32)
-
-                # 使用 foreach_get 批量获取切线和副切线符号数据
-                tangents = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                mesh_loops.foreach_get("tangent", tangents)
-                # 将切线分量放置到输出数组中
-                result[0::4] = tangents[0::3]  # x 分量
-                result[1::4] = tangents[1::3]  # y 分量
-                result[2::4] = tangents[2::3]  # z 分量
-
-                if GlobalConfig.gamename == "YYSLS":
-                    # 燕云十六声的TANGENT.w固定为1
-                    tangent_w = numpy.ones(mesh_loops_length, dtype=numpy.float32)
-                    # TODO 这里仍然不知道是什么，可能是平滑法线？
-                    # result[0::4] *= -1
-                    # result[1::4] *= -1
-                    # result[2::4] *= -1
-                    result[3::4] = tangent_w
-                elif GlobalConfig.get_game_category() == GameCategory.UnityCS or GlobalConfig.get_game_category() == GameCategory.UnityVS:
-                    bitangent_signs = numpy.empty(mesh_loops_length, dtype=numpy.float32)
-                    mesh_loops.foreach_get("bitangent_sign", bitangent_signs)
-                    # XXX 将副切线符号乘以 -1
-                    # 这里翻转（翻转指的就是 *= -1）是因为如果要确保Unity游戏中渲染正确，必须翻转TANGENT的W分量
-                    bitangent_signs *= -1
-                    result[3::4] = bitangent_signs  # w 分量 (副切线符号)
-                elif GlobalConfig.get_game_category() == GameCategory.UnrealVS or GlobalConfig.get_game_category() == GameCategory.UnrealCS:
-                    # Unreal引擎中这里要填写固定的1
-                    tangent_w = numpy.ones(mesh_loops_length, dtype=numpy.float32)
-                    result[3::4] = tangent_w
-                
-                # 重塑 output_tangents 成 (mesh_loops_length, 4) 形状的二维数组
-                result = result.reshape(-1, 4)
-
-                if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                    result = result.astype(numpy.float16)
-
-                elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                    result = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_snorm(result)
-
-                elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                    result = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm(result)
-                
-                # 第五人格格式
-                elif d3d11_element.Format == "R32G32B32_FLOAT":
-                    result = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-
-                    result[0::3] = tangents[0::3]  # x 分量
-                    result[1::3] = tangents[1::3]  # y 分量
-                    result[2::3] = tangents[2::3]  # z 分量
-
-                    result = result.reshape(-1, 3)
-
-                # 燕云十六声格式
-                elif d3d11_element.Format == 'R16G16B16A16_SNORM':
-                    result = MeshFormatConverter.convert_4x_float32_to_r16g16b16a16_snorm(result)
-                    
-
-                self.element_vertex_ndarray[d3d11_element_name] = result
-
-            #  YYSLS需要BINORMAL导出，前提是先把这些代码差分简化，因为YYSLS的TANGENT和NORMAL的.w都是固定的1
-            elif d3d11_element_name.startswith('BINORMAL'):
-                result = numpy.empty(mesh_loops_length * 4, dtype=numpy.float32)
-
-                # 使用 foreach_get 批量获取切线和副切线符号数据
-                binormals = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
-                mesh_loops.foreach_get("bitangent", binormals)
-                # 将切线分量放置到输出数组中
-                # BINORMAL全部翻转即可得到和YYSLS游戏中一样的效果。
-                result[0::4] = binormals[0::3]  # x 分量
-                result[1::4] = binormals[1::3]   # y 分量
-                result[2::4] = binormals[2::3]  # z 分量
-                binormal_w = numpy.ones(mesh_loops_length, dtype=numpy.float32)
-                result[3::4] = binormal_w
-                result = result.reshape(-1, 4)
-
-                if d3d11_element.Format == 'R16G16B16A16_SNORM':
-                    #  燕云十六声格式
-                    result = MeshFormatConverter.convert_4x_float32_to_r16g16b16a16_snorm(result)
-                    
-                self.element_vertex_ndarray[d3d11_element_name] = result
-            elif d3d11_element_name.startswith('COLOR'):
-                # TimerUtils.Start("Get COLOR")
+            if source in self.VECTOR_SOURCE_ATTRIBUTE_DICT:
+                self.element_source_dict[d3d11_element_name] = self.get_loop_vector_ndarray(mesh, self.VECTOR_SOURCE_ATTRIBUTE_DICT[source], element_plan)
 
+            elif source == "COLOR":
                 if d3d11_element_name in mesh.vertex_colors:
                     # 因为COLOR属性存储在Blender里固定是float32类型所以这里只能用numpy.float32
                     result = numpy.zeros(mesh_loops_length, dtype=(numpy.float32, 4))
                     mesh.vertex_colors[d3d11_element_name].data.foreach_get("color", result.ravel())
-                    
-                    if d3d11_element.Format == 'R16G16B16A16_FLOAT':
-                        result = result.astype(numpy.float16)
-                    elif d3d11_element.Format == "R16G16_FLOAT":
-                        result = result[:, :2]
-                    elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                        result = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm(result)
-
-                    self.element_vertex_ndarray[d3d11_element_name] = result
-
-                # TimerUtils.End("Get COLOR") # 0:00:00.030605 
-            elif d3d11_element_name.startswith('TEXCOORD') and d3d11_element.Format.endswith('FLOAT'):
-                # TimerUtils.Start("GET TEXCOORD")
+                    self.element_source_dict[d3d11_element_name] = result
+
+            elif source == "TEXCOORD":
                 for uv_name in ('%s.xy' % d3d11_element_name, '%s.zw' % d3d11_element_name):
                     if uv_name in mesh.uv_layers:
                         uvs_array = numpy.empty(mesh_loops_length ,dtype=(numpy.float32,2))
                         mesh.uv_layers[uv_name].data.foreach_get("uv",uvs_array.ravel())
-                        uvs_array[:,1] = 1.0 - uvs_array[:,1]
+                        self.element_source_dict[d3d11_element_name] = uvs_array
+
+        self.mesh_vertices_length = len(mesh.vertices)
+        self.vertex_group_triples = None
+        self.vertex_group_lock_flags = None
+        if layout_plan.need_blend_data:
+            if vertex_group_triples is None:
+                vertex_group_triples = MeshData(mesh=mesh).get_vertex_group_triples()
+            self.vertex_group_triples = vertex_group_triples
+            if normalize_weights and not ObjUtils.is_all_vertex_groups_locked(obj):
+                self.vertex_group_lock_flags = ObjUtils.get_vertex_group_lock_flags(obj)
+
+        self.recalculate_tangent = MeshFormatConverter.allow_recalculate_tangent(obj)
+        self.recalculate_color = MeshFormatConverter.allow_recalculate_color(obj)
+
+    def parse_elementname_ravel_ndarray_dict(self):
+        '''
+        把gather_mesh_source_data读取的原始数据转换为目标格式，写入element_vertex_ndarray
+        不访问bpy，可以在线程池中执行
 
-                        if d3d11_element.Format == 'R16G16_FLOAT':
-                            uvs_array = uvs_array.astype(numpy.float16)
-                        
-                        # 重塑 uvs_array 成 (mesh_loops_length, 2) 形状的二维数组
-                        # uvs_array = uvs_array.reshape(-1, 2)
+        dtype、每个元素的数据来源和转换方式都来自缓存的ExportLayoutPlan
+        存在多个BLENDWEIGHTS时，按SemanticIndex依次取每个顶点权重最大的4个、第5到8个……顶点组
+        '''
+        layout_plan = self.layout_plan
+
+        self.dtype = layout_plan.dtype
+        self.element_vertex_ndarray = numpy.zeros(self.mesh_loops_length,dtype=self.dtype)
+
+        blendweights_dict, blendindices_dict = {}, {}
+        quantized_blendweights = None
+        if layout_plan.need_blend_data:
+            blendweights_dict, blendindices_dict = MeshData.calc_blendweights_blendindices(
+                vertex_group_triples=self.vertex_group_triples,
+                loop_vertex_indices=self.loop_vertex_indices,
+                mesh_vertices_length=self.mesh_vertices_length,
+                blend_semantic_count=layout_plan.blend_semantic_count,
+                vertex_group_lock_flags=self.vertex_group_lock_flags)
+
+        # 对每一种Element都转换对应的数据
+        for element_plan in layout_plan.element_plan_list:
+            d3d11_element_name = element_plan.element_name
+            source = element_plan.source
+            source_data = self.element_source_dict.get(d3d11_element_name, None)
+
+            if source in self.VECTOR_SOURCE_ATTRIBUTE_DICT:
+                if element_plan.remap_signed_to_unsigned:
+                    source_data = MeshFormatConverter.remap_signed_to_unsigned(source_data)
+                self.element_vertex_ndarray[d3d11_element_name] = element_plan.converter(source_data)
+
+            elif source == "COLOR":
+                if source_data is not None:
+                    self.element_vertex_ndarray[d3d11_element_name] = element_plan.converter(source_data)
+
+            elif source == "TEXCOORD":
+                if source_data is not None:
+                    source_data[:,1] = 1.0 - source_data[:,1]
+                    self.element_vertex_ndarray[d3d11_element_name] = element_plan.converter(source_data)
+
+            elif source == "BLENDINDICES":
+                blendindices = blendindices_dict.get(element_plan.d3d11_element.SemanticIndex,None)
+                self.element_vertex_ndarray[d3d11_element_name] = element_plan.converter(blendindices)
+
+            elif source == "BLENDWEIGHT":
+                blendweights = blendweights_dict.get(element_plan.d3d11_element.SemanticIndex, None)
+                self.element_vertex_ndarray[d3d11_element_name] = element_plan.converter(blendweights)
+
+            elif source == "BLENDWEIGHT_UNORM":
+                # 存在多个BLENDWEIGHTS时，要把所有权重拼成一行整体量化，保证每个顶点的全部权重加起来是255，而不是每4个分别是255
+                if quantized_blendweights is None:
+                    quantized_blendweights = element_plan.converter(numpy.hstack([blendweights_dict[semantic_index] for semantic_index in range(layout_plan.blend_semantic_count)]))
+                semantic_index = element_plan.d3d11_element.SemanticIndex
+                self.element_vertex_ndarray[d3d11_element_name] = quantized_blendweights[:, semantic_index * 4:semantic_index * 4 + 4]
+
+        # 原始数据已经全部转换完成，不再需要
+        self.element_source_dict = None
+        self.vertex_group_triples = None
+
+    def get_loop_vector_ndarray(self,mesh:bpy.types.Mesh,attribute_name:str,element_plan:ExportElementPlan) -> numpy.ndarray:
+        '''
+        读取每个loop的三分量向量数据，按照element_plan组装成(loop数, 3)或者(loop数, 4)的float32数组
 
-                        self.element_vertex_ndarray[d3d11_element_name] = uvs_array 
-                # TimerUtils.End("GET TEXCOORD")
-            
-                        
-            elif d3d11_element_name.startswith('BLENDINDICES'):
-                blendindices = blendindices_dict.get(d3d11_element.SemanticIndex,None)
-                
-                # if blendindices is None:
-                #     blendindices = blendindices_dict.get(0,None)
-
-                if d3d11_element.Format == "R32G32B32A32_SINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices
-                elif d3d11_element.Format == "R16G16B16A16_UINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices
-                elif d3d11_element.Format == "R32G32B32A32_UINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices
-                elif d3d11_element.Format == "R32G32_UINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices[:, :2]
-                elif d3d11_element.Format == "R32_UINT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices[:, :1]
-                elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                    self.element_vertex_ndarray[d3d11_element_name] = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_snorm(blendindices)
-                elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                    self.element_vertex_ndarray[d3d11_element_name] = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm(blendindices)
-                elif d3d11_element.Format == 'R8G8B8A8_UINT':
-                    blendindices.astype(numpy.uint8)
-                    self.element_vertex_ndarray[d3d11_element_name] = blendindices
-                
-            elif d3d11_element_name.startswith('BLENDWEIGHT'):
-                blendweights = blendweights_dict.get(d3d11_element.SemanticIndex, None)
-
-                if d3d11_element.Format == "R32G32B32A32_FLOAT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendweights
-                elif d3d11_element.Format == "R32G32_FLOAT":
-                    self.element_vertex_ndarray[d3d11_element_name] = blendweights[:, :2]
-                elif d3d11_element.Format == 'R8G8B8A8_SNORM':
-                    # print("BLENDWEIGHT R8G8B8A8_SNORM")
-                    self.element_vertex_ndarray[d3d11_element_name] = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_snorm(blendweights)
-                elif d3d11_element.Format == 'R8G8B8A8_UNORM':
-                    # print("BLENDWEIGHT R8G8B8A8_UNORM")
-                    self.element_vertex_ndarray[d3d11_element_name] = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm_blendweights(blendweights)
-
-    def calc_index_vertex_buffer_girlsfrontline2(self,obj,mesh:bpy.types.Mesh)->ObjModel:
+        undeformed_co存储在顶点上，需要通过loop的vertex_index展开到每个loop上，其它属性直接从loop上读取
+        '''
+        mesh_loops = mesh.loops
+        mesh_loops_length = len(mesh_loops)
+
+        if attribute_name == "undeformed_co":
+            vertex_coords = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+            mesh.vertices.foreach_get(attribute_name, vertex_coords)
+            vectors = vertex_coords.reshape(-1, 3)[self.loop_vertex_indices]
+        else:
+            vectors = numpy.empty(mesh_loops_length * 3, dtype=numpy.float32)
+            mesh_loops.foreach_get(attribute_name, vectors)
+            vectors = vectors.reshape(-1, 3)
+
+        if element_plan.component_count == 3:
+            return vectors
+
+        # 未指定W的填充方式时不填充，和之前一样
+        if element_plan.w_fill == "one":
+            result = numpy.ones((mesh_loops_length, 4), dtype=numpy.float32)
+        elif element_plan.w_fill == "zero":
+            result = numpy.zeros((mesh_loops_length, 4), dtype=numpy.float32)
+        else:
+            result = numpy.empty((mesh_loops_length, 4), dtype=numpy.float32)
+
+        if element_plan.w_fill == "neg_bitangent_sign":
+            bitangent_signs = numpy.empty(mesh_loops_length, dtype=numpy.float32)
+            mesh_loops.foreach_get("bitangent_sign", bitangent_signs)
+            result[:, 3] = bitangent_signs * -1
+
+        result[:, :3] = vectors
+        return result
+
+    def calc_index_vertex_buffer_girlsfrontline2(self)->ObjModel:
         '''
         计算IndexBuffer和CategoryBufferDict并返回
 
-        这里是速度瓶颈，23万顶点情况下测试，前面的获取mesh数据只用了1.5秒
-        但是这里两个步骤加起来用了6秒，占了4/5运行时间。
-        不过暂时也够用了，先不管了。
+        保持相同顶点数时，让POSITION和NORMAL都相同的顶点使用相同的TANGENT值来避免增加索引数和顶点数。
+        这里我们使用每组顶点第一次出现的TANGENT值，分组和广播都是整体数组操作。
         '''
         # TimerUtils.Start("Calc IB VB")
         # (1) 统计模型的索引和唯一顶点
-        '''
-        保持相同顶点数时，让相同顶点使用相同的TANGENT值来避免增加索引数和顶点数。
-        这里我们使用每个顶点第一次出现的TANGENT值。
-        效率比下面的低50%，不过能使用这个选项的场景只有导入直接导出原模型，所以总运行时间基本都在0.4秒以内，用户感觉不到差距的，没问题。
-        '''
-        # 创建一个空列表用于存储最终的结果
-        ib = []
-        indexed_vertices = collections.OrderedDict()
-        # 一个字典确保每个符合条件的position只出现过一次
-        position_normal_sharedtangent_dict = {}
-        # 遍历每个多边形（polygon）
-        for poly in mesh.polygons:
-            # 创建一个临时列表用于存储当前多边形的索引
-            vertex_indices = []
-            
-            # 遍历当前多边形中的每一个环（loop），根据多边形的起始环和环总数
-            for blender_lvertex in mesh.loops[poly.loop_start:poly.loop_start + poly.loop_total]:
-                vertex_data_get = self.element_vertex_ndarray[blender_lvertex.index].copy()
-                poskey = tuple(vertex_data_get['POSITION'] + vertex_data_get['NORMAL'])
-                if poskey in position_normal_sharedtangent_dict:
-                    tangent_var = position_normal_sharedtangent_dict[poskey]
-                    vertex_data_get['TANGENT'] = tangent_var
-                else:
-                    tangent_var = vertex_data_get['TANGENT']
-                    position_normal_sharedtangent_dict[poskey] = tangent_var
-                
-                vertex_data = vertex_data_get.tobytes()
-                index = indexed_vertices.setdefault(vertex_data, len(indexed_vertices))
-                vertex_indices.append(index)
-            
-            # 将当前多边形的顶点索引列表添加到最终结果列表中
-            ib.append(vertex_indices)
-
-        # print("长度：")
-        # print(len(position_normal_sharedtangent_dict))
-            
-        flattened_ib = [item for sublist in ib for item in sublist]
+        loop_indices = self.loop_indices
+        loop_vertex_ndarray = self.element_vertex_ndarray[loop_indices]
+        loop_length = len(loop_vertex_ndarray)
+
+        # 把POSITION和NORMAL拼接成每行一个的分组key
+        # 加0.0是为了把-0.0变成0.0，和之前用tuple做字典key时按数值比较的行为一致
+        position_normal_key = numpy.ascontiguousarray(numpy.hstack((
+            loop_vertex_ndarray['POSITION'].reshape(loop_length, -1),
+            loop_vertex_ndarray['NORMAL'].reshape(loop_length, -1)
+        )) + 0.0)
+        position_normal_key = position_normal_key.view(numpy.dtype((numpy.void, position_normal_key.dtype.itemsize * position_normal_key.shape[1]))).reshape(-1)
+
+        # 每组第一次出现的TANGENT广播到组内所有loop上
+        _, group_first_indices, group_inverse = numpy.unique(position_normal_key, return_index=True, return_inverse=True)
+        loop_vertex_ndarray['TANGENT'] = loop_vertex_ndarray['TANGENT'][group_first_indices[group_inverse.reshape(-1)]]
+
+        ib, indexed_vertices, _ = self.deduplicate_vertex_ndarray(loop_vertex_ndarray)
         # TimerUtils.End("Calc IB VB")
 
         # (2) 转换为CategoryBufferDict
-        # TimerUtils.Start("Calc CategoryBuffer")
-        category_stride_dict = self.d3d11GameType.get_real_category_stride_dict()
-        category_buffer_dict:dict[str,list] = {}
-        for categoryname,category_stride in self.d3d11GameType.CategoryStrideDict.items():
-            category_buffer_dict[categoryname] = []
-
-        data_matrix = numpy.array([numpy.frombuffer(byte_data,dtype=numpy.uint8) for byte_data in indexed_vertices])
-        stride_offset = 0
-        for categoryname,category_stride in category_stride_dict.items():
-            category_buffer_dict[categoryname] = data_matrix[:,stride_offset:stride_offset + category_stride].flatten()
-            stride_offset += category_stride
+        category_buffer_dict = self.get_category_buffer_dict(indexed_vertices)
 
         obj_model = ObjModel()
-        obj_model.ib = flattened_ib
+        obj_model.ib = ib
         obj_model.category_buffer_dict = category_buffer_dict
-        obj_model.index_vertex_id_dict = None
+        obj_model.index_vertex_id_ndarray = None
         return obj_model
 
-    def calc_index_vertex_buffer_wwmi(self,obj,mesh:bpy.types.Mesh)->ObjModel:
+    def calc_index_vertex_buffer_wwmi(self)->ObjModel:
         '''
         计算IndexBuffer和CategoryBufferDict并返回
 
-        这里是速度瓶颈，23万顶点情况下测试，前面的获取mesh数据只用了1.5秒
-        但是这里两个步骤加起来用了6秒，占了4/5运行时间。
-        不过暂时也够用了，先不管了。
+        WWMI额外需要每个顶点索引对应的Blender顶点ID，用于导出形态键
+        这里返回的index_vertex_id_ndarray中，下标是顶点索引，值是顶点ID
         '''
         # TimerUtils.Start("Calc IB VB")
         # (1) 统计模型的索引和唯一顶点
+        loop_indices = self.loop_indices
+        ib, indexed_vertices, _ = self.deduplicate_vertex_ndarray(self.element_vertex_ndarray[loop_indices])
 
-        # 创建一个空列表用于存储最终的结果
-        index_vertex_id_dict = {}
-        ib = []
-        indexed_vertices = collections.OrderedDict()
-        # 一个字典确保每个符合条件的position只出现过一次
-        # 遍历每个多边形（polygon）
-        for poly in mesh.polygons:
-            # 创建一个临时列表用于存储当前多边形的索引
-            vertex_indices = []
-            
-            # 遍历当前多边形中的每一个环（loop），根据多边形的起始环和环总数
-            for blender_lvertex in mesh.loops[poly.loop_start:poly.loop_start + poly.loop_total]:
-                vertex_data_get = self.element_vertex_ndarray[blender_lvertex.index].copy()
-                vertex_data = vertex_data_get.tobytes()
-                index = indexed_vertices.setdefault(vertex_data, len(indexed_vertices))
-                vertex_indices.append(index)
-                index_vertex_id_dict[index] = blender_lvertex.vertex_index
-            
-            # 将当前多边形的顶点索引列表添加到最终结果列表中
-            ib.append(vertex_indices)
+        # 计算每个顶点索引对应的顶点ID
+        # 多个loop去重后可能对应同一个顶点索引，之前逐个loop写入字典时是最后一次写入生效，所以这里取每个索引最后一次出现的位置
+        loop_vertex_indices = self.loop_vertex_indices[loop_indices]
 
-        # print("长度：")
-        # print(len(position_normal_sharedtangent_dict))
-            
-        flattened_ib = [item for sublist in ib for item in sublist]
+        _, reversed_first_indices = numpy.unique(ib[::-1], return_index=True)
+        index_vertex_id_ndarray = loop_vertex_indices[len(ib) - 1 - reversed_first_indices]
         # TimerUtils.End("Calc IB VB")
 
         # (2) 转换为CategoryBufferDict
-        # TimerUtils.Start("Calc CategoryBuffer")
-        category_stride_dict = self.d3d11GameType.get_real_category_stride_dict()
-        category_buffer_dict:dict[str,list] = {}
-        for categoryname,category_stride in self.d3d11GameType.CategoryStrideDict.items():
-            category_buffer_dict[categoryname] = []
-
-        data_matrix = numpy.array([numpy.frombuffer(byte_data,dtype=numpy.uint8) for byte_data in indexed_vertices])
-        stride_offset = 0
-        for categoryname,category_stride in category_stride_dict.items():
-            category_buffer_dict[categoryname] = data_matrix[:,stride_offset:stride_offset + category_stride].flatten()
-            stride_offset += category_stride
+        category_buffer_dict = self.get_category_buffer_dict(indexed_vertices)
 
         obj_model = ObjModel()
-        # obj_model.ib = flattened_ib
 
+        # 每个三角形的第一个和第三个索引互换，原地翻转面朝向
         print("导出WWMI Mod时，翻转面朝向")
-        flipped_indices = []
-        print(flattened_ib[0],flattened_ib[1],flattened_ib[2])
-        for i in range(0, len(flattened_ib), 3):
-            triangle = flattened_ib[i:i+3]
-            flipped_triangle = triangle[::-1]
-            flipped_indices.extend(flipped_triangle)
-        print(flipped_indices[0],flipped_indices[1],flipped_indices[2])
+        triangles = ib.reshape(-1, 3)
+        triangles[:, [0, 2]] = triangles[:, [2, 0]]
 
-        obj_model.ib = flipped_indices
+        obj_model.ib = ib
 
         obj_model.category_buffer_dict = category_buffer_dict
-        obj_model.index_vertex_id_dict = index_vertex_id_dict
+        obj_model.index_vertex_id_ndarray = index_vertex_id_ndarray
         return obj_model
 
-    def calc_index_vertex_buffer_universal(self,obj,mesh:bpy.types.Mesh)->ObjModel:
+    def get_category_buffer_dict(self,unique_vertex_ndarray:numpy.ndarray) -> dict:
+        '''
+        从去重后的结构化顶点数组中，按照布局中每个Category的偏移和步长切分出每个Category的Buffer
+
+        返回的每个Buffer都是(顶点数, 步长)形状的uint8视图，不会复制顶点数据，可以直接tofile写出
+        '''
+        unique_vertex_ndarray = numpy.ascontiguousarray(unique_vertex_ndarray)
+        vertex_byte_matrix = unique_vertex_ndarray.view(numpy.uint8).reshape(len(unique_vertex_ndarray), unique_vertex_ndarray.dtype.itemsize)
+
+        category_buffer_dict:dict[str,numpy.ndarray] = {}
+        for categoryname,stride_offset,category_stride in self.layout_plan.category_offset_list:
+            category_buffer_dict[categoryname] = vertex_byte_matrix[:, stride_offset:stride_offset + category_stride]
+        return category_buffer_dict
+
+    def get_polygon_loop_indices(self,mesh:bpy.types.Mesh):
+        '''
+        按照mesh.polygons的顺序，依次展开每个多边形的loop索引
+        等价于 for poly in mesh.polygons: for loop in mesh.loops[poly.loop_start:poly.loop_start + poly.loop_total]
+        '''
+        polygons_length = len(mesh.polygons)
+        loop_starts = numpy.empty(polygons_length, dtype=numpy.int64)
+        loop_totals = numpy.empty(polygons_length, dtype=numpy.int64)
+        mesh.polygons.foreach_get("loop_start", loop_starts)
+        mesh.polygons.foreach_get("loop_total", loop_totals)
+
+        # 每个loop在展开后的位置减去其所属多边形的展开起点，再加上该多边形的loop_start
+        polygon_offsets = numpy.cumsum(loop_totals) - loop_totals
+        loop_indices = numpy.arange(int(loop_totals.sum()), dtype=numpy.int64)
+        loop_indices += numpy.repeat(loop_starts - polygon_offsets, loop_totals)
+        return loop_indices
+
+    @classmethod
+    def mesh_has_non_triangles(cls,mesh:bpy.types.Mesh) -> bool:
+        '''
+        是否存在不是三角面的多边形
+        '''
+        polygons_length = len(mesh.polygons)
+        loop_totals = numpy.empty(polygons_length, dtype=numpy.int64)
+        mesh.polygons.foreach_get("loop_total", loop_totals)
+        return bool(numpy.any(loop_totals != 3))
+
+    @classmethod
+    def deduplicate_vertex_ndarray(cls,vertex_ndarray:numpy.ndarray):
+        '''
+        对结构化的顶点数组整体去重，替代逐个loop执行tobytes()再OrderedDict.setdefault的做法。
+
+        每一行视为一个定长的void值，逐字节比较，所以去重结果与tobytes()作为key时完全一致。
+        唯一顶点按照第一次出现的顺序排列，与OrderedDict的插入顺序一致。
+
+        返回值:
+        - ib: 每个输入行对应的唯一顶点索引，uint32数组
+        - unique_vertex_ndarray: 按第一次出现顺序排列的唯一顶点
+        - first_indices: 每个唯一顶点第一次出现时在输入中的行号
+        '''
+        vertex_ndarray = numpy.ascontiguousarray(vertex_ndarray)
+        void_keys = vertex_ndarray.view(numpy.dtype((numpy.void, vertex_ndarray.dtype.itemsize)))
+
+        # numpy.unique返回的是按字节排序的结果，return_index得到的是每个唯一值第一次出现的位置
+        _, sorted_first_indices, sorted_inverse = numpy.unique(void_keys, return_index=True, return_inverse=True)
+        sorted_inverse = sorted_inverse.reshape(-1)
+
+        # 把按字节排序的唯一值重新排列为按第一次出现的顺序
+        first_seen_order = numpy.argsort(sorted_first_indices, kind="stable")
+        # IndexBuffer最终以uint32写出，这里直接生成uint32的索引，之后的偏移和写出都不再转换
+        sorted_to_first_seen = numpy.empty(len(first_seen_order), dtype=numpy.uint32)
+        sorted_to_first_seen[first_seen_order] = numpy.arange(len(first_seen_order), dtype=numpy.uint32)
+
+        ib = sorted_to_first_seen[sorted_inverse]
+        first_indices = sorted_first_indices[first_seen_order]
+        unique_vertex_ndarray = vertex_ndarray[first_indices]
+        return ib, unique_vertex_ndarray, first_indices
+
+    def calc_index_vertex_buffer_universal(self)->ObjModel:
         '''
         计算IndexBuffer和CategoryBufferDict并返回
 
-        这里是速度瓶颈，23万顶点情况下测试，前面的获取mesh数据只用了1.5秒
-        但是这里两个步骤加起来用了6秒，占了4/5运行时间。
-        不过暂时也够用了，先不管了。
+        之前这里逐个loop执行tobytes()并放入OrderedDict去重，23万顶点时占了4/5的运行时间，
+        现在改为对整个loop数组一次性去重，结果与之前逐字节一致。
         '''
         # TimerUtils.Start("Calc IB VB")
         # (1) 统计模型的索引和唯一顶点
-        '''
-        不保持相同顶点时，仍然使用经典而又快速的方法
-        '''
-        indexed_vertices = collections.OrderedDict()
-        ib = [[indexed_vertices.setdefault(self.element_vertex_ndarray[blender_lvertex.index].tobytes(), len(indexed_vertices))
-                for blender_lvertex in mesh.loops[poly.loop_start:poly.loop_start + poly.loop_total]
-                    ]for poly in mesh.polygons] 
-            
-        flattened_ib = [item for sublist in ib for item in sublist]
+        loop_indices = self.loop_indices
+        ib, indexed_vertices, _ = self.deduplicate_vertex_ndarray(self.element_vertex_ndarray[loop_indices])
         # TimerUtils.End("Calc IB VB")
 
         # 重计算TANGENT步骤
-        indexed_vertices = MeshFormatConverter.average_normal_tangent(obj=obj, indexed_vertices=indexed_vertices, d3d11GameType=self.d3d11GameType,dtype=self.dtype)
+        indexed_vertices = MeshFormatConverter.average_normal_tangent(indexed_vertices=indexed_vertices, d3d11GameType=self.d3d11GameType, allow_calc=self.recalculate_tangent)
         
         # 重计算COLOR步骤
-        indexed_vertices = MeshFormatConverter.average_normal_color(obj=obj, indexed_vertices=indexed_vertices, d3d11GameType=self.d3d11GameType,dtype=self.dtype)
+        indexed_vertices = MeshFormatConverter.average_normal_color(indexed_vertices=indexed_vertices, d3d11GameType=self.d3d11GameType, allow_calc=self.recalculate_color)
 
         print("indexed_vertices:")
         print(str(len(indexed_vertices)))
 
         # (2) 转换为CategoryBufferDict
-        # TimerUtils.Start("Calc CategoryBuffer")
-        category_stride_dict = self.d3d11GameType.get_real_category_stride_dict()
-        category_buffer_dict:dict[str,list] = {}
-        for categoryname,category_stride in self.d3d11GameType.CategoryStrideDict.items():
-            category_buffer_dict[categoryname] = []
-
-        data_matrix = numpy.array([numpy.frombuffer(byte_data,dtype=numpy.uint8) for byte_data in indexed_vertices])
-        stride_offset = 0
-        for categoryname,category_stride in category_stride_dict.items():
-            category_buffer_dict[categoryname] = data_matrix[:,stride_offset:stride_offset + category_stride].flatten()
-            stride_offset += category_stride
+        category_buffer_dict = self.get_category_buffer_dict(indexed_vertices)
 
         obj_model = ObjModel()
 
-        
-
-        obj_model.ib = flattened_ib
+        obj_model.ib = ib
         if GlobalConfig.gamename == "YYSLS":
             print("导出WWMI Mod时，翻转面朝向")
-            flipped_indices = []
-            print(flattened_ib[0],flattened_ib[1],flattened_ib[2])
-            for i in range(0, len(flattened_ib), 3):
-                triangle = flattened_ib[i:i+3]
-                flipped_triangle = triangle[::-1]
-                flipped_indices.extend(flipped_triangle)
-            print(flipped_indices[0],flipped_indices[1],flipped_indices[2])
-            obj_model.ib = flipped_indices
+            # 每个三角形的三个索引倒序排列
+            obj_model.ib = numpy.ascontiguousarray(ib.reshape(-1, 3)[:, ::-1]).reshape(-1)
 
         obj_model.category_buffer_dict = category_buffer_dict
-        obj_model.index_vertex_id_dict = None
+        obj_model.index_vertex_id_ndarray = None
         return obj_model
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+
+from ..config.main_config import GlobalConfig
+from ..migoto.migoto_format import D3D11GameType
+from ..utils.memory_utils import MemoryUtils
+
+
+class CategoryBufferWriter:
+    '''
+    流式导出时使用，每个obj计算完成后直接把它的CategoryBuffer追加写入到对应的.buf文件
+    不再把整个DrawIB的CategoryBuffer拼接后保存在内存中，写入后调用方就可以释放这个obj的数据
+
+    追加顺序和parse_categoryname_bytelist_dict_3一样，同一个obj只写入一次，
+    所以写出的文件和非流式导出完全相同
+
+    可以用with使用，正常结束时close，中途出现异常时abort，关闭并删除只写了一部分的.buf文件，
+    避免文件句柄一直被占用，也避免在Mod文件夹中留下不完整的Buffer
+    '''
+
+    def __init__(self, draw_ib:str, d3d11GameType:D3D11GameType):
+        self.draw_ib = draw_ib
+        self.d3d11GameType = d3d11GameType
+        self.category_name_file_dict = {}
+        self.processed_obj_name_set = set()
+        # 已经写入的总顶点数，写入完成后就是DrawIB的draw_number
+        self.vertex_count = 0
+
+        self.buf_path_list = []
+
+        buf_output_folder = GlobalConfig.path_generatemod_buffer_folder(draw_ib=self.draw_ib)
+        try:
+            for category_name in self.d3d11GameType.OrderedCategoryNameList:
+                buf_path = buf_output_folder + self.draw_ib + "-" + category_name + ".buf"
+                self.category_name_file_dict[category_name] = open(buf_path, 'wb')
+                self.buf_path_list.append(buf_path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def append(self, obj_name:str, category_buffer_dict:dict):
+        '''
+        追加写入一个obj的CategoryBuffer，已经写入过的obj直接跳过
+        '''
+        if obj_name in self.processed_obj_name_set:
+            return
+        self.processed_obj_name_set.add(obj_name)
+
+        if category_buffer_dict is None:
+            print("Can't find vb object for " + obj_name +",skip this obj process.")
+            return
+
+        for category_name, category_file in self.category_name_file_dict.items():
+            # CategoryBuffer是去重后顶点数组上的视图，tofile可以直接按行写出，不需要先复制成连续数组
+            category_buffer_dict[category_name].tofile(category_file)
+
+        position_stride = self.d3d11GameType.CategoryStrideDict["Position"]
+        self.vertex_count += int(category_buffer_dict["Position"].size / position_stride)
+
+        MemoryUtils.sample("CategoryBuffer " + obj_name)
+
+    def close(self):
+        for category_file in self.category_name_file_dict.values():
+            category_file.close()
+        self.category_name_file_dict = {}
+
+    def abort(self):
+        '''
+        导出失败时调用，关闭并删除已经写入的.buf文件
+        '''
+        self.close()
+        for buf_path in self.buf_path_list:
+            if os.path.exists(buf_path):
+                os.remove(buf_path)
+        self.buf_path_list = []
@@ -2,13 +2,17 @@ import bpy
 import copy
 import numpy
 
+from concurrent.futures import Future
+
 from ..utils.collection_utils import CollectionUtils,CollectionColor
 from ..utils.config_utils import ConfigUtils
 from ..utils.log_utils import LOG
 from ..utils.obj_utils import ObjUtils
-from ..migoto.migoto_format import M_Key, ObjModel, M_DrawIndexed, M_Condition,D3D11GameType
+from ..migoto.migoto_format import M_Key, ObjModel, ObjBufferData, M_DrawIndexed, M_Condition,D3D11GameType
 
-from .m_export import get_buffer_ib_vb_fast
+from .export_cache import ExportCache
+from .m_export import ExportExecutor
+from .category_buffer_writer import CategoryBufferWriter
 from .m_counter import M_Counter
     
 class ComponentModel:
@@ -16,12 +20,14 @@ class ComponentModel:
     虽然DrawIBModel是每个游戏都不同的，但是ComponentModel这里的代码是可以复用的。
     '''
 
-    def __init__(self,component_collection, d3d11_game_type:D3D11GameType,draw_ib:str,read_ib_category_data=True):
+    def __init__(self,component_collection, d3d11_game_type:D3D11GameType,draw_ib:str,read_ib_category_data=True,category_buffer_writer:CategoryBufferWriter=None):
         '''
         传入一个【Component集合】，然后解析并设置各项属性
+        传入category_buffer_writer时为流式导出，每个obj的CategoryBuffer计算完成后直接写入文件，obj_model中不再保留
         '''
         self.draw_ib = draw_ib
         self.d3d11_game_type = d3d11_game_type
+        self.category_buffer_writer = category_buffer_writer
         self.component_name = CollectionUtils.get_clean_collection_name(component_collection.name)
         # print("当前处理Component: " + self.component_name)
 
@@ -39,7 +45,7 @@ class ComponentModel:
         接下来处理ordered_draw_obj_model_list中的每个obj:
         - 读取category_buffer
         - 读取ib
-        - 【可选】读取index_vertex_id_dict
+        - 【可选】读取index_vertex_id_ndarray
         '''
         if read_ib_category_data:
             self.final_ordered_draw_obj_model_list:list[ObjModel] = [] 
@@ -51,52 +57,63 @@ class ComponentModel:
         (2) 读取obj的ib
         (3) 设置到最终的ordered_draw_obj_model_list
         '''
-        __obj_name_ib_dict:dict[str,list] = {} 
-        __obj_name_category_buffer_list_dict:dict[str,list] =  {} 
-
-        obj_name_obj_model_cache_dict:dict[str,ObjModel] = {}
+        # 同一个obj在多个位置绘制时共享同一份ObjBufferData
+        __obj_name_buffer_data_dict:dict[str,ObjBufferData] = {} 
+
+        # 主线程依次读取每个obj的数据并提交计算，计算在线程池中同时进行
+        obj_name_future_dict:dict[str,Future] = {}
+        # 已提交但还没有取回结果的obj，按提交顺序排列
+        pending_obj_name_list:list[str] = []
+
+        # 流式导出时限制同时在计算中的obj数量，其它情况全部提交后再统一取回
+        max_in_flight = None
+        if self.category_buffer_writer is not None:
+            max_in_flight = ExportExecutor.get_max_in_flight()
+
+        def collect_result(obj_name:str):
+            # 按绘制顺序取回计算结果，计算中的报错也会在这里抛出
+            ib, category_buffer_dict, index_vertex_id_ndarray = obj_name_future_dict[obj_name].result()
+            # 结果已经取回，Future不再持有这个obj的数据
+            obj_name_future_dict[obj_name] = None
+            unique_vertex_count = ObjBufferData.get_unique_vertex_count(ib, category_buffer_dict)
+
+            if self.category_buffer_writer is not None:
+                self.category_buffer_writer.append(obj_name, category_buffer_dict)
+                category_buffer_dict = None
+            __obj_name_buffer_data_dict[obj_name] = ObjBufferData(ib=ib, category_buffer_dict=category_buffer_dict, index_vertex_id_ndarray=None, unique_vertex_count=unique_vertex_count)
 
         for obj_model in self.ordered_draw_obj_model_list:
             obj_name = obj_model.obj_name
 
-            obj = bpy.data.objects[obj_name]
-            
-            obj_model = obj_name_obj_model_cache_dict.get(obj_name,None)
-            if obj_model is not None:
+            if obj_name in obj_name_future_dict:
                 LOG.info("Using cached model for " + obj_name)
-                __obj_name_ib_dict[obj.name] = obj_model.ib
-                __obj_name_category_buffer_list_dict[obj.name] = obj_model.category_buffer_dict
-            else:
-                # 选中当前obj对象
-                bpy.context.view_layer.objects.active = obj
+                continue
 
-                # XXX 我们在导出具体数据之前，先对模型整体的权重进行normalize_all预处理，才能让后续的具体每一个权重的normalize_all更好的工作
-                # 使用这个的前提是当前obj中没有锁定的顶点组，所以这里要先进行判断。
-                if "Blend" in self.d3d11_game_type.OrderedCategoryNameList:
-                    all_vgs_locked = ObjUtils.is_all_vertex_groups_locked(obj)
-                    if not all_vgs_locked:
-                        ObjUtils.normalize_all(obj)
+            obj = bpy.data.objects[obj_name]
 
-                ib, category_buffer_dict, index_vertex_id_dict = get_buffer_ib_vb_fast(self.d3d11_game_type)
-                
-                __obj_name_ib_dict[obj.name] = ib
-                __obj_name_category_buffer_list_dict[obj.name] = category_buffer_dict
+            # 选中当前obj对象
+            bpy.context.view_layer.objects.active = obj
 
-                obj_model = ObjModel()
-                obj_model.obj_name = obj_name
-                obj_model.ib = ib
-                obj_model.category_buffer_dict = category_buffer_dict
-                obj_name_obj_model_cache_dict[obj_name] = obj_model
+            # XXX 我们在导出具体数据之前，先对模型整体的权重进行normalize_all预处理，才能让后续的具体每一个权重的normalize_all更好的工作
+            # 这里不再调用bpy.ops，而是在计算权重时按Normalize All的规则直接规格化，不修改obj本身，锁定的顶点组同样保持不变
+            obj_name_future_dict[obj_name] = ExportCache.submit_buffer_ib_vb(obj, self.d3d11_game_type, normalize_weights=True)
+            pending_obj_name_list.append(obj_name)
+
+            while max_in_flight is not None and len(pending_obj_name_list) > max_in_flight:
+                collect_result(pending_obj_name_list.pop(0))
+
+        for obj_name in pending_obj_name_list:
+            collect_result(obj_name)
         
         final_ordered_draw_obj_model_list:list[ObjModel] = [] 
         
         for obj_model in self.ordered_draw_obj_model_list:
             obj_name = obj_model.obj_name
 
-            obj_model.ib = __obj_name_ib_dict[obj_name]
-            obj_model.category_buffer_dict = __obj_name_category_buffer_list_dict[obj_name]
+            # 每个obj_model都是解析集合时新建的，生效条件各不相同，这里直接引用共享的几何数据，不需要再复制obj_model
+            obj_model.buffer_data = __obj_name_buffer_data_dict[obj_name]
 
-            final_ordered_draw_obj_model_list.append(copy.deepcopy(obj_model))
+            final_ordered_draw_obj_model_list.append(obj_model)
         
         self.final_ordered_draw_obj_model_list = final_ordered_draw_obj_model_list
 
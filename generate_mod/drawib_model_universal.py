@@ -11,13 +11,16 @@ from ..utils.collection_utils import *
 from ..config.main_config import *
 from ..utils.json_utils import *
 from ..utils.timer_utils import *
-from ..utils.migoto_utils import Fatal
+from ..utils.migoto_utils import Fatal, MigotoUtils
 from ..utils.obj_utils import ObjUtils
 
 from ..utils.obj_utils import ExtractedObject, ExtractedObjectHelper
 from ..migoto.migoto_format import M_DrawIndexed, TextureReplace,ObjModel
 from ..config.import_config import ImportConfig
+from ..utils.memory_utils import MemoryUtils
+from ..properties.properties_generate_mod import Properties_GenerateMod
 from .component_model import ComponentModel
+from .category_buffer_writer import CategoryBufferWriter
 
 from .m_counter import M_Counter
 
@@ -55,15 +58,31 @@ class DrawIBModelUniversal:
         self.component_name_component_model_dict:dict[str,ComponentModel] = {}
         # 使用全局key索引，确保存在多个Component时声明的key不会重复
         self.key_name_mkey_dict:dict[str,M_Key] = {}
-        for component_collection in component_collection_list:
-            component_model = ComponentModel(component_collection=component_collection,d3d11_game_type=self.d3d11GameType,draw_ib=self.draw_ib)
 
-            self.component_model_list.append(component_model)
-            self.component_name_component_model_dict[component_model.component_name] = component_model
-
-            for key_name, mkey in component_model.keyname_mkey_dict.items():
-                self.key_name_mkey_dict[key_name] = mkey
-                print("key_name: " + key_name + "  key:" + str(mkey)) 
+        # 流式导出时每个obj计算完成后直接把CategoryBuffer写入文件，不再在内存中拼接
+        category_buffer_writer = None
+        if Properties_GenerateMod.use_streaming_export():
+            category_buffer_writer = CategoryBufferWriter(draw_ib=self.draw_ib, d3d11GameType=self.d3d11GameType)
+
+        # 流式导出时中途出现异常要关闭并删除已经写入一部分的.buf文件
+        try:
+            for component_collection in component_collection_list:
+                component_model = ComponentModel(component_collection=component_collection,d3d11_game_type=self.d3d11GameType,draw_ib=self.draw_ib,category_buffer_writer=category_buffer_writer)
+
+                self.component_model_list.append(component_model)
+                self.component_name_component_model_dict[component_model.component_name] = component_model
+
+                for key_name, mkey in component_model.keyname_mkey_dict.items():
+                    self.key_name_mkey_dict[key_name] = mkey
+                    print("key_name: " + key_name + "  key:" + str(mkey)) 
+        except BaseException:
+            if category_buffer_writer is not None:
+                category_buffer_writer.abort()
+            raise
+
+        # 所有obj都已经写入，后面不再需要写入CategoryBuffer
+        if category_buffer_writer is not None:
+            category_buffer_writer.close()
         
         
 
@@ -79,16 +98,23 @@ class DrawIBModelUniversal:
             self.__read_component_ib_buf_dict_merged()
         else:
             self.__read_component_ib_buf_dict_seperated_single()
-            
-        self.parse_categoryname_bytelist_dict_3()
+
+        if category_buffer_writer is not None:
+            self.draw_number = category_buffer_writer.vertex_count
+        else:
+            self.parse_categoryname_bytelist_dict_3()
 
         # (5) 导出Buffer文件，Export Index Buffer files, Category Buffer files. (And Export ShapeKey Buffer Files.(WWMI))
         # 用于写出IB时使用
         self.PartName_IBResourceName_Dict = {}
         self.PartName_IBBufferFileName_Dict = {}
+        # 每个IB根据最大索引选择R16_UINT或R32_UINT，写出IB时确定
+        self.PartName_IBFormat_Dict = {}
         self.combine_partname_ib_resource_and_filename_dict()
         self.write_buffer_files()
 
+        MemoryUtils.sample("DrawIB " + self.draw_ib)
+
     def __initlialize_drawib_item(self,drawib_collection_name:str):
         drawib_collection_name_splits = CollectionUtils.get_clean_collection_name(drawib_collection_name).split("_")
         self.draw_ib = drawib_collection_name_splits[0]
@@ -96,48 +122,51 @@ class DrawIBModelUniversal:
 
 
     def parse_categoryname_bytelist_dict_3(self):
-        processed_obj_name_list = [] # 用于记录已经处理过的obj_name，避免重复处理
+        '''
+        拼接所有obj的CategoryBuffer
 
+        第一遍统计每个obj的顶点数，每个CategoryBuffer只分配一次；第二遍把每个obj的数据直接写到对应的位置，
+        不再每个obj都concatenate一次，obj数量很多时(比如大量头发、饰品的小部件)不会变成平方级别的复制
+        '''
+        processed_obj_name_set = set() # 用于记录已经处理过的obj_name，避免重复处理
+
+        # (1) 按顺序收集需要拼接的CategoryBuffer，并统计总顶点数
+        category_buffer_dict_list:list[dict] = []
+        total_vertex_count = 0
         for component_model in self.component_model_list:
             for obj_model in component_model.final_ordered_draw_obj_model_list:
                 obj_name = obj_model.obj_name
                 # 如果obj_name已经被处理过了，则跳过
-                if obj_name in processed_obj_name_list:
+                if obj_name in processed_obj_name_set:
                     continue
                 
                 # 否则加入已处理列表，并进行处理
-                processed_obj_name_list.append(obj_name)
+                processed_obj_name_set.add(obj_name)
                 # 下面的流程是对当前obj处理得到CategoryBuffer，所以如果obj_name已经被处理过，那就不需要继续处理了
-                category_buffer_list = obj_model.category_buffer_dict
+                category_buffer_dict = obj_model.category_buffer_dict
                 
-                if category_buffer_list is None:
+                if category_buffer_dict is None:
                     print("Can't find vb object for " + obj_name +",skip this obj process.")
                     continue
 
-                for category_name in self.d3d11GameType.OrderedCategoryNameList:
-                    if category_name not in self.__categoryname_bytelist_dict:
-                        self.__categoryname_bytelist_dict[category_name] =  category_buffer_list[category_name]
-                    else:
-                        existing_array = self.__categoryname_bytelist_dict[category_name]
-                        buffer_array = category_buffer_list[category_name]
-
-                        # 确保两个数组都是NumPy数组
-                        existing_array = numpy.asarray(existing_array)
-                        buffer_array = numpy.asarray(buffer_array)
+                category_buffer_dict_list.append(category_buffer_dict)
+                total_vertex_count += len(category_buffer_dict["Position"])
 
-                        # 使用 concatenate 连接两个数组，确保传递的是一个序列（如列表或元组）
-                        concatenated_array = numpy.concatenate((existing_array, buffer_array))
+        # (2) 每个CategoryBuffer都是(顶点数, 步长)形状的uint8数组，一次分配后按顺序填充
+        for category_name in self.d3d11GameType.OrderedCategoryNameList:
+            category_stride = self.d3d11GameType.CategoryStrideDict[category_name]
+            category_array = numpy.empty((total_vertex_count, category_stride), dtype=numpy.uint8)
 
-                        # 更新字典中的值
-                        self.__categoryname_bytelist_dict[category_name] = concatenated_array
+            vertex_offset = 0
+            for category_buffer_dict in category_buffer_dict_list:
+                buffer_array = category_buffer_dict[category_name]
+                category_array[vertex_offset:vertex_offset + len(buffer_array)] = buffer_array
+                vertex_offset += len(buffer_array)
 
-                        # self.__categoryname_bytelist_dict[category_name] = numpy.concatenate(self.__categoryname_bytelist_dict[category_name],category_buffer_list[category_name])
+            self.__categoryname_bytelist_dict[category_name] = category_array
 
-        # 顺便计算一下步长得到总顶点数
-        # print(self.d3d11GameType.CategoryStrideDict)
-        position_stride = self.d3d11GameType.CategoryStrideDict["Position"]
-        position_bytelength = len(self.__categoryname_bytelist_dict["Position"])
-        self.draw_number = int(position_bytelength/position_stride)
+        # 总顶点数就是Position的行数
+        self.draw_number = total_vertex_count
 
     def __read_component_ib_buf_dict_merged(self):
         '''
@@ -152,7 +181,8 @@ class DrawIBModelUniversal:
         obj_name_drawindexedobj_cache_dict:dict[str,M_DrawIndexed] = {}
 
         vertex_number_ib_offset = 0
-        ib_buf = []
+        # 每个obj偏移后的IB，全部处理完后一次性拼接
+        offset_ib_list:list[numpy.ndarray] = []
         draw_offset = 0
 
         new_component_model_list = []
@@ -171,19 +201,17 @@ class DrawIBModelUniversal:
                 else:
                     # print("processing: " + obj_name)
                     ib = obj_model.ib
-                    # ib的数据类型是list[int]
-                    unique_vertex_number_set = set(ib)
-                    unique_vertex_number = len(unique_vertex_number_set)
 
                     if ib is None:
                         print("Can't find ib object for " + obj_name +",skip this obj process.")
                         continue
-                    
+
+                    # ib是uint32数组，唯一顶点数在去重时已经统计好
+                    unique_vertex_number = obj_model.buffer_data.unique_vertex_count
+
                     # 扩充总IB Buffer
-                    offset_ib = []
-                    for ib_number in ib:
-                        offset_ib.append(ib_number + vertex_number_ib_offset)
-                    ib_buf.extend(offset_ib)
+                    offset_ib = ib + numpy.uint32(vertex_number_ib_offset)
+                    offset_ib_list.append(offset_ib)
                     # Add UniqueVertexNumber to show vertex count in mod ini.
                     # print("Draw Number: " + str(unique_vertex_number))
                     vertex_number_ib_offset = vertex_number_ib_offset + unique_vertex_number
@@ -205,11 +233,14 @@ class DrawIBModelUniversal:
             
             component_model.final_ordered_draw_obj_model_list = new_final_ordered_draw_obj_model_list
             new_component_model_list.append(component_model)
-            self.component_name_component_model_dict[component_model.component_name] = copy.deepcopy(component_model)
+            # 之后不会再修改component_model，直接引用即可，不需要复制一份obj_model及其几何数据
+            self.component_name_component_model_dict[component_model.component_name] = component_model
 
         # 累加完毕后draw_offset的值就是总的index_count的值，正好作为WWMI的$object_id
         self.total_index_count = draw_offset
 
+        ib_buf = numpy.concatenate(offset_ib_list) if len(offset_ib_list) != 0 else numpy.empty(0, dtype=numpy.uint32)
+
         for component_model in self.component_model_list:
             # Only export if it's not empty.
             if len(ib_buf) != 0:
@@ -225,7 +256,8 @@ class DrawIBModelUniversal:
 
         new_component_model_list = []
         for component_model in self.component_model_list:
-            ib_buf = []
+            # 每个obj偏移后的IB，当前Component处理完后一次性拼接
+            offset_ib_list:list[numpy.ndarray] = []
             offset = 0
 
             new_final_ordered_draw_obj_model_list:list[ObjModel] = [] 
@@ -241,21 +273,18 @@ class DrawIBModelUniversal:
                     # print("processing: " + obj_name)
                     ib =  obj_model.ib
 
-                    # ib的数据类型是list[int]
-                    unique_vertex_number_set = set(ib)
-                    unique_vertex_number = len(unique_vertex_number_set)
-
                     if ib is None:
                         print("Can't find ib object for " + obj_name +",skip this obj process.")
                         continue
 
-                    offset_ib = []
-                    for ib_number in ib:
-                        offset_ib.append(ib_number + vertex_number_ib_offset)
+                    # ib是uint32数组，唯一顶点数在去重时已经统计好
+                    unique_vertex_number = obj_model.buffer_data.unique_vertex_count
+
+                    offset_ib = ib + numpy.uint32(vertex_number_ib_offset)
                     
                     # print("Component name: " + component_name)
                     # print("Draw Offset: " + str(vertex_number_ib_offset))
-                    ib_buf.extend(offset_ib)
+                    offset_ib_list.append(offset_ib)
 
                     drawindexed_obj = M_DrawIndexed()
                     draw_number = len(offset_ib)
@@ -282,9 +311,11 @@ class DrawIBModelUniversal:
 
             component_model.final_ordered_draw_obj_model_list = new_final_ordered_draw_obj_model_list
             new_component_model_list.append(component_model)
-            self.component_name_component_model_dict[component_model.component_name] = copy.deepcopy(component_model)
+            # 之后不会再修改component_model，直接引用即可，不需要复制一份obj_model及其几何数据
+            self.component_name_component_model_dict[component_model.component_name] = component_model
 
             # Only export if it's not empty.
+            ib_buf = numpy.concatenate(offset_ib_list) if len(offset_ib_list) != 0 else numpy.empty(0, dtype=numpy.uint32)
             if len(ib_buf) == 0:
                 LOG.warning(self.draw_ib + " collection: " + component_model.component_name + " is hide, skip export ib buf.")
             else:
@@ -306,6 +337,7 @@ class DrawIBModelUniversal:
             ib_buf_filename = self.draw_ib + "-" + style_part_name + ".buf"
             self.PartName_IBResourceName_Dict[partname] = ib_resource_name
             self.PartName_IBBufferFileName_Dict[partname] = ib_buf_filename
+            self.PartName_IBFormat_Dict[partname] = "DXGI_FORMAT_R32_UINT"
 
     def write_buffer_files(self):
         '''
@@ -323,9 +355,12 @@ class DrawIBModelUniversal:
             else:
                 ib_path = buf_output_folder + self.PartName_IBBufferFileName_Dict[partname]
 
-                packed_data = struct.pack(f'<{len(ib_buf)}I', *ib_buf)
+                # 最大索引不超过R16_UINT的范围时按uint16写出，否则按uint32写出，都是小端序一次性写出
+                ib_format = MigotoUtils.get_index_buffer_format(ib_buf)
+                self.PartName_IBFormat_Dict[partname] = ib_format
+                ib_dtype = numpy.dtype(MigotoUtils.get_nptype_from_format(ib_format)).newbyteorder("<")
                 with open(ib_path, 'wb') as ibf:
-                    ibf.write(packed_data) 
+                    numpy.asarray(ib_buf, dtype=ib_dtype).tofile(ibf)
             
         # print("Export Category Buffers::")
         # Export category buffer files.
@@ -338,5 +373,8 @@ class DrawIBModelUniversal:
             with open(buf_path, 'wb') as ibf:
                 category_buf.tofile(ibf)
 
+        # 写出后不再需要，DrawIBModel会一直保留到生成ini结束，这里提前释放拼接后的CategoryBuffer
+        self.__categoryname_bytelist_dict = {}
+
 
 
@@ -0,0 +1,319 @@
+import os
+import hashlib
+import tempfile
+import numpy
+import bpy
+
+from concurrent.futures import Future
+
+from ..migoto.migoto_format import D3D11GameType
+from ..config.main_config import GlobalConfig
+from ..properties.properties_generate_mod import Properties_GenerateMod
+from ..utils.log_utils import LOG
+from .export_layout_plan import ExportLayoutPlan
+from .buffer_model import BufferModel
+from .mesh_data import MeshData
+from .mesh_format_converter import MeshFormatConverter
+from ..utils.obj_utils import ObjUtils
+from ..utils.memory_utils import MemoryUtils
+from .m_export import ExportExecutor, gather_buffer_model_from_mesh, compute_buffer_ib_vb, submit_buffer_ib_vb
+
+
+class ExportCache:
+    '''
+    持久化在工作空间中的obj导出缓存
+
+    之前的缓存只在一次生成Mod的过程中有效，而实际制作Mod时经常是改了一两个模型就重新生成一次。
+    这里对每个obj的evaluated mesh内容、顶点组权重、数据类型以及相关的导出设置计算一个哈希，
+    作为key把导出计算的结果保存到工作空间的ExportCache文件夹中，
+    下次生成Mod时没有任何变化的obj直接读取结果，跳过整个计算过程。
+
+    缓存文件的修改时间就是最后使用时间，超过大小上限时按最久未使用的顺序删除。
+    '''
+    # 导出结果的计算方式有变化时需要修改这个版本号，让旧的缓存全部失效
+    cache_version = 7
+
+    hit_count = 0
+    miss_count = 0
+
+    # Blender中每种属性类型对应foreach_get使用的字段名和numpy类型
+    attribute_data_type_dict = {
+        "FLOAT": ("value", numpy.float32),
+        "INT": ("value", numpy.int32),
+        "INT8": ("value", numpy.int8),
+        "BOOLEAN": ("value", numpy.bool_),
+        "FLOAT2": ("vector", numpy.float32),
+        "FLOAT_VECTOR": ("vector", numpy.float32),
+        "FLOAT_COLOR": ("color", numpy.float32),
+        "BYTE_COLOR": ("color", numpy.float32),
+        "INT32_2D": ("value", numpy.int32),
+        "QUATERNION": ("value", numpy.float32),
+    }
+
+    # 每个元素的分量个数
+    attribute_component_count_dict = {
+        "FLOAT2": 2,
+        "FLOAT_VECTOR": 3,
+        "FLOAT_COLOR": 4,
+        "BYTE_COLOR": 4,
+        "INT32_2D": 2,
+        "QUATERNION": 4,
+    }
+
+    # 本次生成Mod中还在计算的缓存key和对应的Future
+    # 内容完全相同的obj(比如在多个Component或分支中使用的关联复制)得到相同的key，共用同一次计算
+    pending_future_dict:dict[str,Future] = {}
+
+    @classmethod
+    def initialize(cls):
+        cls.hit_count = 0
+        cls.miss_count = 0
+        cls.pending_future_dict = {}
+
+    @classmethod
+    def path_export_cache_folder(cls):
+        export_cache_folder_path = os.path.join(GlobalConfig.path_workspace_folder(), "ExportCache\\")
+        if not os.path.exists(export_cache_folder_path):
+            os.makedirs(export_cache_folder_path)
+        return export_cache_folder_path
+
+    @classmethod
+    def get_buffer_ib_vb(cls,obj:bpy.types.Object,d3d11GameType:D3D11GameType,normalize_weights:bool = False):
+        '''
+        和get_buffer_ib_vb_fast一样返回ib, category_buffer_dict, index_vertex_id_ndarray
+        调用前同样需要先选中obj
+        '''
+        return cls.submit_buffer_ib_vb(obj, d3d11GameType, normalize_weights=normalize_weights).result()
+
+    @classmethod
+    def submit_buffer_ib_vb(cls,obj:bpy.types.Object,d3d11GameType:D3D11GameType,normalize_weights:bool = False) -> Future:
+        '''
+        命中缓存时返回已完成的Future，未命中时在主线程读取数据，把计算和写入缓存提交到线程池
+        调用方按绘制顺序依次取result()即可，多个obj的计算可以同时进行
+
+        哈希在三角化和calc_tangents之前对evaluated mesh计算，命中时跳过三角化、TANGENT计算、读取数据和导出计算，
+        未命中时直接在同一个mesh上继续读取，不需要再生成一次evaluated mesh
+        '''
+        if not Properties_GenerateMod.use_export_cache():
+            return submit_buffer_ib_vb(obj, d3d11GameType, normalize_weights=normalize_weights)
+
+        buffer_model = BufferModel(d3d11GameType=d3d11GameType)
+        buffer_model.check_and_verify_attributes(obj)
+
+        obj_eval = obj.evaluated_get(bpy.context.evaluated_depsgraph_get())
+        mesh = obj_eval.to_mesh()
+        try:
+            # 顶点组权重只读取一次，计算哈希和导出计算共用
+            vertex_group_triples = None
+            if buffer_model.layout_plan.need_blend_data:
+                vertex_group_triples = MeshData(mesh=mesh).get_vertex_group_triples()
+
+            cache_key = cls.compute_cache_key(obj, mesh, d3d11GameType, normalize_weights, vertex_group_triples)
+            cache_file_path = os.path.join(cls.path_export_cache_folder(), cache_key + ".npz")
+
+            # 相同的key正在计算中时直接共用这次计算的结果
+            pending_future = cls.pending_future_dict.get(cache_key, None)
+            if pending_future is not None and not pending_future.done():
+                cls.hit_count += 1
+                LOG.info("Using export cache for " + obj.name)
+                return pending_future
+
+            cached_result = cls.load(cache_file_path)
+            if cached_result is not None:
+                cls.hit_count += 1
+                LOG.info("Using export cache for " + obj.name)
+                future = Future()
+                future.set_result(cached_result)
+                return future
+
+            cls.miss_count += 1
+            gather_buffer_model_from_mesh(buffer_model, obj, mesh, normalize_weights=normalize_weights, vertex_group_triples=vertex_group_triples)
+        finally:
+            obj_eval.to_mesh_clear()
+
+        MemoryUtils.sample("Gather " + obj.name)
+
+        future = ExportExecutor.submit(cls.compute_and_save, buffer_model, cache_file_path)
+        cls.pending_future_dict[cache_key] = future
+        # 计算完成后不再保留，避免Future一直持有结果
+        future.add_done_callback(lambda done_future: cls.remove_pending_future(cache_key, done_future))
+        return future
+
+    @classmethod
+    def remove_pending_future(cls,cache_key:str,done_future:Future):
+        if cls.pending_future_dict.get(cache_key, None) is done_future:
+            cls.pending_future_dict.pop(cache_key, None)
+
+    @classmethod
+    def compute_and_save(cls,buffer_model,cache_file_path:str):
+        '''
+        在线程池中执行
+        内容相同的obj在同一次生成Mod中共用一次计算，但之后的生成Mod中仍可能有其它线程同时写同一个缓存文件，见save
+        '''
+        ib, category_buffer_dict, index_vertex_id_ndarray = compute_buffer_ib_vb(buffer_model)
+        cls.save(cache_file_path, ib, category_buffer_dict, index_vertex_id_ndarray)
+        return ib, category_buffer_dict, index_vertex_id_ndarray
+
+    @classmethod
+    def compute_cache_key(cls,obj:bpy.types.Object,mesh:bpy.types.Mesh,d3d11GameType:D3D11GameType,normalize_weights:bool,vertex_group_triples) -> str:
+        '''
+        对三角化之前的evaluated mesh的顶点、拓扑、法线、所有属性层、顶点组权重，以及数据类型、导出设置计算哈希
+        三角化、TANGENT和后续的导出计算都只由这些数据决定，修改器的影响也已经体现在evaluated mesh中
+        '''
+        hasher = hashlib.blake2b(digest_size=20)
+
+        def update_str(value):
+            hasher.update(str(value).encode("utf-8"))
+            hasher.update(b"\0")
+
+        def update_ndarray(ndarray:numpy.ndarray):
+            ndarray = numpy.ascontiguousarray(ndarray)
+            update_str((ndarray.dtype.str, ndarray.shape))
+            hasher.update(ndarray.tobytes())
+
+        update_str(cls.cache_version)
+        update_str(ExportLayoutPlan.get_cache_key(d3d11GameType))
+        update_str(GlobalConfig.get_game_category())
+
+        # 影响导出结果的设置
+        update_str(MeshFormatConverter.allow_recalculate_tangent(obj))
+        update_str(MeshFormatConverter.allow_recalculate_color(obj))
+        update_str(Properties_GenerateMod.use_vertex_cache_optimization())
+
+        # 导出时规格化权重的结果取决于顶点组的锁定状态
+        update_str(normalize_weights and not ObjUtils.is_all_vertex_groups_locked(obj))
+        if normalize_weights:
+            update_str(ObjUtils.get_vertex_group_lock_flags(obj))
+
+        update_str((len(mesh.vertices), len(mesh.loops), len(mesh.polygons)))
+        for collection, attribute_name, dtype, component_count in (
+            (mesh.vertices, "co", numpy.float32, 3),
+            (mesh.vertices, "undeformed_co", numpy.float32, 3),
+            (mesh.loops, "vertex_index", numpy.int32, 1),
+            (mesh.polygons, "loop_start", numpy.int32, 1),
+            (mesh.polygons, "loop_total", numpy.int32, 1),
+        ):
+            update_ndarray(cls.get_collection_ndarray(collection, attribute_name, dtype, component_count))
+
+        # 自定义法线、平滑和锐边的影响都体现在每个loop的法线上，Blender 4.1之后可以直接读取corner_normals
+        if hasattr(mesh, "corner_normals"):
+            update_ndarray(cls.get_collection_ndarray(mesh.corner_normals, "vector", numpy.float32, 3))
+        else:
+            mesh.calc_normals_split()
+            update_ndarray(cls.get_collection_ndarray(mesh.loops, "normal", numpy.float32, 3))
+
+        # UV和COLOR在旧版本Blender中不在attributes里，单独读取
+        for uv_layer in mesh.uv_layers:
+            update_str(("uv", uv_layer.name))
+            update_ndarray(cls.get_collection_ndarray(uv_layer.data, "uv", numpy.float32, 2))
+        for vertex_color in mesh.vertex_colors:
+            update_str(("color", vertex_color.name))
+            update_ndarray(cls.get_collection_ndarray(vertex_color.data, "color", numpy.float32, 4))
+
+        # 其它所有属性层
+        for attribute in mesh.attributes:
+            # 以.开头的是选中、隐藏等内部状态，不影响导出结果
+            if attribute.name.startswith("."):
+                continue
+            data_type = cls.attribute_data_type_dict.get(attribute.data_type, None)
+            if data_type is None:
+                continue
+            update_str((attribute.name, attribute.domain, attribute.data_type))
+            component_count = cls.attribute_component_count_dict.get(attribute.data_type, 1)
+            update_ndarray(cls.get_collection_ndarray(attribute.data, data_type[0], data_type[1], component_count))
+
+        # 顶点组权重
+        if vertex_group_triples is not None:
+            for ndarray in vertex_group_triples:
+                update_ndarray(ndarray)
+
+        return hasher.hexdigest()
+
+    @classmethod
+    def get_collection_ndarray(cls,collection,attribute_name:str,dtype,component_count:int) -> numpy.ndarray:
+        data = numpy.empty(len(collection) * component_count, dtype=dtype)
+        collection.foreach_get(attribute_name, data)
+        return data
+
+    @classmethod
+    def load(cls,cache_file_path:str):
+        if not os.path.exists(cache_file_path):
+            return None
+        try:
+            with numpy.load(cache_file_path) as cache_file:
+                ib = cache_file["ib"]
+
+                category_buffer_dict = {}
+                for key in cache_file.files:
+                    if key.startswith("category_"):
+                        category_buffer_dict[key[len("category_"):]] = cache_file[key]
+
+                index_vertex_id_ndarray = cache_file["index_vertex_id"] if "index_vertex_id" in cache_file.files else None
+        except Exception as e:
+            # 缓存文件损坏时当作未命中，重新计算后覆盖
+            LOG.warning("Can't read export cache " + cache_file_path + " : " + str(e))
+            return None
+
+        # 更新修改时间作为最后使用时间
+        os.utime(cache_file_path)
+        return ib, category_buffer_dict, index_vertex_id_ndarray
+
+    @classmethod
+    def save(cls,cache_file_path:str,ib,category_buffer_dict:dict,index_vertex_id_ndarray):
+        cache_arrays = {
+            "ib": ib,
+        }
+        for categoryname, category_buffer in category_buffer_dict.items():
+            cache_arrays["category_" + categoryname] = numpy.ascontiguousarray(category_buffer)
+        if index_vertex_id_ndarray is not None:
+            cache_arrays["index_vertex_id"] = index_vertex_id_ndarray
+
+        # 先写临时文件再替换，避免中途失败留下不完整的缓存文件
+        # 每次写入使用各自的临时文件，多个线程同时写同一个缓存时不会互相覆盖或删除对方的临时文件
+        tmp_file_descriptor, tmp_file_path = tempfile.mkstemp(suffix=".tmp.npz", dir=os.path.dirname(cache_file_path))
+        os.close(tmp_file_descriptor)
+        try:
+            numpy.savez(tmp_file_path, **cache_arrays)
+            os.replace(tmp_file_path, cache_file_path)
+        except OSError as e:
+            # 内容相同的缓存已经由其它线程写入，或者正在被读取(Windows下无法替换)，这次写入可以放弃
+            if not os.path.exists(cache_file_path):
+                raise
+            LOG.warning("Skip writing export cache " + cache_file_path + " : " + str(e))
+        finally:
+            if os.path.exists(tmp_file_path):
+                os.remove(tmp_file_path)
+
+    @classmethod
+    def evict(cls):
+        '''
+        缓存总大小超过上限时，按最后使用时间从旧到新删除
+        '''
+        size_limit = Properties_GenerateMod.export_cache_size_limit_mb() * 1024 * 1024
+        export_cache_folder_path = cls.path_export_cache_folder()
+
+        cache_file_list = []
+        for file_name in os.listdir(export_cache_folder_path):
+            if file_name.endswith(".npz"):
+                file_path = os.path.join(export_cache_folder_path, file_name)
+                file_stat = os.stat(file_path)
+                cache_file_list.append((file_stat.st_mtime, file_stat.st_size, file_path))
+
+        total_size = sum(file_size for _, file_size, _ in cache_file_list)
+        for _, file_size, file_path in sorted(cache_file_list):
+            if total_size <= size_limit:
+                break
+            os.remove(file_path)
+            total_size -= file_size
+        return total_size
+
+    @classmethod
+    def report(cls):
+        '''
+        每次生成Mod结束时调用，清理超出大小上限的缓存并输出命中情况
+        '''
+        if not Properties_GenerateMod.use_export_cache():
+            return
+        total_size = cls.evict()
+        LOG.info("导出缓存: 命中 " + str(cls.hit_count) + " 个, 未命中 " + str(cls.miss_count) + " 个, 缓存大小 " + str(round(total_size / 1024 / 1024, 2)) + " MB")
+        LOG.newline()
@@ -0,0 +1,250 @@
+import numpy
+
+from ..migoto.migoto_format import D3D11GameType
+from .mesh_format_converter import MeshFormatConverter
+from ..utils.migoto_utils import MigotoUtils
+from ..config.main_config import GlobalConfig, GameCategory
+
+
+class ExportElementPlan:
+    '''
+    单个D3D11Element在导出时的处理方式，编译布局时就确定下来，之后每个obj直接使用
+
+    - source: 数据来源，POSITION、NORMAL、TANGENT、BINORMAL、COLOR、TEXCOORD、BLENDINDICES、BLENDWEIGHT、BLENDWEIGHT_UNORM
+    - component_count: 从Blender中读取时组装成几个分量，3或者4，其它来源不使用
+    - w_fill: 组装成4个分量时W分量的填充方式，one、zero、neg_bitangent_sign，None表示不填充
+    - converter: 把读取到的float32数据转换为目标格式的函数
+    '''
+    def __init__(self,element_name:str,d3d11_element,source:str,converter,component_count:int = 0,w_fill:str = None):
+        self.element_name = element_name
+        self.d3d11_element = d3d11_element
+        self.source = source
+        self.converter = converter
+        self.component_count = component_count
+        self.w_fill = w_fill
+        # 方向向量是否需要先从[-1,1]映射到[0,1]，用于UNORM格式
+        self.remap_signed_to_unsigned = False
+
+
+class ExportLayoutPlan:
+    '''
+    之前每个obj导出时都要重新拼接dtype，逐个元素用正则解析Format，再根据GlobalConfig.gamename和Format选择转换方式。
+    一个角色经常有几百个小配件obj，这部分重复的准备工作反而成了主要耗时。
+
+    这里按D3D11GameType的元素布局和当前游戏编译一次，得到最终的dtype、每个元素的数据来源和转换函数、以及每个Category的偏移，
+    然后缓存起来，同一个DrawIB的所有obj以及之后的每次导出都直接复用。
+    '''
+    # 四分量向量W分量的填充规则，按顺序匹配第一条符合的规则，格式和游戏为None表示不限制
+    # 游戏既可以是GlobalConfig.gamename也可以是GameCategory，都没有匹配到时不填充W
+    # (数据来源, 格式, 游戏, W填充方式)
+    W_FILL_RULES = [
+        ("POSITION", None, None, "zero"),
+
+        # 燕云十六声的NORMAL.w固定为0
+        ("NORMAL", "R8G8B8A8_UNORM", "YYSLS", "zero"),
+        # Unreal的NORMAL.w是翻转后的副切线符号
+        ("NORMAL", "R8G8B8A8_SNORM", GameCategory.UnrealVS, "neg_bitangent_sign"),
+        ("NORMAL", "R8G8B8A8_SNORM", GameCategory.UnrealCS, "neg_bitangent_sign"),
+        ("NORMAL", None, None, "one"),
+
+        # 燕云十六声的TANGENT.w固定为1
+        ("TANGENT", None, "YYSLS", "one"),
+        # 如果要确保Unity游戏中渲染正确，必须翻转TANGENT的W分量
+        ("TANGENT", None, GameCategory.UnityVS, "neg_bitangent_sign"),
+        ("TANGENT", None, GameCategory.UnityCS, "neg_bitangent_sign"),
+        # Unreal引擎中这里要填写固定的1
+        ("TANGENT", None, GameCategory.UnrealVS, "one"),
+        ("TANGENT", None, GameCategory.UnrealCS, "one"),
+
+        ("BINORMAL", None, None, "one"),
+    ]
+
+    # 缓存的key只取决于元素布局和游戏，所以不同DrawIB读取出的相同数据类型也能共用同一个布局
+    _plan_cache:dict[tuple,"ExportLayoutPlan"] = {}
+
+    @classmethod
+    def get_plan(cls,d3d11GameType:D3D11GameType) -> "ExportLayoutPlan":
+        cache_key = cls.get_cache_key(d3d11GameType)
+        plan = cls._plan_cache.get(cache_key,None)
+        if plan is None:
+            plan = ExportLayoutPlan(d3d11GameType)
+            cls._plan_cache[cache_key] = plan
+        return plan
+
+    @classmethod
+    def get_cache_key(cls,d3d11GameType:D3D11GameType) -> tuple:
+        element_layout = tuple(
+            (d3d11_element.ElementName, d3d11_element.SemanticIndex, d3d11_element.Format, d3d11_element.ByteWidth, d3d11_element.Category)
+            for d3d11_element in d3d11GameType.D3D11ElementList
+        )
+        return (GlobalConfig.gamename, element_layout)
+
+    @classmethod
+    def clear_cache(cls):
+        cls._plan_cache.clear()
+
+    def __init__(self,d3d11GameType:D3D11GameType) -> None:
+        self.d3d11GameType = d3d11GameType
+
+        self.dtype = self.compile_dtype()
+        self.element_plan_list:list[ExportElementPlan] = self.compile_element_plan_list()
+
+        # 每个Category在一个顶点中的字节偏移和步长，按CategoryStrideDict的顺序排列
+        self.category_offset_list:list[tuple[str,int,int]] = []
+        stride_offset = 0
+        for categoryname,category_stride in d3d11GameType.CategoryStrideDict.items():
+            self.category_offset_list.append((categoryname, stride_offset, category_stride))
+            stride_offset += category_stride
+
+        # 没有BLENDWEIGHTS和BLENDINDICES时，不需要读取顶点组权重
+        # 否则每个SemanticIndex对应4个权重，比如BLENDWEIGHTS和BLENDWEIGHTS1就需要每个顶点的前8个顶点组
+        blend_semantic_index_list = [element_plan.d3d11_element.SemanticIndex for element_plan in self.element_plan_list if element_plan.source in ("BLENDINDICES","BLENDWEIGHT","BLENDWEIGHT_UNORM")]
+        self.need_blend_data = len(blend_semantic_index_list) > 0
+        self.blend_semantic_count = max(blend_semantic_index_list) + 1 if self.need_blend_data else 0
+
+    def compile_vector_element_plan(self,element_name:str,d3d11_element,source:str) -> ExportElementPlan:
+        '''
+        POSITION、NORMAL、TANGENT、BINORMAL都是从Blender读取三分量向量，
+        四分量格式按照W_FILL_RULES填充W，UNORM格式的方向向量先映射到[0,1]，最后按格式编码
+        '''
+        element_format = d3d11_element.Format
+        component_count = 4 if MigotoUtils.format_components(element_format) >= 4 else 3
+        w_fill = self.match_w_fill(source, element_format) if component_count == 4 else None
+
+        # POSITION不是方向向量，不做映射
+        remap_signed_to_unsigned = source != "POSITION" and element_format.endswith("_UNORM")
+
+        element_plan = ExportElementPlan(element_name, d3d11_element, source, self.get_vector_format_converter(element_format), component_count=component_count, w_fill=w_fill)
+        element_plan.remap_signed_to_unsigned = remap_signed_to_unsigned
+        return element_plan
+
+    @classmethod
+    def match_w_fill(cls,source:str,element_format:str):
+        game_category = GlobalConfig.get_game_category()
+        for rule_source, rule_format, rule_game, w_fill in cls.W_FILL_RULES:
+            if rule_source != source:
+                continue
+            if rule_format is not None and rule_format != element_format:
+                continue
+            if rule_game is not None and rule_game != GlobalConfig.gamename and rule_game != game_category:
+                continue
+            return w_fill
+        return None
+
+    @classmethod
+    def get_vector_format_converter(cls,element_format:str):
+        '''
+        按Format把float32向量编码为目标格式，SNORM和UNORM按位宽缩放，16位FLOAT转为float16
+        '''
+        np_type = MigotoUtils.get_nptype_from_format(element_format)
+        if element_format.endswith("_UNORM"):
+            if np_type == numpy.uint16:
+                return MeshFormatConverter.convert_4x_float32_to_r16g16b16a16_unorm
+            return MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm
+        elif element_format.endswith("_SNORM"):
+            if np_type == numpy.int16:
+                return MeshFormatConverter.convert_4x_float32_to_r16g16b16a16_snorm
+            return MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_snorm
+        elif np_type == numpy.float16:
+            return cls.convert_float16
+        return cls.convert_none
+
+    def compile_dtype(self) -> numpy.dtype:
+        dtype_list = []
+        for d3d11_element_name in self.d3d11GameType.OrderedFullElementList:
+            d3d11_element = self.d3d11GameType.ElementNameD3D11ElementDict[d3d11_element_name]
+            np_type = MigotoUtils.get_nptype_from_format(d3d11_element.Format)
+            format_len = MigotoUtils.format_components(d3d11_element.Format)
+
+            # XXX 长度为1时必须手动指定为(1,)否则会变成1维数组
+            if format_len == 1:
+                dtype_list.append((d3d11_element_name, (np_type, (1,))))
+            else:
+                dtype_list.append((d3d11_element_name, (np_type, format_len)))
+        return numpy.dtype(dtype_list)
+
+    def compile_element_plan_list(self) -> list[ExportElementPlan]:
+        element_plan_list = []
+        for d3d11_element_name in self.d3d11GameType.OrderedFullElementList:
+            d3d11_element = self.d3d11GameType.ElementNameD3D11ElementDict[d3d11_element_name]
+            element_format = d3d11_element.Format
+            element_plan = None
+
+            if d3d11_element_name in ("POSITION","NORMAL","TANGENT"):
+                element_plan = self.compile_vector_element_plan(d3d11_element_name, d3d11_element, d3d11_element_name)
+
+            elif d3d11_element_name.startswith('BINORMAL'):
+                #  YYSLS需要BINORMAL导出
+                element_plan = self.compile_vector_element_plan(d3d11_element_name, d3d11_element, "BINORMAL")
+
+            elif d3d11_element_name.startswith('COLOR'):
+                if element_format == 'R16G16B16A16_FLOAT':
+                    converter = self.convert_float16
+                elif element_format == "R16G16_FLOAT":
+                    converter = self.convert_first_two
+                elif element_format == 'R8G8B8A8_UNORM':
+                    converter = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm
+                else:
+                    converter = self.convert_none
+                element_plan = ExportElementPlan(d3d11_element_name, d3d11_element, "COLOR", converter)
+
+            elif d3d11_element_name.startswith('TEXCOORD') and element_format.endswith('FLOAT'):
+                converter = self.convert_float16 if element_format == 'R16G16_FLOAT' else self.convert_none
+                element_plan = ExportElementPlan(d3d11_element_name, d3d11_element, "TEXCOORD", converter)
+
+            elif d3d11_element_name.startswith('BLENDINDICES'):
+                if element_format in ("R32G32B32A32_SINT", "R16G16B16A16_UINT", "R32G32B32A32_UINT", "R8G8B8A8_UINT"):
+                    converter = self.convert_none
+                elif element_format == "R32G32_UINT":
+                    converter = self.convert_first_two
+                elif element_format == "R32_UINT":
+                    converter = self.convert_first_one
+                elif element_format == 'R8G8B8A8_SNORM':
+                    converter = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_snorm
+                elif element_format == 'R8G8B8A8_UNORM':
+                    converter = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm
+                else:
+                    converter = None
+
+                if converter is not None:
+                    element_plan = ExportElementPlan(d3d11_element_name, d3d11_element, "BLENDINDICES", converter)
+
+            elif d3d11_element_name.startswith('BLENDWEIGHT'):
+                if element_format == "R32G32B32A32_FLOAT":
+                    converter = self.convert_none
+                elif element_format == "R32G32_FLOAT":
+                    converter = self.convert_first_two
+                elif element_format == 'R8G8B8A8_SNORM':
+                    converter = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_snorm
+                elif element_format == 'R8G8B8A8_UNORM':
+                    converter = MeshFormatConverter.convert_4x_float32_to_r8g8b8a8_unorm_blendweights
+                else:
+                    converter = None
+
+                if element_format == 'R8G8B8A8_UNORM':
+                    # 需要把所有SemanticIndex的权重拼在一起整体量化
+                    element_plan = ExportElementPlan(d3d11_element_name, d3d11_element, "BLENDWEIGHT_UNORM", converter)
+                elif converter is not None:
+                    element_plan = ExportElementPlan(d3d11_element_name, d3d11_element, "BLENDWEIGHT", converter)
+
+            # 不支持的元素保持为0，和之前一样
+            if element_plan is not None:
+                element_plan_list.append(element_plan)
+
+        return element_plan_list
+
+    @classmethod
+    def convert_none(cls,input_array):
+        return input_array
+
+    @classmethod
+    def convert_float16(cls,input_array):
+        return input_array.astype(numpy.float16)
+
+    @classmethod
+    def convert_first_two(cls,input_array):
+        return input_array[:, :2]
+
+    @classmethod
+    def convert_first_one(cls,input_array):
+        return input_array[:, :1]
@@ -1,52 +1,159 @@
+import os
 import bpy
 
+from concurrent.futures import Future, ThreadPoolExecutor
+
 from ..utils.obj_utils import ObjUtils
 
 from ..migoto.migoto_format import D3D11GameType,ObjModel
 from ..config.main_config import GlobalConfig
+from ..properties.properties_generate_mod import Properties_GenerateMod
 from .buffer_model import BufferModel
+from .vertex_cache_optimizer import VertexCacheOptimizer
 from ..utils.timer_utils import TimerUtils
+from ..utils.memory_utils import MemoryUtils
 
-def get_buffer_ib_vb_fast(d3d11GameType:D3D11GameType):
+
+class ExportExecutor:
     '''
-    使用Numpy直接从当前选中的obj的mesh中转换数据到目标格式Buffer
+    导出计算使用的线程池
+
+    只有读取mesh数据需要访问bpy，必须在主线程中执行；
+    格式转换、权重量化、去重和重计算都是numpy的整体数组操作，计算时会释放GIL，
+    所以主线程读取完一个obj的数据后就提交到线程池，接着读取下一个obj，多个obj的计算可以同时进行。
+    这里不用进程池，因为Blender内置的Python无法正常启动子进程，而且进程间还要复制全部顶点数据。
+    '''
+    executor = None
+
+    @classmethod
+    def get_max_workers(cls) -> int:
+        return os.cpu_count() or 4
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        if cls.executor is None:
+            cls.executor = ThreadPoolExecutor(max_workers=cls.get_max_workers(), thread_name_prefix="ExportCompute")
+        return cls.executor
+
+    @classmethod
+    def submit(cls,fn,*args) -> Future:
+        '''
+        提交计算任务，未开启并行导出时直接在当前线程计算，同样返回Future，调用方不需要区分
+        '''
+        if Properties_GenerateMod.use_parallel_export():
+            return cls.get_executor().submit(fn, *args)
+
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @classmethod
+    def get_max_in_flight(cls) -> int:
+        '''
+        流式导出时最多同时保留多少个已提交但还没有取回结果的obj
+        超过这个数量时先按顺序取回最早提交的结果，这样同一时间只有少量obj的数据在内存中
+        '''
+        if Properties_GenerateMod.use_parallel_export():
+            return cls.get_max_workers()
+        return 1
+
+    @classmethod
+    def shutdown(cls):
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=True)
+            cls.executor = None
+
+
+def gather_buffer_model(obj:bpy.types.Object,d3d11GameType:D3D11GameType,normalize_weights:bool = False) -> BufferModel:
+    '''
+    在主线程中读取obj的mesh数据，返回的BufferModel不再持有任何bpy对象
+    normalize_weights为True时在计算权重时对顶点组做Normalize All规格化，不修改obj本身
     '''
-    TimerUtils.Start("get_buffer_ib_vb_fast")
     buffer_model = BufferModel(d3d11GameType=d3d11GameType)
 
-    obj = ObjUtils.get_bpy_context_object()
     buffer_model.check_and_verify_attributes(obj)
     # print("正在计算物体Buffer数据: " + obj.name)
-    
+
     # Nico: 通过evaluated_get获取到的是一个新的mesh，用于导出，不影响原始Mesh
-    mesh = obj.evaluated_get(bpy.context.evaluated_depsgraph_get()).to_mesh()
+    obj_eval = obj.evaluated_get(bpy.context.evaluated_depsgraph_get())
+    mesh = obj_eval.to_mesh()
+
+    try:
+        gather_buffer_model_from_mesh(buffer_model, obj, mesh, normalize_weights=normalize_weights)
+    finally:
+        # 读取完成后BufferModel只持有numpy数组，临时mesh立即释放，不再等到导出结束
+        obj_eval.to_mesh_clear()
+
+    MemoryUtils.sample("Gather " + obj.name)
+    return buffer_model
 
-    # 三角化mesh
-    ObjUtils.mesh_triangulate(mesh)
+
+def gather_buffer_model_from_mesh(buffer_model:BufferModel,obj:bpy.types.Object,mesh:bpy.types.Mesh,normalize_weights:bool = False,vertex_group_triples = None):
+    '''
+    三角化evaluated mesh、计算TANGENT并把数据读取到buffer_model中，mesh由调用方负责释放
+    导出缓存先对三角化之前的mesh计算哈希，未命中时再调用这里，见ExportCache.submit_buffer_ib_vb
+    '''
+    # 全部是三角面时bmesh三角化不会改变mesh，直接跳过
+    # 存在四边面或多边形时必须先三角化再calc_tangents，这样TANGENT和法线都基于导出的三角形计算，三角形顺序也和bmesh一致
+    # 这里不能改用loop_triangles展开四边面，即使不需要TANGENT也不行:
+    # 四边面的面法线会影响平滑和锐边的法线，三角形的顺序和起始顶点也和bmesh.ops.triangulate不同，导出结果会变化
+    if BufferModel.mesh_has_non_triangles(mesh):
+        ObjUtils.mesh_triangulate(mesh)
 
     # Calculates tangents and makes loop normals valid (still with our custom normal data from import time):
     # 前提是有UVMap，前面的步骤应该保证了模型至少有一个TEXCOORD.xy
     mesh.calc_tangents()
 
-    # 读取并解析数据
-    buffer_model.parse_elementname_ravel_ndarray_dict(mesh)
+    # 读取数据
+    buffer_model.gather_mesh_source_data(obj, mesh, normalize_weights=normalize_weights, vertex_group_triples=vertex_group_triples)
+    buffer_model.obj_name = obj.name
+    buffer_model.optimize_vertex_cache = Properties_GenerateMod.use_vertex_cache_optimization()
+
+
+def compute_buffer_ib_vb(buffer_model:BufferModel):
+    '''
+    把gather_buffer_model读取的数据转换到目标格式Buffer
+    不访问bpy，可以在线程池中执行
+    '''
+    # 转换数据
+    buffer_model.parse_elementname_ravel_ndarray_dict()
 
     obj_model = ObjModel()
 
     # 因为只有存在TANGENT时，顶点数才会增加，所以如果是GF2并且存在TANGENT才使用共享TANGENT防止增加顶点数
     if GlobalConfig.gamename == "GF2" and "TANGENT" in buffer_model.d3d11GameType.OrderedFullElementList:
-        obj_model = buffer_model.calc_index_vertex_buffer_girlsfrontline2(obj, mesh)
+        obj_model = buffer_model.calc_index_vertex_buffer_girlsfrontline2()
 
     elif GlobalConfig.gamename == "WWMI" or GlobalConfig.gamename == "WuWa":
-        obj_model = buffer_model.calc_index_vertex_buffer_wwmi(obj, mesh)
+        obj_model = buffer_model.calc_index_vertex_buffer_wwmi()
     else:
         # 计算IndexBuffer和CategoryBufferDict
-        obj_model = buffer_model.calc_index_vertex_buffer_universal(obj, mesh)
-    
-    TimerUtils.End("get_buffer_ib_vb_fast")
-    
-    return obj_model.ib, obj_model.category_buffer_dict, obj_model.index_vertex_id_dict
+        obj_model = buffer_model.calc_index_vertex_buffer_universal()
 
+    # WWMI导出的是所有Component融合后的一个obj，整体重排会跨越Component的边界，所以不做顶点缓存优化
+    if buffer_model.optimize_vertex_cache and GlobalConfig.gamename not in ["WWMI", "WuWa"]:
+        return VertexCacheOptimizer.optimize(obj_model.ib, obj_model.category_buffer_dict, obj_model.index_vertex_id_ndarray, obj_name=buffer_model.obj_name)
 
+    return obj_model.ib, obj_model.category_buffer_dict, obj_model.index_vertex_id_ndarray
 
 
+def submit_buffer_ib_vb(obj:bpy.types.Object,d3d11GameType:D3D11GameType,normalize_weights:bool = False) -> Future:
+    '''
+    主线程读取数据后把计算提交到线程池，Future的结果和get_buffer_ib_vb_fast的返回值相同
+    '''
+    buffer_model = gather_buffer_model(obj, d3d11GameType, normalize_weights=normalize_weights)
+    return ExportExecutor.submit(compute_buffer_ib_vb, buffer_model)
+
+
+def get_buffer_ib_vb_fast(d3d11GameType:D3D11GameType):
+    '''
+    使用Numpy直接从当前选中的obj的mesh中转换数据到目标格式Buffer
+    '''
+    TimerUtils.Start("get_buffer_ib_vb_fast")
+    obj = ObjUtils.get_bpy_context_object()
+    result = compute_buffer_ib_vb(gather_buffer_model(obj, d3d11GameType))
+    TimerUtils.End("get_buffer_ib_vb_fast")
+    return result
@@ -6,145 +6,115 @@ class MeshData:
     '''
     MeshClass用于获取每一个obj的mesh对象中的数据，加快导出速度。
     '''
-    
+
     def __init__(self,mesh:bpy.types.Mesh) -> None:
         self.mesh = mesh
 
-    def get_blendweights_blendindices_v1(self,normalize_weights:bool = False):
-        # TODO 下面这里是获取BLENDWEIGHTS和BLENDINDICES的代码，但是只支持前四个BLENDWEIGHTS和BLENDINDICES
-        # 我们需要扩展让它支持任意多个，并且每四个为一组
-        # 比如BLENDWEIGHTS R8G8B8A8_UNORM  BLENDWEIGHTS1 R8G8B8A8_UNORM  
-        # 也会有对应的BLENDINDICES和BLENDINDICES1，数据类型为R8G8B8A8_UINT等等
-        # 数据类型是后面决定的，但是我们这里要提前准备好BLENDWEIGHTS和BLENDINDICES的内容，反正肯定不是4个
-        # 创建一个包含所有循环顶点索引的NumPy数组
-        mesh_loops = self.mesh.loops
-        mesh_loops_length = len(mesh_loops)
+    def get_vertex_group_triples(self):
+        '''
+        一次性取出所有顶点的(顶点, 顶点组, 权重)数据，展开为三个一维数组
+
+        Blender没有提供批量读取顶点组权重的foreach_get，所以这里只遍历一次，不做任何逐顶点的排序和数组写入
+        '''
         mesh_vertices = self.mesh.vertices
+        mesh_vertices_length = len(mesh_vertices)
+
+        vertex_groups_list = [v.groups for v in mesh_vertices]
+        group_counts = numpy.fromiter(map(len, vertex_groups_list), dtype=numpy.int64, count=mesh_vertices_length)
+        group_total = int(group_counts.sum())
 
-        loop_vertex_indices = numpy.empty(mesh_loops_length, dtype=int)
-        mesh_loops.foreach_get("vertex_index", loop_vertex_indices)
+        vertex_indices = numpy.repeat(numpy.arange(mesh_vertices_length, dtype=numpy.int64), group_counts)
+        group_indices = numpy.fromiter((g.group for groups in vertex_groups_list for g in groups), dtype=numpy.int64, count=group_total)
+        group_weights = numpy.fromiter((g.weight for groups in vertex_groups_list for g in groups), dtype=numpy.float32, count=group_total)
+        return vertex_indices, group_indices, group_weights, group_counts
 
-        max_groups = 4
+    @classmethod
+    def normalize_vertex_group_weights(cls,vertex_group_triples,vertex_group_lock_flags,mesh_vertices_length:int):
+        '''
+        按照Blender的Normalize All(vertex_group_normalize_all)的规则对顶点组权重做规格化，返回新的权重数组，不修改obj本身
 
-        # Extract and sort the top 4 groups by weight for each vertex.
-        sorted_groups = [
-            sorted(v.groups, key=lambda x: x.weight, reverse=True)[:max_groups]
-            for v in mesh_vertices
-        ]
+        - 锁定的顶点组权重保持不变
+        - 每个顶点未锁定的权重等比例缩放，使其总和为 max(0, 1 - 锁定的权重之和)
+        - 只有一个顶点组并且未锁定的顶点，权重直接设为1
+        - 未锁定的权重总和为0的顶点保持不变
 
-        # Initialize arrays to hold all groups and weights with zeros.
-        all_groups = numpy.zeros((len(mesh_vertices), max_groups), dtype=int)
-        all_weights = numpy.zeros((len(mesh_vertices), max_groups), dtype=numpy.float32)
+        之前是切换到权重绘制模式调用bpy.ops，每个obj要切换两次模式并重新计算depsgraph，
+        比导出计算本身还慢，而且会修改用户的数据
+        '''
+        vertex_indices, group_indices, group_weights, group_counts = vertex_group_triples
+        if len(group_weights) == 0:
+            return group_weights
+
+        lock_flags = numpy.asarray(vertex_group_lock_flags, dtype=bool)
+        locked_mask = numpy.zeros(len(group_indices), dtype=bool)
+        valid_mask = group_indices < len(lock_flags)
+        locked_mask[valid_mask] = lock_flags[group_indices[valid_mask]]
+        unlocked_mask = ~locked_mask
+
+        unlocked_sums = numpy.bincount(vertex_indices, weights=numpy.where(unlocked_mask, group_weights, 0), minlength=mesh_vertices_length).astype(numpy.float32)
+        locked_sums = numpy.bincount(vertex_indices, weights=numpy.where(locked_mask, group_weights, 0), minlength=mesh_vertices_length).astype(numpy.float32)
+
+        remaining_weights = numpy.maximum(numpy.float32(0), numpy.float32(1) - locked_sums)
+        # 和Blender一样按 (1 / 未锁定的权重之和) * 剩余权重 计算缩放比例
+        scalars = numpy.ones(mesh_vertices_length, dtype=numpy.float32)
+        numpy.divide(numpy.float32(1), unlocked_sums, out=scalars, where=unlocked_sums > 0)
+        scalars = numpy.where(unlocked_sums > 0, scalars * remaining_weights, numpy.float32(1))
+
+        normalized_weights = numpy.where(unlocked_mask, numpy.clip(group_weights * scalars[vertex_indices], 0, 1), group_weights).astype(numpy.float32)
+        normalized_weights[unlocked_mask & (group_counts[vertex_indices] == 1)] = 1.0
+        return normalized_weights
+
+    @classmethod
+    def calc_blendweights_blendindices(cls,vertex_group_triples,loop_vertex_indices,mesh_vertices_length:int,blend_semantic_count:int = 1,vertex_group_lock_flags = None):
+        '''
+        每个顶点取权重最大的 blend_semantic_count * 4 个顶点组，规格化后每4个为一组，
+        生成 blend_semantic_count 组 BLENDWEIGHTS 和 BLENDINDICES，字典的key就是SemanticIndex
 
+        比如燕云十六声的 BLENDWEIGHTS 和 BLENDWEIGHTS1，对应的就是每个顶点权重最大的前8个顶点组
 
-        # Fill the pre-allocated arrays with group indices and weights.
-        for v_index, groups in enumerate(sorted_groups):
-            num_groups = min(len(groups), max_groups)
-            all_groups[v_index, :num_groups] = [g.group for g in groups][:num_groups]
-            all_weights[v_index, :num_groups] = [g.weight for g in groups][:num_groups]
+        排序规则和之前逐顶点 sorted(v.groups, key=lambda x: x.weight, reverse=True) 一致，权重相同时保持顶点组原本的顺序，
+        不足的部分填充0
 
-        # Initialize the blendindices and blendweights with zeros.
-        blendindices = numpy.zeros((mesh_loops_length, max_groups), dtype=numpy.uint32)
-        blendweights = numpy.zeros((mesh_loops_length, max_groups), dtype=numpy.float32)
+        只使用get_vertex_group_triples读取出来的数组，不访问bpy，所以可以在主线程读取完数据后放到线程池中执行
+
+        传入vertex_group_lock_flags时，先按Normalize All的规则对所有顶点组做规格化，再取权重最大的几个
+        '''
+        max_groups = blend_semantic_count * 4
 
-        # Map from loop_vertex_indices to precomputed data using advanced indexing.
-        valid_mask = (0 <= numpy.array(loop_vertex_indices)) & (numpy.array(loop_vertex_indices) < len(mesh_vertices))
-        valid_indices = loop_vertex_indices[valid_mask]
+        vertex_indices, group_indices, group_weights, group_counts = vertex_group_triples
+        if vertex_group_lock_flags is not None:
+            group_weights = cls.normalize_vertex_group_weights(vertex_group_triples, vertex_group_lock_flags, mesh_vertices_length)
 
-        blendindices[valid_mask] = all_groups[valid_indices]
-        blendweights[valid_mask] = all_weights[valid_indices]
+        # 把所有顶点组放到一个按顶点对齐的矩阵里，每行是一个顶点的全部顶点组
+        max_groups_per_vertex = int(group_counts.max()) if mesh_vertices_length > 0 else 0
+        group_starts = numpy.cumsum(group_counts) - group_counts
+        group_columns = numpy.arange(len(group_indices), dtype=numpy.int64) - group_starts[vertex_indices]
+
+        padded_width = max(max_groups_per_vertex, max_groups)
+        padded_groups = numpy.zeros((mesh_vertices_length, padded_width), dtype=numpy.int64)
+        padded_weights = numpy.zeros((mesh_vertices_length, padded_width), dtype=numpy.float32)
+        padded_groups[vertex_indices, group_columns] = group_indices
+        padded_weights[vertex_indices, group_columns] = group_weights
+
+        # 降序稳定排序，填充的位置排序key为inf，保证排在所有真实顶点组(包括权重为0的)之后
+        sort_keys = -padded_weights
+        sort_keys[numpy.arange(padded_width) >= group_counts[:, None]] = numpy.inf
+        topk_order = numpy.argsort(sort_keys, axis=1, kind="stable")[:, :max_groups]
+
+        topk_groups = numpy.take_along_axis(padded_groups, topk_order, axis=1)
+        topk_weights = numpy.take_along_axis(padded_weights, topk_order, axis=1)
 
         # XXX 必须对当前obj对象执行权重规格化，否则模型细分后会导致模型坑坑洼洼
-        
-        blendweights = blendweights / numpy.sum(blendweights, axis=1)[:, None]
+        # 没有任何顶点组的顶点保持为0，而不是除以0得到NaN
+        weight_sums = numpy.sum(topk_weights, axis=1)[:, None]
+        topk_weights = numpy.divide(topk_weights, weight_sums, out=numpy.zeros_like(topk_weights), where=weight_sums != 0)
 
-        blendweights_dict = {}
-        blendindices_dict = {}
+        loop_blendindices = topk_groups[loop_vertex_indices].astype(numpy.uint32)
+        loop_blendweights = topk_weights[loop_vertex_indices]
 
-        blendweights_dict[0] = blendweights
-        blendindices_dict[0] = blendindices
-        return blendweights_dict, blendindices_dict
-    
-    
-    # TODO V2暂时不能启用，因为无法解决Normalize All的问题。
-    def get_blendweights_blendindices_v2(self):
-        '''
-        升级版，支持多个SemanticIndex的BLENDWEIGHTS和BLENDINDICES
-        '''
-        
-        mesh_loops = self.mesh.loops
-        mesh_loops_length = len(mesh_loops)
-        mesh_vertices = self.mesh.vertices
-        
-        loop_vertex_indices = numpy.empty(mesh_loops_length, dtype=int)
-        mesh_loops.foreach_get("vertex_index", loop_vertex_indices)
-        
-        # 计算每个顶点的最大组数（向上取整到最近的4的倍数）
-        max_groups_per_vertex = 0
-        for v in mesh_vertices:
-            group_count = len(v.groups)
-            if group_count > max_groups_per_vertex:
-                max_groups_per_vertex = group_count
-        
-        # 将最大组数对齐到4的倍数（每个语义索引包含4个权重）
-        max_groups_per_vertex = ((max_groups_per_vertex + 3) // 4) * 4
-        num_semantics = max_groups_per_vertex // 4  # 需要的语义索引数量
-        
-        # 为每个顶点存储所有组和权重（填充0）
-        all_groups = numpy.zeros((len(mesh_vertices), max_groups_per_vertex), dtype=int)
-        
-        all_weights = numpy.zeros((len(mesh_vertices), max_groups_per_vertex), dtype=numpy.float32)
-        
-        # 填充权重和组数据
-        for v_index, v in enumerate(mesh_vertices):
-            groups = sorted(v.groups, key=lambda x: x.weight, reverse=True)
-            
-            # 提取权重并规格化
-            weights = numpy.array([g.weight for g in groups], dtype=numpy.float32)
-
-            # 这个归一化，我测试了，细分之后不管是否归一化都对最终效果没有影响
-            # 所以这个代码实际上没啥用，但是仍然保留以防万一。
-            if len(weights) > 0:
-                total_weight = numpy.sum(weights)
-                if total_weight > 0:
-                    weights = weights / total_weight
-            
-            # 填充到数组中
-            num_groups = min(len(groups), max_groups_per_vertex)
-            all_groups[v_index, :num_groups] = [g.group for g in groups][:num_groups]
-            all_weights[v_index, :num_groups] = weights[:num_groups]
-        
-        # 创建存储多个BLENDWEIGHTS/BLENDINDICES的字典
         blendweights_dict = {}
         blendindices_dict = {}
-        
-        # 为每个语义索引创建数据
-        for semantic_index in range(num_semantics):
-            start_idx = semantic_index * 4
-            end_idx = start_idx + 4
-            
-            # 初始化loop级别的数组
-            loop_blendweights = numpy.zeros((mesh_loops_length, 4), dtype=numpy.float32)
-            # loop_blendweights = numpy.full((mesh_loops_length, 4), -1, dtype=int)
-
-
-            loop_blendindices = numpy.zeros((mesh_loops_length, 4), dtype=numpy.uint32)
-            
-            # 映射顶点数据到loop
-            valid_mask = (loop_vertex_indices >= 0) & (loop_vertex_indices < len(mesh_vertices))
-            valid_indices = loop_vertex_indices[valid_mask]
-            
-            if len(valid_indices) > 0:
-                # 获取当前语义索引对应的4个权重/组
-                weights_slice = all_weights[valid_indices, start_idx:end_idx]
-                groups_slice = all_groups[valid_indices, start_idx:end_idx]
-                
-                # 填充到loop数组
-                loop_blendweights[valid_mask] = weights_slice
-                loop_blendindices[valid_mask] = groups_slice
-            
-            # 存储到字典
-            blendweights_dict[semantic_index] = loop_blendweights
-            blendindices_dict[semantic_index] = loop_blendindices
-        
+        for semantic_index in range(blend_semantic_count):
+            blendweights_dict[semantic_index] = loop_blendweights[:, semantic_index * 4:semantic_index * 4 + 4]
+            blendindices_dict[semantic_index] = loop_blendindices[:, semantic_index * 4:semantic_index * 4 + 4]
         return blendweights_dict, blendindices_dict
@@ -2,7 +2,6 @@ import math
 import numpy
 
 from ..properties.properties_generate_mod import Properties_GenerateMod
-from ..utils.timer_utils import TimerUtils
 from ..utils.log_utils import LOG
 
 class MeshFormatConverter:
@@ -35,6 +34,15 @@ class MeshFormatConverter:
     '''
     这四个UNORM和SNORM比较特殊需要这样处理，其它float类型转换直接astype就行
     '''
+    @classmethod
+    def remap_signed_to_unsigned(cls, input_array):
+        '''
+        因为法线数据是[-1,1]如果非要导出成UNORM，那一定是进行了归一化到[0,1]
+        归一化 (此处感谢 球球 的代码开发)，只处理XYZ，W分量是声明好的固定值或副切线符号，保持不变
+        '''
+        input_array[:, :3] = (input_array[:, :3] + 1) * 0.5
+        return input_array
+
     @classmethod
     def convert_4x_float32_to_r8g8b8a8_snorm(cls, input_array):
         return numpy.round(input_array * 127).astype(numpy.int8)
@@ -56,69 +64,83 @@ class MeshFormatConverter:
         return numpy.round(input_array * 32767).astype(numpy.int16)
     
     @classmethod
-    def average_normal_tangent(cls,obj,indexed_vertices,d3d11GameType,dtype):
+    def get_position_group_ids(cls,positions):
+        '''
+        把POSITION完全相同的顶点分为一组，返回每个顶点的分组号、排序索引和分组边界
+
+        排序后每遇到一次位置变化分组号就加1，再按sort_indices放回原来的顺序
+        '''
+        # 对位置进行排序，以便相同的位置会相邻
+        sort_indices = numpy.lexsort(positions.T)
+        sorted_positions = positions[sort_indices]
+
+        # 找出位置变化的地方，即我们需要分组的地方
+        group_change_mask = numpy.any(sorted_positions[:-1] != sorted_positions[1:], axis=1)
+        group_indices = numpy.flatnonzero(group_change_mask)
+        group_indices = numpy.r_[0, group_indices + 1, len(sorted_positions)]
+
+        position_group_ids = numpy.empty(len(positions), dtype=numpy.int64)
+        position_group_ids[sort_indices] = numpy.r_[0, numpy.cumsum(group_change_mask)]
+        return position_group_ids, sort_indices, group_indices
+
+    @classmethod
+    def allow_recalculate_tangent(cls,obj) -> bool:
+        '''
+        全局勾选了重计算TANGENT，或者obj在右键菜单中标记了重计算TANGENT
+        需要读取bpy数据，所以要在主线程中调用
+        '''
+        if Properties_GenerateMod.recalculate_tangent():
+            return True
+        return bool(obj.get("3DMigoto:RecalculateTANGENT",False))
+
+    @classmethod
+    def allow_recalculate_color(cls,obj) -> bool:
+        '''
+        全局勾选了重计算COLOR，或者obj在右键菜单中标记了重计算COLOR
+        需要读取bpy数据，所以要在主线程中调用
+        '''
+        if Properties_GenerateMod.recalculate_color():
+            return True
+        return bool(obj.get("3DMigoto:RecalculateCOLOR",False))
+
+    @classmethod
+    def average_normal_tangent(cls,indexed_vertices,d3d11GameType,allow_calc:bool):
         '''
         Nico: 米游所有游戏都能用到这个，还有曾经的GPU-PreSkinning的GF2也会用到这个，崩坏三2.0新角色除外。
         尽管这个可以起到相似的效果，但是仍然无法完美获取模型本身的TANGENT数据，只能做到身体轮廓线99%近似。
         经过测试，头发轮廓线部分并不是简单的向量归一化，也不是算术平均归一化。
+
+        indexed_vertices是去重后的结构化顶点数组，这里直接在上面修改TANGENT并返回。
+        allow_calc由allow_recalculate_tangent在主线程中得到，这里不访问bpy，可以在线程池中执行。
         '''
         # TimerUtils.Start("Recalculate TANGENT")
 
         if "TANGENT" not in d3d11GameType.OrderedFullElementList:
             return indexed_vertices
-        allow_calc = False
-        if Properties_GenerateMod.recalculate_tangent():
-            allow_calc = True
-        elif obj.get("3DMigoto:RecalculateTANGENT",False): 
-            allow_calc = True
         
-        if not allow_calc:
+        if not allow_calc or len(indexed_vertices) == 0:
             return indexed_vertices
         
-        # 不用担心这个转换的效率，速度非常快
-        vb = bytearray()
-        for vertex in indexed_vertices:
-            vb += bytes(vertex)
-        vb = numpy.frombuffer(vb, dtype = dtype)
+        vb = numpy.ascontiguousarray(indexed_vertices)
 
         # 开始重计算TANGENT
-        positions = numpy.array([val['POSITION'] for val in vb])
-        normals = numpy.array([val['NORMAL'] for val in vb], dtype=float)
+        # 每个顶点所属的位置分组，这样就不需要用位置的tuple作为key构建字典再逐个顶点查找了
+        position_group_ids, sort_indices, group_indices = cls.get_position_group_ids(vb['POSITION'])
 
-        # 对位置进行排序，以便相同的位置会相邻
-        sort_indices = numpy.lexsort(positions.T)
-        sorted_positions = positions[sort_indices]
-        sorted_normals = normals[sort_indices]
-
-        # 找出位置变化的地方，即我们需要分组的地方
-        group_indices = numpy.flatnonzero(numpy.any(sorted_positions[:-1] != sorted_positions[1:], axis=1))
-        group_indices = numpy.r_[0, group_indices + 1, len(sorted_positions)]
-
-        # 累加法线和计算计数
-        unique_positions = sorted_positions[group_indices[:-1]]
+        # 累加法线
+        sorted_normals = vb['NORMAL'].astype(float)[sort_indices]
         accumulated_normals = numpy.add.reduceat(sorted_normals, group_indices[:-1], axis=0)
-        counts = numpy.diff(group_indices)
 
         # 归一化累积法线向量
-        normalized_normals = accumulated_normals / numpy.linalg.norm(accumulated_normals, axis=1)[:, numpy.newaxis]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            normalized_normals = accumulated_normals / numpy.linalg.norm(accumulated_normals, axis=1)[:, numpy.newaxis]
         normalized_normals[numpy.isnan(normalized_normals)] = 0  # 处理任何可能出现的零向量导致的除零错误
 
-        # 构建结果字典
-        position_normal_dict = dict(zip(map(tuple, unique_positions), normalized_normals))
-
-        # TimerUtils.End("Recalculate TANGENT")
-
-        # 获取所有位置并转换为元组，用于查找字典
-        positions = [tuple(pos) for pos in vb['POSITION']]
-
-        # 从字典中获取对应的标准化法线
-        normalized_normals = numpy.array([position_normal_dict[pos] for pos in positions])
-
         # 计算 w 并调整 tangent 的第四个分量
         w = numpy.where(vb['TANGENT'][:, 3] >= 0, -1.0, 1.0)
 
         # 更新 TANGENT 分量，注意这里的切片操作假设 TANGENT 有四个分量
-        vb['TANGENT'][:, :3] = normalized_normals
+        vb['TANGENT'][:, :3] = normalized_normals[position_group_ids]
         vb['TANGENT'][:, 3] = w
 
         # TimerUtils.End("Recalculate TANGENT")
@@ -126,79 +148,56 @@ class MeshFormatConverter:
         return vb
 
     @classmethod
-    def average_normal_color(cls,obj,indexed_vertices,d3d11GameType,dtype):
+    def average_normal_color(cls,indexed_vertices,d3d11GameType,allow_calc:bool):
         '''
         Nico: 算数平均归一化法线，HI3 2.0角色使用的方法
+
+        相同POSITION的顶点的NORMAL取算数平均，从[-1,1]映射到[0,1]后写入COLOR的RGB，Alpha保持不变。
+        COLOR是整数格式(UNORM)时按该格式的最大值缩放后截断，是浮点格式时直接写入[0,1]的值。
+        allow_calc由allow_recalculate_color在主线程中得到。
         '''
         if "COLOR" not in d3d11GameType.OrderedFullElementList:
             return indexed_vertices
-        allow_calc = False
-        if Properties_GenerateMod.recalculate_color():
-            allow_calc = True
-        elif obj.get("3DMigoto:RecalculateCOLOR",False): 
-            allow_calc = True
-        if not allow_calc:
+        if not allow_calc or len(indexed_vertices) == 0:
             return indexed_vertices
 
         # 开始重计算COLOR
-        TimerUtils.Start("Recalculate COLOR")
-
-        # 不用担心这个转换的效率，速度非常快
-        vb = bytearray()
-        for vertex in indexed_vertices:
-            vb += bytes(vertex)
-        vb = numpy.frombuffer(vb, dtype = dtype)
-
-        # 首先提取所有唯一的位置，并创建一个索引映射
-        unique_positions, position_indices = numpy.unique(
-            [tuple(val['POSITION']) for val in vb], 
-            return_inverse=True, 
-            axis=0
-        )
-
-        # 初始化累积法线和计数器为零
-        accumulated_normals = numpy.zeros((len(unique_positions), 3), dtype=float)
-        counts = numpy.zeros(len(unique_positions), dtype=int)
-
-        # 累加法线并增加计数（这里假设vb是一个list）
-        for i, val in enumerate(vb):
-            accumulated_normals[position_indices[i]] += numpy.array(val['NORMAL'], dtype=float)
-            counts[position_indices[i]] += 1
-
-        # 对所有位置的法线进行一次性规范化处理
-        mask = counts > 0
-        average_normals = numpy.zeros_like(accumulated_normals)
-        average_normals[mask] = (accumulated_normals[mask] / counts[mask][:, None])
+        vb = numpy.ascontiguousarray(indexed_vertices)
 
-        # 归一化到[0,1]，然后映射到颜色值
-        normalized_normals = ((average_normals + 1) / 2 * 255).astype(numpy.uint8)
+        position_group_ids, _, group_indices = cls.get_position_group_ids(vb['POSITION'])
+        group_count = len(group_indices) - 1
 
-        # 更新颜色信息
-        new_color = []
-        for i, val in enumerate(vb):
-            color = [0, 0, 0, val['COLOR'][3]]  # 保留原来的Alpha通道
-            
-            if mask[position_indices[i]]:
-                color[:3] = normalized_normals[position_indices[i]]
+        # 按顶点顺序累加每个位置的法线，和之前逐个顶点累加的顺序一致
+        accumulated_normals = numpy.zeros((group_count, 3), dtype=float)
+        numpy.add.at(accumulated_normals, position_group_ids, vb['NORMAL'][:, :3].astype(float))
+        counts = numpy.bincount(position_group_ids, minlength=group_count)
 
-            new_color.append(color)
+        average_normals = accumulated_normals / counts[:, None]
 
-        # 将新的颜色列表转换为NumPy数组
-        new_color_array = numpy.array(new_color, dtype=numpy.uint8)
+        # 归一化到[0,1]，然后映射到颜色值
+        color_dtype = vb.dtype['COLOR'].base
+        if numpy.issubdtype(color_dtype, numpy.integer):
+            normalized_normals = ((average_normals + 1) / 2 * numpy.iinfo(color_dtype).max).astype(color_dtype)
+        else:
+            normalized_normals = ((average_normals + 1) / 2).astype(color_dtype)
 
-        # 更新vb中的颜色信息
-        for i, val in enumerate(vb):
-            val['COLOR'] = new_color_array[i]
+        # 更新颜色信息，R16G16_FLOAT这种只有两个分量的COLOR只写入前两个分量
+        color_component_count = min(3, vb['COLOR'].shape[1])
+        vb['COLOR'][:, :color_component_count] = normalized_normals[position_group_ids][:, :color_component_count]
 
-        TimerUtils.End("Recalculate COLOR")
         return vb
 
 
 
     @classmethod
     def convert_4x_float32_to_r8g8b8a8_unorm_blendweights(cls, input_array):
-        TimerUtils.Start("convert_4x_float32_to_r8g8b8a8_unorm_blendweights")
-        
+        '''
+        把每行权重量化为总和为255的UNORM整数，小数部分的误差按照ticket从大到小分配，
+        每行4个权重时，除了总和为0的行(这里全部分配给第一个位置，_bk2为全0)，逐行结果与_bk2一致
+        每行不限于4个权重，存在多个BLENDWEIGHTS时可以把8、12、16个权重拼成一行整体量化，
+        这时numpy按块累加的行总和可能和_bk2的sum()相差一个ulp，少数行的结果会不同
+        见benchmarks/bench_blendweights_unorm8.py
+        '''
         # 创建结果数组
         result = numpy.zeros_like(input_array, dtype=numpy.uint8)
         
@@ -209,7 +208,6 @@ class MeshFormatConverter:
         # 只处理非NaN行
         valid_input = input_array[valid_mask]
         if valid_input.size == 0:
-            TimerUtils.End("convert_4x_float32_to_r8g8b8a8_unorm_blendweights")
             return result
         
         # 计算每行总和
@@ -245,50 +243,31 @@ class MeshFormatConverter:
             )
         
         # 分配精度误差
-        output = int_part.copy()
-        for i in range(precision_error.max()):
-            # 找出需要分配的行
-            need_allocation = (precision_error > 0)
-            if not numpy.any(need_allocation):
-                break
-            
-            # 找出当前行中ticket最大的位置
-            max_ticket_mask = numpy.zeros_like(tickets, dtype=bool)
-            rows = numpy.where(need_allocation)[0]
-            
-            # 对于有ticket的行
-            has_ticket = (tickets[rows] > 0).any(axis=1)
-            if numpy.any(has_ticket):
-                ticket_rows = rows[has_ticket]
-                row_indices = ticket_rows[:, numpy.newaxis]
-                col_indices = tickets[ticket_rows].argmax(axis=1)
-                max_ticket_mask[ticket_rows, col_indices] = True
-                tickets[ticket_rows, col_indices] = 0
-            
-            # 对于没有ticket的行
-            no_ticket = ~has_ticket & need_allocation[rows]
-            if numpy.any(no_ticket):
-                no_ticket_rows = rows[no_ticket]
-                # 找出当前权重最大的位置
-                max_weight_mask = numpy.zeros_like(tickets, dtype=bool)
-                row_indices = no_ticket_rows[:, numpy.newaxis]
-                col_indices = output[no_ticket_rows].argmax(axis=1)
-                max_weight_mask[no_ticket_rows, col_indices] = True
-                max_ticket_mask |= max_weight_mask
-            
-            # 应用分配
-            output[max_ticket_mask] += 1
-            precision_error[need_allocation] -= 1
+        # 之前是循环最多255次，每次给每行ticket最大的位置加1，ticket用完后再给当前权重最大的位置加1
+        # 这里一次性算出每行的ticket排名，直接给排名在前precision_error个的位置加1，剩余的全部加到权重最大的位置，结果与逐次分配完全一致
+        # ticket相同时列号小的排在前面，和argmax取第一个最大值的行为一致
+        row_width = tickets.shape[1]
+        ticket_order = numpy.argsort(-tickets, axis=1, kind="stable")
+        ticket_rank = numpy.empty_like(ticket_order)
+        numpy.put_along_axis(ticket_rank, ticket_order, numpy.broadcast_to(numpy.arange(row_width), ticket_order.shape), axis=1)
+
+        allocation = numpy.maximum(precision_error, 0)
+        ticket_allocation = numpy.minimum(allocation, (tickets > 0).sum(axis=1))
+        output = int_part + (ticket_rank < ticket_allocation[:, numpy.newaxis])
+
+        # ticket用完之后，剩余的误差每次都会加到同一个当前权重最大的位置上
+        remaining_allocation = allocation - ticket_allocation
+        remaining_rows = numpy.nonzero(remaining_allocation > 0)[0]
+        remaining_cols = output[remaining_rows].argmax(axis=1)
+        output[remaining_rows, remaining_cols] += remaining_allocation[remaining_rows]
         
         # 将结果存回
         result[valid_mask] = output.astype(numpy.uint8)
         
-        TimerUtils.End("convert_4x_float32_to_r8g8b8a8_unorm_blendweights")
         return result
     
     @classmethod
     def convert_4x_float32_to_r8g8b8a8_unorm_blendweights_bk2(cls, input_array):
-        TimerUtils.Start("convert_4x_float32_to_r8g8b8a8_unorm_blendweights")
         # print(f"Input shape: {input_array.shape}")  # 输出形状 (1896, 4)
 
         result = numpy.zeros_like(input_array, dtype=numpy.uint8)
@@ -358,6 +337,5 @@ class MeshFormatConverter:
 
             row_normalized = normalized_weights
             result[i] = numpy.array(row_normalized, dtype=numpy.uint8)
-        TimerUtils.End("convert_4x_float32_to_r8g8b8a8_unorm_blendweights")
 
         return result
\ No newline at end of file
@@ -0,0 +1,206 @@
+import threading
+import numpy
+
+from ..utils.log_utils import LOG
+
+
+class VertexCacheOptimizer:
+    '''
+    导出时可选的顶点缓存优化
+
+    去重后的IB按照Blender的面顺序排列，顶点按第一次出现的顺序编号，没有考虑GPU的顶点后变换缓存和顶点读取的局部性。
+    这里对每个obj单独处理，也就是每个DrawIndexed范围内部：
+    (1) 用Tipsify算法重新排列三角形顺序，提高顶点后变换缓存的命中率
+    (2) 按新的三角形顺序中第一次使用的顺序重新编号顶点，同时重排所有CategoryBuffer和index_vertex_id_ndarray
+
+    每个obj的顶点和索引在DrawIB中都是连续的一段，所以不会跨越Component或者生效条件的边界。
+    三角形内部的索引顺序不变，面朝向也不会改变。
+
+    ACMR是平均每个三角形的缓存未命中数，ATVR是缓存未命中数除以顶点数，都是越小越好，ATVR最小为1。
+    '''
+    # 模拟的FIFO顶点缓存大小，Tipsify排序和ACMR/ATVR统计都使用这个大小
+    cache_size = 16
+
+    lock = threading.Lock()
+    triangle_count = 0
+    vertex_count = 0
+    miss_count_before = 0
+    miss_count_after = 0
+
+    @classmethod
+    def initialize(cls):
+        with cls.lock:
+            cls.triangle_count = 0
+            cls.vertex_count = 0
+            cls.miss_count_before = 0
+            cls.miss_count_after = 0
+
+    @classmethod
+    def report(cls):
+        if cls.triangle_count == 0:
+            return
+        LOG.info("顶点缓存优化(本次计算的模型): "
+                 + "ACMR " + cls.format_ratio(cls.miss_count_before, cls.triangle_count) + " -> " + cls.format_ratio(cls.miss_count_after, cls.triangle_count)
+                 + "，ATVR " + cls.format_ratio(cls.miss_count_before, cls.vertex_count) + " -> " + cls.format_ratio(cls.miss_count_after, cls.vertex_count))
+
+    @classmethod
+    def format_ratio(cls, numerator:int, denominator:int) -> str:
+        if denominator == 0:
+            return "0"
+        return "%.3f" % (numerator / denominator)
+
+    @classmethod
+    def count_cache_misses(cls, ib:numpy.ndarray, vertex_count:int) -> int:
+        '''
+        模拟FIFO顶点缓存，返回缓存未命中的次数
+        每次未命中时时间戳加1，顶点的时间戳和当前时间戳相差不超过缓存大小时说明仍在缓存中
+        '''
+        cache_size = cls.cache_size
+        cache_time = [-cache_size - 1] * vertex_count
+        timestamp = 0
+        miss_count = 0
+        for vertex_index in ib.tolist():
+            if timestamp - cache_time[vertex_index] > cache_size:
+                cache_time[vertex_index] = timestamp
+                timestamp += 1
+                miss_count += 1
+        return miss_count
+
+    @classmethod
+    def get_tipsify_triangle_order(cls, ib:numpy.ndarray, vertex_count:int) -> numpy.ndarray:
+        '''
+        Tipsify三角形排序 (Sander, Nehab, Barczak 2007, Fast Triangle Reordering for Vertex Locality and Reduced Overdraw)
+
+        以一个顶点为中心输出它周围所有还没输出的三角形，然后在刚输出的顶点中选择下一个中心：
+        优先选择输出它剩余的三角形后仍然在缓存中、并且在缓存中停留最久的顶点，
+        没有合适的顶点时从最近输出过的顶点中找还有剩余三角形的，再没有就按顶点编号顺序找。
+
+        返回新的三角形顺序，值是原来的三角形编号
+        '''
+        cache_size = cls.cache_size
+        triangles = ib.reshape(-1, 3)
+        triangle_count = len(triangles)
+
+        # 每个顶点相邻的三角形列表，按CSR格式存储
+        vertex_triangle_counts = numpy.bincount(triangles.reshape(-1), minlength=vertex_count)
+        adjacency_offsets = numpy.zeros(vertex_count + 1, dtype=numpy.int64)
+        numpy.cumsum(vertex_triangle_counts, out=adjacency_offsets[1:])
+        adjacency_triangles = numpy.argsort(triangles.reshape(-1), kind="stable") // 3
+
+        adjacency_offsets = adjacency_offsets.tolist()
+        adjacency_triangles = adjacency_triangles.tolist()
+        triangle_vertices = triangles.tolist()
+
+        # 每个顶点还没有输出的三角形数
+        live_triangle_counts = vertex_triangle_counts.tolist()
+        cache_time = [0] * vertex_count
+        emitted = bytearray(triangle_count)
+        dead_end_stack = []
+
+        triangle_order = []
+        timestamp = cache_size + 1
+        cursor = 0
+        fanning_vertex = 0 if vertex_count > 0 else -1
+
+        while fanning_vertex >= 0:
+            candidate_vertices = []
+
+            for triangle_index in adjacency_triangles[adjacency_offsets[fanning_vertex]:adjacency_offsets[fanning_vertex + 1]]:
+                if emitted[triangle_index]:
+                    continue
+                emitted[triangle_index] = 1
+                triangle_order.append(triangle_index)
+
+                for vertex_index in triangle_vertices[triangle_index]:
+                    dead_end_stack.append(vertex_index)
+                    candidate_vertices.append(vertex_index)
+                    live_triangle_counts[vertex_index] -= 1
+                    if timestamp - cache_time[vertex_index] > cache_size:
+                        cache_time[vertex_index] = timestamp
+                        timestamp += 1
+
+            # 在刚输出的顶点中选择下一个中心顶点
+            fanning_vertex = -1
+            max_priority = -1
+            for vertex_index in candidate_vertices:
+                live_triangle_count = live_triangle_counts[vertex_index]
+                if live_triangle_count > 0:
+                    priority = 0
+                    if timestamp - cache_time[vertex_index] + 2 * live_triangle_count <= cache_size:
+                        priority = timestamp - cache_time[vertex_index]
+                    if priority > max_priority:
+                        max_priority = priority
+                        fanning_vertex = vertex_index
+
+            if fanning_vertex == -1:
+                # 死路时先从最近输出过的顶点中找，再按顶点编号顺序找
+                while dead_end_stack:
+                    vertex_index = dead_end_stack.pop()
+                    if live_triangle_counts[vertex_index] > 0:
+                        fanning_vertex = vertex_index
+                        break
+
+            if fanning_vertex == -1:
+                while cursor < vertex_count:
+                    if live_triangle_counts[cursor] > 0:
+                        fanning_vertex = cursor
+                        break
+                    cursor += 1
+
+        return numpy.array(triangle_order, dtype=numpy.int64)
+
+    @classmethod
+    def get_first_use_vertex_order(cls, ib:numpy.ndarray, vertex_count:int) -> numpy.ndarray:
+        '''
+        按在ib中第一次使用的顺序排列顶点，返回值是新顺序中每个位置对应的原顶点编号
+        ib中没有用到的顶点排在最后
+        '''
+        used_vertices, first_positions = numpy.unique(ib, return_index=True)
+        used_vertex_order = used_vertices[numpy.argsort(first_positions, kind="stable")]
+
+        is_used = numpy.zeros(vertex_count, dtype=bool)
+        is_used[used_vertices] = True
+        unused_vertices = numpy.nonzero(~is_used)[0]
+        return numpy.concatenate((used_vertex_order, unused_vertices)).astype(numpy.int64)
+
+    @classmethod
+    def optimize(cls, ib:numpy.ndarray, category_buffer_dict:dict, index_vertex_id_ndarray:numpy.ndarray = None, obj_name:str = ""):
+        '''
+        对一个obj的IB和CategoryBuffer做顶点缓存优化和顶点读取优化，返回新的ib, category_buffer_dict, index_vertex_id_ndarray
+        '''
+        ib = numpy.asarray(ib, dtype=numpy.uint32)
+        if len(ib) == 0 or len(ib) % 3 != 0 or not category_buffer_dict:
+            return ib, category_buffer_dict, index_vertex_id_ndarray
+
+        vertex_count = len(next(iter(category_buffer_dict.values())))
+        miss_count_before = cls.count_cache_misses(ib, vertex_count)
+
+        # (1) 重新排列三角形
+        triangle_order = cls.get_tipsify_triangle_order(ib, vertex_count)
+        reordered_ib = ib.reshape(-1, 3)[triangle_order].reshape(-1)
+
+        # (2) 按第一次使用的顺序重新编号顶点
+        new_to_old_vertex = cls.get_first_use_vertex_order(reordered_ib, vertex_count)
+        old_to_new_vertex = numpy.empty(vertex_count, dtype=numpy.uint32)
+        old_to_new_vertex[new_to_old_vertex] = numpy.arange(vertex_count, dtype=numpy.uint32)
+
+        optimized_ib = old_to_new_vertex[reordered_ib]
+        optimized_category_buffer_dict = {}
+        for category_name, category_buffer in category_buffer_dict.items():
+            optimized_category_buffer_dict[category_name] = category_buffer[new_to_old_vertex]
+
+        # 下标是顶点索引，值是顶点ID，所以和CategoryBuffer一样按新顺序重排
+        if index_vertex_id_ndarray is not None:
+            index_vertex_id_ndarray = index_vertex_id_ndarray[new_to_old_vertex]
+
+        miss_count_after = cls.count_cache_misses(optimized_ib, vertex_count)
+        triangle_count = len(ib) // 3
+        LOG.info("顶点缓存优化 " + obj_name + ": ACMR " + cls.format_ratio(miss_count_before, triangle_count) + " -> " + cls.format_ratio(miss_count_after, triangle_count)
+                 + "，ATVR " + cls.format_ratio(miss_count_before, vertex_count) + " -> " + cls.format_ratio(miss_count_after, vertex_count))
+        with cls.lock:
+            cls.triangle_count += triangle_count
+            cls.vertex_count += vertex_count
+            cls.miss_count_before += miss_count_before
+            cls.miss_count_after += miss_count_after
+
+        return optimized_ib, optimized_category_buffer_dict, index_vertex_id_ndarray
@@ -0,0 +1,41 @@
+import os
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ImportExecutor:
+    '''
+    一键导入工作空间时使用的线程池
+
+    解析fmt、读取ib和vb、格式转换都只访问文件和numpy，读取文件和numpy的整体数组操作会释放GIL，
+    所以把后面几个模型的这些工作提前提交到线程池同时进行，
+    主线程按原来的顺序取回结果，只负责创建mesh和obj，因为访问bpy必须在主线程中执行。
+    '''
+    executor = None
+
+    @classmethod
+    def get_max_workers(cls) -> int:
+        return os.cpu_count() or 4
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        if cls.executor is None:
+            cls.executor = ThreadPoolExecutor(max_workers=cls.get_max_workers(), thread_name_prefix="ImportPrefetch")
+        return cls.executor
+
+    @classmethod
+    def submit(cls,fn,*args) -> Future:
+        return cls.get_executor().submit(fn, *args)
+
+    @classmethod
+    def get_max_in_flight(cls) -> int:
+        '''
+        最多同时保留多少个已提交但还没有被主线程取走的模型，避免把整个工作空间的数据同时读入内存
+        '''
+        return cls.get_max_workers()
+
+    @classmethod
+    def shutdown(cls):
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=True)
+            cls.executor = None
@@ -2,6 +2,7 @@ import numpy
 import itertools
 import math
 import bpy
+import bmesh
 import os
 
 from .migoto_binary_file import MigotoBinaryFile
@@ -16,7 +17,7 @@ from ..properties.properties_wwmi import Properties_WWMI
 
 from ..config.main_config import GlobalConfig
 
-from bpy_extras.io_utils import unpack_list, axis_conversion
+from bpy_extras.io_utils import axis_conversion
 
 
 class MeshImportUtils:
@@ -40,6 +41,9 @@ class MeshImportUtils:
 
         MeshImportUtils.initialize_mesh(mesh, mbf)
 
+        # 每个loop对应的顶点索引，COLOR和TEXCOORD都通过它把顶点数据展开到loop上
+        loop_vertex_indices = MeshImportUtils.get_loop_vertex_indices(mesh)
+
         blend_indices = {}
         blend_weights = {}
         texcoords = {}
@@ -48,27 +52,28 @@ class MeshImportUtils:
         normals = []
 
         for element in mbf.fmt_file.elements:
-            data = mbf.vb_data[element.ElementName]
-
-            data = MigotoUtils.apply_format_conversion(data, element.Format)
+            data = mbf.get_decoded_element_data(element)
 
             if element.SemanticName == "POSITION":
-                if len(data[0]) == 4:
-                    if ([x[3] for x in data] != [1.0] * len(data)) and ([x[3] for x in data] != [0] * len(data)):
+                if data.ndim == 2 and data.shape[1] == 4:
+                    position_w = data[:, 3]
+                    if not numpy.all(position_w == 1.0) and not numpy.all(position_w == 0):
                         # Nico: Blender暂时不支持4D索引，加了也没用，直接不行就报错，转人工处理。
                         raise Fatal('Positions are 4D')
-                positions = [(x[0], x[1], x[2]) for x in data]
-                mesh.vertices.foreach_set('co', unpack_list(positions))
+                positions = numpy.ascontiguousarray(data[:, :3], dtype=numpy.float32)
+                mesh.vertices.foreach_set('co', positions.ravel())
             elif element.SemanticName.startswith("COLOR"):
                 mesh.vertex_colors.new(name=element.ElementName)
                 color_layer = mesh.vertex_colors[element.ElementName].data
-                for l in mesh.loops:
-                    color_layer[l.index].color = list(data[l.vertex_index]) + [0] * (4 - len(data[l.vertex_index]))
+                # 不足4个分量的补0，再按loop的顶点索引展开
+                colors = numpy.zeros((len(data), 4), dtype=numpy.float32)
+                color_data = data.reshape(len(data), -1)
+                colors[:, :color_data.shape[1]] = color_data[:, :4]
+                color_layer.foreach_set('color', colors[loop_vertex_indices].ravel())
             elif element.SemanticName.startswith("BLENDINDICES"):
                 if data.ndim == 1:
-                    # 如果data是一维数组，转换为包含元组的2D数组，用于处理只有一个R32_UINT的情况
-                    data_2d = numpy.array([(x,) for x in data])
-                    blend_indices[element.SemanticIndex] = data_2d
+                    # 如果data是一维数组，转换为2D数组，用于处理只有一个R32_UINT的情况
+                    blend_indices[element.SemanticIndex] = data.reshape(-1, 1)
                 else:
                     blend_indices[element.SemanticIndex] = data
             elif element.SemanticName.startswith("BLENDWEIGHT"):
@@ -88,11 +93,10 @@ class MeshImportUtils:
                 这种归一化后到[0,1]的法线，可以减少Shader的计算消耗。
                 # (此处感谢 球球 的代码开发)
                 '''
+                normals = numpy.ascontiguousarray(data[:, :3], dtype=numpy.float32)
                 if GlobalConfig.gamename == "YYSLS":
                     print("燕云十六声法线处理")
-                    normals = [(x[0] * 2 - 1, x[1] * 2 - 1, x[2] * 2 - 1) for x in data]
-                else:
-                    normals = [(x[0], x[1], x[2]) for x in data]
+                    normals = normals * 2 - 1
                 
 
             elif element.SemanticName == "TANGENT":
@@ -107,14 +111,12 @@ class MeshImportUtils:
             print("检测到BLENDWEIGHTS为空，但是含有BLENDINDICES数据，特殊情况，默认补充1,0,0,0的BLENDWEIGHTS")
             tmpi = 0
             for blendindices_turple in blend_indices.values():
-                # print(blendindices_turple)
-                new_dict = []
-                for indices in blendindices_turple:
-                    new_dict.append((1.0,0,0,0))
-                blend_weights[tmpi] = new_dict
+                default_blend_weights = numpy.zeros((len(blendindices_turple), 4), dtype=numpy.float32)
+                default_blend_weights[:, 0] = 1.0
+                blend_weights[tmpi] = default_blend_weights
                 tmpi = tmpi + 1
 
-        MeshImportUtils.import_uv_layers(mesh, obj, texcoords)
+        MeshImportUtils.import_uv_layers(mesh, obj, texcoords, loop_vertex_indices=loop_vertex_indices)
 
         #  metadata.json, if contains then we can import merged vgmap.
         component = None
@@ -131,12 +133,14 @@ class MeshImportUtils:
         print(len(blend_indices))
         print(len(blend_weights))
 
-        MeshImportUtils.import_vertex_groups(mesh, obj, blend_indices, blend_weights, component)
-        MeshImportUtils.import_shapekeys(mesh, obj, shapekeys)
-
         # Validate closes the loops so they don't disappear after edit mode and probably other important things:
         mesh.validate(verbose=False, clean_customdata=False)  
         mesh.update()
+
+        # 顶点组通过bmesh写入，必须在validate生成边之后调用，见import_vertex_groups
+        MeshImportUtils.import_vertex_groups(mesh, obj, blend_indices, blend_weights, component)
+        MeshImportUtils.import_shapekeys(mesh, obj, shapekeys)
+
         # XXX 这个方法还必须得在mesh.validate和mesh.update之后调用 3.6和4.2都可以用这个
         if use_normals:
             # Blender4.2 移除了mesh.create_normal_splits()
@@ -212,32 +216,45 @@ class MeshImportUtils:
 
     @classmethod
     def initialize_mesh(cls,mesh, mbf:MigotoBinaryFile):
+        '''
+        from_pydata需要把所有数据转换为Python列表，比foreach_set慢得多，
+        所以这里直接用numpy数组通过foreach_set设置loop和polygon，数组类型和Blender内部的int32一致时可以整体复制
+        '''
+        ib = numpy.ascontiguousarray(mbf.ib_data, dtype=numpy.int32)
+
         # 翻转索引顺序以改变面朝向
-        # print(mbf.ib_data[0],mbf.ib_data[1],mbf.ib_data[2])
         if mbf.fmt_file.flip_face_orientation:  # 假设你有一个标志位控制是否翻转
-            flipped_indices = []
-            for i in range(0, len(mbf.ib_data), 3):
-                triangle = mbf.ib_data[i:i+3]
-                flipped_triangle = triangle[::-1]
-                flipped_indices.extend(flipped_triangle)
-            mbf.ib_data = flipped_indices
-        # print(mbf.ib_data[0],mbf.ib_data[1],mbf.ib_data[2])
+            triangle_index_count = mbf.ib_polygon_count * 3
+            flipped_triangles = ib[:triangle_index_count].reshape(-1, 3)[:, ::-1].ravel()
+            # 末尾不足一个三角形的索引和原来逐段翻转的结果保持一致
+            ib = numpy.concatenate((flipped_triangles, ib[triangle_index_count:][::-1]))
+            mbf.ib_data = ib
 
         # 导入IB文件设置为mesh的三角形索引
         mesh.loops.add(mbf.ib_count)
         mesh.polygons.add(mbf.ib_polygon_count)
-        mesh.loops.foreach_set('vertex_index', mbf.ib_data)
-        mesh.polygons.foreach_set('loop_start', [x * 3 for x in range(mbf.ib_polygon_count)])
-        mesh.polygons.foreach_set('loop_total', [3] * mbf.ib_polygon_count)
+        mesh.loops.foreach_set('vertex_index', ib)
+        mesh.polygons.foreach_set('loop_start', numpy.arange(0, mbf.ib_polygon_count * 3, 3, dtype=numpy.int32))
+        mesh.polygons.foreach_set('loop_total', numpy.full(mbf.ib_polygon_count, 3, dtype=numpy.int32))
 
         # 根据vb文件的顶点数设置mesh的顶点数
         mesh.vertices.add(mbf.vb_vertex_count)
 
     @classmethod
-    def import_uv_layers(cls,mesh, obj, texcoords):
+    def get_loop_vertex_indices(cls, mesh) -> numpy.ndarray:
+        '''
+        通过foreach_get一次性读取所有loop的顶点索引
+        '''
+        loop_vertex_indices = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+        mesh.loops.foreach_get('vertex_index', loop_vertex_indices)
+        return loop_vertex_indices
+
+    @classmethod
+    def import_uv_layers(cls,mesh, obj, texcoords, loop_vertex_indices:numpy.ndarray = None):
         # 预先获取所有循环的顶点索引并转换为numpy数组
-        loops = mesh.loops
-        vertex_indices = numpy.array([l.vertex_index for l in loops], dtype=numpy.int32)
+        if loop_vertex_indices is None:
+            loop_vertex_indices = cls.get_loop_vertex_indices(mesh)
+        vertex_indices = loop_vertex_indices
         
         for texcoord, data in sorted(texcoords.items()):
             # 将原始数据转换为numpy数组（只需转换一次）
@@ -279,31 +296,133 @@ class MeshImportUtils:
     def import_vertex_groups(cls,mesh, obj, blend_indices, blend_weights,component):
         '''
         component: 如果是一键导入WWMI的模型则不为None，其它情况默认为None
+
+        不再逐个顶点逐个权重调用vertex_groups[i].add，先用numpy把所有(顶点, 顶点组, 权重)展开并完成vg_map映射，再按数据选择写入方式:
+
+        - UNORM8之类的权重只有很少的几种取值，按(顶点组, 权重)分组后每组只调用一次add，见import_vertex_groups_by_weight
+        - 浮点权重几乎每个都不同，分组无法减少调用次数，这时通过bmesh的deform层逐个顶点直接写入，见import_vertex_groups_by_bmesh
+
+        两种方式的结果都和原来逐个add完全一样：权重为0的跳过，
+        同一个顶点多次出现同一个顶点组时以最后一次为准(REPLACE)，顶点上顶点组的排列顺序也相同。
+
+        bmesh读取mesh时需要边，所以要在mesh.validate和mesh.update之后调用。
         '''
         assert (len(blend_indices) == len(blend_weights))
-        if blend_indices:
-            # We will need to make sure we re-export the same blend indices later -
-            # that they haven't been renumbered. Not positive whether it is better
-            # to use the vertex group index, vertex group name or attach some extra
-            # data. Make sure the indices and names match:
-            if component is None:
-                num_vertex_groups = max(itertools.chain(*itertools.chain(*blend_indices.values()))) + 1
-            else:
-                num_vertex_groups = max(component.vg_map.values()) + 1
-            
-            for i in range(num_vertex_groups):
-                obj.vertex_groups.new(name=str(i))
-            for vertex in mesh.vertices:
-                for semantic_index in sorted(blend_indices.keys()):
-                    for i, w in zip(blend_indices[semantic_index][vertex.index],
-                                    blend_weights[semantic_index][vertex.index]):
-                        if w == 0.0:
-                            continue
-                        if component is None:
-                            obj.vertex_groups[i].add((vertex.index,), w, 'REPLACE')
-                        else:
-                            # 这里由于C++生成的json文件是无序的，所以我们这里读取的时候要用原始的map而不是转换成列表的索引，避免无序问题
-                            obj.vertex_groups[component.vg_map[str(i)]].add((vertex.index,), w, 'REPLACE')
+        if not blend_indices:
+            return
+
+        vertex_count = len(mesh.vertices)
+
+        # 按SemanticIndex顺序把每个顶点的所有BLENDINDICES和BLENDWEIGHTS横向拼接，展开后就是原来逐个添加的顺序
+        indices_list = []
+        weights_list = []
+        for semantic_index in sorted(blend_indices.keys()):
+            indices = numpy.asarray(blend_indices[semantic_index]).reshape(vertex_count, -1)
+            weights = numpy.asarray(blend_weights[semantic_index], dtype=numpy.float32).reshape(vertex_count, -1)
+            component_count = min(indices.shape[1], weights.shape[1])
+            indices_list.append(indices[:, :component_count].astype(numpy.int64))
+            weights_list.append(weights[:, :component_count])
+
+        all_indices = numpy.hstack(indices_list)
+        all_weights = numpy.hstack(weights_list)
+
+        # We will need to make sure we re-export the same blend indices later -
+        # that they haven't been renumbered. Not positive whether it is better
+        # to use the vertex group index, vertex group name or attach some extra
+        # data. Make sure the indices and names match:
+        if component is None:
+            num_vertex_groups = int(all_indices.max()) + 1 if all_indices.size > 0 else 0
+        else:
+            num_vertex_groups = max(component.vg_map.values()) + 1
+
+        for i in range(num_vertex_groups):
+            obj.vertex_groups.new(name=str(i))
+
+        nonzero_mask = all_weights != 0.0
+        vertex_influence_counts = numpy.count_nonzero(nonzero_mask, axis=1)
+        all_indices = all_indices[nonzero_mask]
+        all_weights = all_weights[nonzero_mask]
+        if all_indices.size == 0:
+            return
+
+        if component is not None:
+            # 这里由于C++生成的json文件是无序的，所以我们这里读取的时候要用原始的map而不是转换成列表的索引，避免无序问题
+            # 把vg_map转换为查找数组，下标是原始的BLENDINDICES，值是融合后的顶点组，-1表示vg_map中不存在
+            vg_map_lookup = numpy.full(max(int(key) for key in component.vg_map.keys()) + 1, -1, dtype=numpy.int64)
+            for key, value in component.vg_map.items():
+                vg_map_lookup[int(key)] = value
+
+            if int(all_indices.max()) >= len(vg_map_lookup) or (vg_map_lookup[all_indices] < 0).any():
+                raise Fatal("BLENDINDICES not found in Metadata.json vg_map")
+            all_indices = vg_map_lookup[all_indices]
+
+        if not cls.import_vertex_groups_by_weight(obj, vertex_influence_counts, all_indices, all_weights, num_vertex_groups):
+            cls.import_vertex_groups_by_bmesh(mesh, vertex_influence_counts, all_indices, all_weights)
+
+    @classmethod
+    def import_vertex_groups_by_weight(cls,obj, vertex_influence_counts, all_indices, all_weights, num_vertex_groups:int) -> bool:
+        '''
+        按(顶点组, 权重)分段，每段调用一次vertex_groups[i].add，不适用时返回False
+
+        每个顶点上的顶点组按add的调用顺序排列，导出时权重相同的顶点组按这个顺序取舍，
+        所以先按每个权重在所属顶点中的位置排序，再按顶点组和权重分段，这样每个顶点上顶点组的排列顺序和原来逐个add相同
+
+        - 分段数量没有明显少于权重数量时(浮点权重)，分组无法减少调用次数
+        - 同一个顶点重复出现同一个顶点组时，REPLACE的结果取决于调用顺序，交给bmesh按原来的顺序写入
+        '''
+        influence_count = len(all_indices)
+        all_vertex_ids = numpy.repeat(numpy.arange(len(vertex_influence_counts), dtype=numpy.int64), vertex_influence_counts)
+        influence_starts = numpy.cumsum(vertex_influence_counts) - vertex_influence_counts
+        influence_columns = numpy.arange(influence_count, dtype=numpy.int64) - influence_starts[all_vertex_ids]
+
+        # lexsort是稳定排序，最后一个key优先，每段内的顶点仍然按编号升序
+        sort_order = numpy.lexsort((all_weights, all_indices, influence_columns))
+        sorted_columns = influence_columns[sort_order]
+        sorted_indices = all_indices[sort_order]
+        sorted_weights = all_weights[sort_order]
+
+        segment_start_mask = numpy.ones(influence_count, dtype=bool)
+        segment_start_mask[1:] = (sorted_columns[1:] != sorted_columns[:-1]) | (sorted_indices[1:] != sorted_indices[:-1]) | (sorted_weights[1:] != sorted_weights[:-1])
+        segment_count = int(numpy.count_nonzero(segment_start_mask))
+
+        # 每段至少平均覆盖4个权重才值得分组
+        if segment_count * 4 > influence_count:
+            return False
+
+        vertex_group_keys = all_vertex_ids * num_vertex_groups + all_indices
+        if len(numpy.unique(vertex_group_keys)) != influence_count:
+            return False
+
+        sorted_vertex_ids = all_vertex_ids[sort_order]
+        segment_starts = numpy.flatnonzero(segment_start_mask)
+        segment_ends = numpy.append(segment_starts[1:], influence_count)
+
+        vertex_groups = obj.vertex_groups
+        for segment_start, segment_end, group_index, weight in zip(segment_starts.tolist(), segment_ends.tolist(), sorted_indices[segment_starts].tolist(), sorted_weights[segment_starts].tolist()):
+            vertex_groups[group_index].add(sorted_vertex_ids[segment_start:segment_end].tolist(), weight, 'REPLACE')
+        return True
+
+    @classmethod
+    def import_vertex_groups_by_bmesh(cls,mesh, vertex_influence_counts, all_indices, all_weights):
+        '''
+        通过bmesh的deform层按原来逐个add的顺序逐个顶点写入，不经过RNA
+        '''
+        bm = bmesh.new()
+        try:
+            bm.from_mesh(mesh)
+            deform_layer = bm.verts.layers.deform.verify()
+
+            group_weight_iterator = zip(all_indices.tolist(), all_weights.tolist())
+            for vertex, influence_count in zip(bm.verts, vertex_influence_counts.tolist()):
+                if influence_count == 0:
+                    continue
+                deform_vert = vertex[deform_layer]
+                for group_index, weight in itertools.islice(group_weight_iterator, influence_count):
+                    deform_vert[group_index] = weight
+
+            bm.to_mesh(mesh)
+        finally:
+            bm.free()
 
     @classmethod
     def import_shapekeys(cls,mesh, obj, shapekeys):
@@ -1,6 +1,7 @@
 
 import numpy
 import os
+import threading
 
 from ..utils.migoto_utils import MigotoUtils, Fatal
 from dataclasses import dataclass, field, asdict
@@ -152,9 +153,21 @@ class MigotoBinaryFile:
     prefix是前缀，比如Body.ib Body.vb Body.fmt 那么此时Body就是prefix
     location_folder_path是存放这些文件的文件夹路径，比如当前工作空间中提取的对应数据类型文件夹
 
+    构造时只读取fmt文件和.ib .vb的文件大小，ib_data和vb_data在第一次访问时才读取，
+    这样file_size_check跳过的空文件不会被读取。
+    use_memory_map为True时.ib和.vb以只读内存映射的方式打开，不会一次性读入内存，
+    导入时通过get_element_data只解码用到的那一列，
+    同一个文件的映射保存在memory_map_cache中，同一次导入中重复读取同一个prefix时共享同一个映射，
+    每个导入操作结束时调用clear_memory_map_cache释放，Windows下文件被映射时无法被覆盖，重新提取时会失败。
     '''
-    def __init__(self, fmt_path:str, mesh_name:str = ""):
+
+    # 文件路径 -> (修改时间, 文件大小, 按字节映射的numpy.memmap)
+    memory_map_cache = {}
+    memory_map_cache_lock = threading.Lock()
+
+    def __init__(self, fmt_path:str, mesh_name:str = "", use_memory_map:bool = False):
         self.fmt_file = FMTFile(fmt_path)
+        self.use_memory_map = use_memory_map
         print("fmt_path: " + fmt_path)
         location_folder_path = os.path.dirname(fmt_path)
         print("location_folder_path: " + location_folder_path)
@@ -191,18 +204,113 @@ class MigotoBinaryFile:
         self.init_data()
 
     def init_data(self):
+        '''
+        只根据文件大小计算数量，不读取文件内容
+        '''
+        self.ib_dtype = numpy.dtype(MigotoUtils.get_nptype_from_format(self.fmt_file.format))
         ib_stride = MigotoUtils.format_size(self.fmt_file.format)
 
         self.ib_count = int(self.ib_file_size / ib_stride)
         self.ib_polygon_count = int(self.ib_count / 3)
-        self.ib_data = numpy.fromfile(self.ib_bin_path, dtype=MigotoUtils.get_nptype_from_format(self.fmt_file.format), count=self.ib_count)
         
         # 读取fmt文件，解析出后面要用的dtype
-        fmt_dtype = self.fmt_file.get_dtype()
-        vb_stride = fmt_dtype.itemsize
+        self.vb_dtype = self.fmt_file.get_dtype()
+        vb_stride = self.vb_dtype.itemsize
 
         self.vb_vertex_count = int(self.vb_file_size / vb_stride)
-        self.vb_data = numpy.fromfile(self.vb_bin_path, dtype=fmt_dtype, count=self.vb_vertex_count)
+
+        self.loaded_ib_data = None
+        self.loaded_vb_data = None
+        # prefetch提前解码好的每个element的数据，导入时取出后就从这里移除
+        self.decoded_element_data_dict = {}
+
+    @property
+    def ib_data(self):
+        if self.loaded_ib_data is None:
+            self.loaded_ib_data = self.read_binary_file(self.ib_bin_path, self.ib_dtype, self.ib_count)
+        return self.loaded_ib_data
+
+    @ib_data.setter
+    def ib_data(self, value):
+        self.loaded_ib_data = value
+
+    @property
+    def vb_data(self):
+        if self.loaded_vb_data is None:
+            self.loaded_vb_data = self.read_binary_file(self.vb_bin_path, self.vb_dtype, self.vb_vertex_count)
+        return self.loaded_vb_data
+
+    def get_element_data(self, element_name:str) -> numpy.ndarray:
+        '''
+        读取vb中一个element对应的列
+        内存映射时vb_data[element_name]是映射上的跨步视图，这里复制成连续数组，只有这一列的数据会被读入内存
+        '''
+        return numpy.ascontiguousarray(self.vb_data[element_name])
+
+    def get_decoded_element_data(self, element:D3D11Element) -> numpy.ndarray:
+        '''
+        读取一个element的数据并进行格式转换，prefetch过的直接返回提前解码好的数据
+        '''
+        decoded_data = self.decoded_element_data_dict.pop(element.ElementName, None)
+        if decoded_data is not None:
+            return decoded_data
+        return MigotoUtils.apply_format_conversion(self.get_element_data(element.ElementName), element.Format)
+
+    def prefetch(self):
+        '''
+        提前读取ib和vb并解码所有element，只访问文件和numpy，不访问bpy，可以在线程池中执行
+        空文件在导入时会被file_size_check跳过，这里也不读取
+        内存映射时只建立映射，不提前解码，避免在映射之外再复制一份完整的顶点数据
+        '''
+        if self.vb_file_size == 0 or self.ib_file_size == 0:
+            return self
+
+        # 提前转换为int32，initialize_mesh中foreach_set时不需要再转换
+        self.ib_data = numpy.ascontiguousarray(self.ib_data, dtype=numpy.int32)
+        if self.use_memory_map:
+            self.vb_data
+            return self
+
+        for element in self.fmt_file.elements:
+            self.decoded_element_data_dict[element.ElementName] = MigotoUtils.apply_format_conversion(self.get_element_data(element.ElementName), element.Format)
+        return self
+
+    def read_binary_file(self, file_path:str, dtype:numpy.dtype, count:int) -> numpy.ndarray:
+        if count == 0:
+            return numpy.empty(0, dtype=dtype)
+
+        if not self.use_memory_map:
+            return numpy.fromfile(file_path, dtype=dtype, count=count)
+
+        # 映射按字节共享，每个MigotoBinaryFile按自己的dtype查看，文件末尾不足一个元素的部分和fromfile一样忽略
+        byte_memory_map = MigotoBinaryFile.get_memory_map(file_path)
+        return byte_memory_map[:count * dtype.itemsize].view(dtype)
+
+    @classmethod
+    def get_memory_map(cls, file_path:str) -> numpy.memmap:
+        '''
+        获取文件的只读内存映射，文件的修改时间或大小变化后重新映射
+        '''
+        file_path = os.path.normcase(os.path.abspath(file_path))
+        file_stat = os.stat(file_path)
+
+        with cls.memory_map_cache_lock:
+            cached = cls.memory_map_cache.get(file_path, None)
+            if cached is not None and cached[0] == file_stat.st_mtime_ns and cached[1] == file_stat.st_size:
+                return cached[2]
+
+            byte_memory_map = numpy.memmap(file_path, dtype=numpy.uint8, mode="r")
+            cls.memory_map_cache[file_path] = (file_stat.st_mtime_ns, file_stat.st_size, byte_memory_map)
+            return byte_memory_map
+
+    @classmethod
+    def clear_memory_map_cache(cls):
+        '''
+        释放缓存中的映射，Windows下文件被映射时无法被覆盖，每个导入操作结束时和卸载插件时调用
+        仍在使用映射的数组会保持映射直到它们被释放
+        '''
+        with cls.memory_map_cache_lock:
+            cls.memory_map_cache = {}
 
     
     def file_sanity_check(self):
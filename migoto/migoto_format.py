@@ -1,5 +1,6 @@
 import json
 import io
+import numpy
 
 from ..utils.migoto_utils import *
 from ..utils.migoto_utils import *
@@ -81,17 +82,107 @@ class M_Condition:
         self.condition_str = condition_str
 
     
-class ObjModel:
+class ObjBufferData:
+    '''
+    一个obj导出得到的IndexBuffer、CategoryBuffer以及WWMI用到的index_vertex_id_ndarray
+
+    同一个obj可能出现在多个绘制位置、多个Component中，每个位置的生效条件和DrawIndexed都不同，但几何数据完全相同，
+    所以这里的数据创建后不再修改，引用它的ObjModel共享同一份，复制ObjModel时也只复制引用。
+    需要修改时调用replace得到一个新的ObjBufferData。
+    '''
+    def __init__(self,ib,category_buffer_dict,index_vertex_id_ndarray,unique_vertex_count:int = None):
+        self.ib = ib
+        self.category_buffer_dict = category_buffer_dict
+        self.index_vertex_id_ndarray = index_vertex_id_ndarray
+
+        # 去重后的顶点数，也就是这个obj在CategoryBuffer中的顶点数，不需要再用set(ib)统计
+        if unique_vertex_count is None:
+            unique_vertex_count = self.get_unique_vertex_count(ib, category_buffer_dict)
+        self.unique_vertex_count = unique_vertex_count
+
+        # numpy数组设置为只读，防止共享的数据被某一处修改
+        for ndarray in [ib, index_vertex_id_ndarray] + list((category_buffer_dict or {}).values()):
+            if isinstance(ndarray, numpy.ndarray):
+                ndarray.flags.writeable = False
+
+    @classmethod
+    def get_unique_vertex_count(cls,ib,category_buffer_dict) -> int:
+        '''
+        CategoryBuffer的每一行就是去重后的一个顶点，所以直接取行数
+        没有CategoryBuffer时(例如流式导出已经写出)，去重得到的ib是从0开始连续的索引，最大值加1就是顶点数
+        '''
+        if category_buffer_dict:
+            return len(next(iter(category_buffer_dict.values())))
+        if ib is None or len(ib) == 0:
+            return 0
+        return int(numpy.max(ib)) + 1
+
+    def replace(self,**kwargs) -> "ObjBufferData":
+        buffer_data_kwargs = {
+            "ib": self.ib,
+            "category_buffer_dict": self.category_buffer_dict,
+            "index_vertex_id_ndarray": self.index_vertex_id_ndarray,
+        }
+        # 只有ib变化时才需要重新统计顶点数，释放CategoryBuffer时保留原来的顶点数
+        if "ib" not in kwargs:
+            buffer_data_kwargs["unique_vertex_count"] = self.unique_vertex_count
+        buffer_data_kwargs.update(kwargs)
+        return ObjBufferData(**buffer_data_kwargs)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class BufferedObjModel:
+    '''
+    ObjModel和ObjDataModel的公共部分，几何数据都放在共享的buffer_data中
+    ib、category_buffer_dict、index_vertex_id_ndarray仍然可以直接读取和赋值，
+    赋值时替换为新的ObjBufferData，不会影响共享同一份数据的其它ObjModel
+    '''
+    def __init__(self):
+        self.buffer_data:ObjBufferData = ObjBufferData(ib=numpy.empty(0, dtype=numpy.uint32), category_buffer_dict={}, index_vertex_id_ndarray=None)
+
+    @property
+    def ib(self):
+        return self.buffer_data.ib
+
+    @ib.setter
+    def ib(self, ib):
+        self.buffer_data = self.buffer_data.replace(ib=ib)
+
+    @property
+    def category_buffer_dict(self):
+        return self.buffer_data.category_buffer_dict
+
+    @category_buffer_dict.setter
+    def category_buffer_dict(self, category_buffer_dict):
+        self.buffer_data = self.buffer_data.replace(category_buffer_dict=category_buffer_dict)
+
+    @property
+    def index_vertex_id_ndarray(self):
+        '''
+        仅用于WWMI的索引顶点ID数组，下标是顶点索引，值是顶点ID，默认可以为None
+        '''
+        return self.buffer_data.index_vertex_id_ndarray
+
+    @index_vertex_id_ndarray.setter
+    def index_vertex_id_ndarray(self, index_vertex_id_ndarray):
+        self.buffer_data = self.buffer_data.replace(index_vertex_id_ndarray=index_vertex_id_ndarray)
+
+
+class ObjModel(BufferedObjModel):
     def __init__(self):
-        self.ib = []
-        self.category_buffer_dict = {}
-        self.index_vertex_id_dict = {} # 仅用于WWMI的索引顶点ID字典，key是顶点索引，value是顶点ID，默认可以为None
+        super().__init__()
         self.obj_name = ""
         self.condition:M_Condition = M_Condition()
         self.drawindexed_obj:M_DrawIndexed = M_DrawIndexed()
 
-class ObjDataModel:
+class ObjDataModel(BufferedObjModel):
     def __init__(self,obj_name:str):
+        super().__init__()
         self.obj_name = obj_name
         
         # 因为现在的obj都需要遵守命名规则
@@ -101,9 +192,6 @@ class ObjDataModel:
         self.obj_alias_name = obj_name_split[2]
 
         # 其它属性
-        self.ib = []
-        self.category_buffer_dict = {}
-        self.index_vertex_id_dict = {} # 仅用于WWMI的索引顶点ID字典，key是顶点索引，value是顶点ID，默认可以为None
         self.condition:M_Condition = M_Condition()
         self.drawindexed_obj:M_DrawIndexed = M_DrawIndexed()
 
@@ -18,6 +18,38 @@ from bpy.props import BoolProperty, StringProperty, CollectionProperty
 
 from .mesh_import_utils import MeshImportUtils
 from .migoto_binary_file import MigotoBinaryFile, FMTFile
+from .import_executor import ImportExecutor
+
+
+def prefetch_migoto_binary_file(fmt_file_path:str, mesh_name:str, use_memory_map:bool) -> MigotoBinaryFile:
+    '''
+    解析fmt、读取ib和vb并解码所有element，不访问bpy，可以在线程池中执行
+    '''
+    mbf = MigotoBinaryFile(fmt_path=fmt_file_path, mesh_name=mesh_name, use_memory_map=use_memory_map)
+    return mbf.prefetch()
+
+
+def iter_migoto_binary_files(fmt_path_mesh_name_list:list, use_memory_map:bool):
+    '''
+    按顺序返回每个(fmt路径, mesh名称)对应的MigotoBinaryFile
+
+    未开启并行导入时和原来一样用到时才读取，同一时间只有一个模型的数据在内存中；
+    开启并行导入时线程池提前读取后面的模型，最多同时保留get_max_in_flight个，超过时先等待最早提交的结果被取走
+    '''
+    if not Properties_ImportModel.use_parallel_import():
+        for fmt_file_path, mesh_name in fmt_path_mesh_name_list:
+            yield MigotoBinaryFile(fmt_path=fmt_file_path, mesh_name=mesh_name, use_memory_map=use_memory_map)
+        return
+
+    max_in_flight = ImportExecutor.get_max_in_flight()
+    pending_future_list = []
+    for fmt_file_path, mesh_name in fmt_path_mesh_name_list:
+        pending_future_list.append(ImportExecutor.submit(prefetch_migoto_binary_file, fmt_file_path, mesh_name, use_memory_map))
+        if len(pending_future_list) >= max_in_flight:
+            yield pending_future_list.pop(0).result()
+
+    for mbf_future in pending_future_list:
+        yield mbf_future.result()
 
 
 
@@ -44,23 +76,30 @@ def ImprotFromWorkSpaceSSMT(self, context):
     JsonUtils.SaveToFile(json_dict=draw_ib_gametypename_dict,filepath=save_import_json_path)
     
 
-    # 开始读取模型数据
+    # 第一阶段：收集所有DrawIB中要导入的模型
+    draw_ib_aliasname_prefix_count_list = []
+    fmt_path_mesh_name_list = []
     for draw_ib_aliasname,import_folder_path in import_drawib_aliasname_folder_path_dict.items():
         import_prefix_list = ConfigUtils.get_prefix_list_from_tmp_json(import_folder_path)
         if len(import_prefix_list) == 0:
             self.report({'ERROR'},"当前output文件夹"+draw_ib_aliasname+"中的内容暂不支持一键导入分支模型")
             continue
 
+        draw_ib_aliasname_prefix_count_list.append((draw_ib_aliasname, len(import_prefix_list)))
+        for prefix in import_prefix_list:
+            fmt_path_mesh_name_list.append((os.path.join(import_folder_path, prefix + ".fmt"), ""))
+
+    # 第二阶段：主线程按原来的顺序取回读取结果，创建集合和模型
+    mbf_iterator = iter_migoto_binary_files(fmt_path_mesh_name_list, Properties_ImportModel.use_memory_map_import())
+    for draw_ib_aliasname, prefix_count in draw_ib_aliasname_prefix_count_list:
         draw_ib_collection = CollectionUtils.create_new_collection(collection_name=draw_ib_aliasname,color_tag=CollectionColor.Pink,link_to_parent_collection_name=workspace_collection.name)
 
         part_count = 1
-        for prefix in import_prefix_list:
+        for i in range(prefix_count):
             component_name = "Component " + str(part_count)
             component_collection = CollectionUtils.create_new_collection(collection_name=component_name,color_tag=CollectionColor.Blue, link_to_parent_collection_name=draw_ib_collection.name)
 
-
-            fmt_file_path = os.path.join(import_folder_path, prefix + ".fmt")
-            mbf = MigotoBinaryFile(fmt_path=fmt_file_path)
+            mbf = next(mbf_iterator)
             obj_result = MeshImportUtils.create_mesh_obj_from_mbf(mbf=mbf)
 
             component_collection.objects.link(obj_result)
@@ -86,7 +125,11 @@ class SSMTImportAllFromCurrentWorkSpace(bpy.types.Operator):
             self.report({"ERROR"},"Please select a correct WorkSpace in SSMT before import " + GlobalConfig.path_workspace_folder())
         else:
             TimerUtils.Start("ImportFromWorkSpace")
-            ImprotFromWorkSpaceSSMT(self,context)
+            try:
+                ImprotFromWorkSpaceSSMT(self,context)
+            finally:
+                # 映射只在这次导入中共享，导入结束后释放，避免文件一直被占用
+                MigotoBinaryFile.clear_memory_map_cache()
             TimerUtils.End("ImportFromWorkSpace")
         return {'FINISHED'}
     
@@ -120,7 +163,8 @@ def ImprotFromWorkSpaceSSMTV3(self, context):
     # 创建一个默认显示的集合，用来存放默认显示的东西，在实际使用中几乎每次都需要我们手动创建，所以变为自动化了。
     default_show_collection = CollectionUtils.create_new_collection(collection_name="DefaultShow",color_tag=CollectionColor.White,link_to_parent_collection_name=workspace_collection.name)
 
-    # 开始读取模型数据
+    # 第一阶段：收集所有DrawIB中要导入的模型
+    fmt_path_mesh_name_list = []
     for draw_ib_aliasname,import_folder_path in import_drawib_aliasname_folder_path_dict.items():
         print("Importing DrawIB:", draw_ib_aliasname)
 
@@ -138,12 +182,16 @@ def ImprotFromWorkSpaceSSMTV3(self, context):
         part_count = 1
         for prefix in import_prefix_list:
             fmt_file_path = os.path.join(import_folder_path, prefix + ".fmt")
-            mbf = MigotoBinaryFile(fmt_path=fmt_file_path,mesh_name=draw_ib + "-" + str(part_count) + "-" + alias_name)
-            obj_result = MeshImportUtils.create_mesh_obj_from_mbf(mbf=mbf)
-
-            default_show_collection.objects.link(obj_result)
+            mesh_name = draw_ib + "-" + str(part_count) + "-" + alias_name
+            fmt_path_mesh_name_list.append((fmt_file_path, mesh_name))
             part_count = part_count + 1
 
+    # 第二阶段：主线程按原来的顺序取回读取结果，只负责创建模型
+    for mbf in iter_migoto_binary_files(fmt_path_mesh_name_list, Properties_ImportModel.use_memory_map_import()):
+        obj_result = MeshImportUtils.create_mesh_obj_from_mbf(mbf=mbf)
+
+        default_show_collection.objects.link(obj_result)
+
     # 这里先链接SourceCollection，确保它在上面
     bpy.context.scene.collection.children.link(workspace_collection)
 
@@ -163,7 +211,11 @@ class SSMTImportAllFromCurrentWorkSpaceV3(bpy.types.Operator):
             self.report({"ERROR"},"WorkSpace Folder Didn't exists, Please create a WorkSpace in SSMT before import " + GlobalConfig.path_workspace_folder())
         else:
             TimerUtils.Start("ImportFromWorkSpace")
-            ImprotFromWorkSpaceSSMTV3(self,context)
+            try:
+                ImprotFromWorkSpaceSSMTV3(self,context)
+            finally:
+                # 映射只在这次导入中共享，导入结束后释放，避免文件一直被占用
+                MigotoBinaryFile.clear_memory_map_cache()
             TimerUtils.End("ImportFromWorkSpace")
         return {'FINISHED'}
     
\ No newline at end of file
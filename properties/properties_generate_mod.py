@@ -85,6 +85,37 @@ class Properties_GenerateMod(bpy.types.PropertyGroup):
         default=False
     ) # type: ignore
 
+    use_export_cache:bpy.props.BoolProperty(
+        name="使用导出缓存",
+        description="把每个模型的导出结果缓存到工作空间的ExportCache文件夹中，再次生成Mod时没有任何改动的模型直接使用缓存结果，大幅加快反复生成Mod的速度",
+        default=True
+    ) # type: ignore
+
+    export_cache_size_limit_mb:bpy.props.IntProperty(
+        name="导出缓存大小上限(MB)",
+        description="导出缓存超过此大小时，自动删除最久未使用的缓存",
+        default=1024,
+        min=16
+    ) # type: ignore
+
+    use_parallel_export:bpy.props.BoolProperty(
+        name="并行导出",
+        description="主线程读取模型数据后，把格式转换、权重量化、去重和重计算放到线程池中执行，多个模型可以同时计算，模型较多时能大幅加快生成Mod的速度",
+        default=True
+    ) # type: ignore
+
+    use_streaming_export:bpy.props.BoolProperty(
+        name="流式导出",
+        description="每个模型计算完成后直接把CategoryBuffer追加写入到.buf文件并释放，同时限制同时在计算中的模型数量，DrawIB较多、模型较大时能大幅降低生成Mod时的内存占用",
+        default=False
+    ) # type: ignore
+
+    use_vertex_cache_optimization:bpy.props.BoolProperty(
+        name="顶点缓存优化",
+        description="导出时在每个模型内部用Tipsify算法重新排列三角形顺序，并按第一次使用的顺序重新编号顶点，提高GPU顶点缓存命中率和顶点读取的局部性，控制台会输出优化前后的ACMR/ATVR。会增加导出耗时，WWMI的融合模型不进行优化",
+        default=False
+    ) # type: ignore
+
     
     # only_use_marked_texture
     @classmethod
@@ -98,6 +129,41 @@ class Properties_GenerateMod(bpy.types.PropertyGroup):
 
 
     
+    @classmethod
+    def use_export_cache(cls):
+        '''
+        bpy.context.scene.properties_generate_mod.use_export_cache
+        '''
+        return bpy.context.scene.properties_generate_mod.use_export_cache
+    
+    @classmethod
+    def export_cache_size_limit_mb(cls):
+        '''
+        bpy.context.scene.properties_generate_mod.export_cache_size_limit_mb
+        '''
+        return bpy.context.scene.properties_generate_mod.export_cache_size_limit_mb
+    
+    @classmethod
+    def use_parallel_export(cls):
+        '''
+        bpy.context.scene.properties_generate_mod.use_parallel_export
+        '''
+        return bpy.context.scene.properties_generate_mod.use_parallel_export
+    
+    @classmethod
+    def use_streaming_export(cls):
+        '''
+        bpy.context.scene.properties_generate_mod.use_streaming_export
+        '''
+        return bpy.context.scene.properties_generate_mod.use_streaming_export
+    
+    @classmethod
+    def use_vertex_cache_optimization(cls):
+        '''
+        bpy.context.scene.properties_generate_mod.use_vertex_cache_optimization
+        '''
+        return bpy.context.scene.properties_generate_mod.use_vertex_cache_optimization
+    
     @classmethod
     def author_name(cls):
         '''
@@ -40,4 +40,30 @@ class Properties_ImportModel(bpy.types.PropertyGroup):
         '''
         bpy.context.scene.properties_import_model.import_flip_scale_y
         '''
-        return bpy.context.scene.properties_import_model.import_flip_scale_y
\ No newline at end of file
+        return bpy.context.scene.properties_import_model.import_flip_scale_y
+
+    use_memory_map_import :bpy.props.BoolProperty(
+        name="内存映射导入",
+        description="勾选后导入时以内存映射的方式打开.ib和.vb文件，不再一次性读取整个文件，只解码导入时用到的数据，同一次导入中重复读取同一个模型时共享同一个映射，导入结束后释放，适合DrawIB很多或者文件很大的工作空间",
+        default=False
+    ) # type: ignore
+
+    @classmethod
+    def use_memory_map_import(cls):
+        '''
+        bpy.context.scene.properties_import_model.use_memory_map_import
+        '''
+        return bpy.context.scene.properties_import_model.use_memory_map_import
+
+    use_parallel_import :bpy.props.BoolProperty(
+        name="并行导入",
+        description="一键导入工作空间时，在线程池中提前解析后面几个模型的fmt文件、读取ib和vb并完成格式转换，主线程只负责创建模型，DrawIB较多时能大幅加快导入速度",
+        default=True
+    ) # type: ignore
+
+    @classmethod
+    def use_parallel_import(cls):
+        '''
+        bpy.context.scene.properties_import_model.use_parallel_import
+        '''
+        return bpy.context.scene.properties_import_model.use_parallel_import
@@ -2,6 +2,7 @@ import bpy
 
 from ..utils.command_utils import *
 from ..utils.timer_utils import TimerUtils
+from ..utils.memory_utils import MemoryUtils
 from ..utils.collection_utils import CollectionUtils
 from ..generate_mod.drawib_model_wwmi import DrawIBModelWWMI
 from ..generate_mod.ini_model_hsr import M_HSRIniModel
@@ -12,6 +13,8 @@ from ..generate_mod.ini_model_identity_v import M_IniModel_IdentityV
 
 from ..generate_mod.drawib_model_universal import DrawIBModelUniversal
 from ..generate_mod.m_counter import M_Counter
+from ..generate_mod.export_cache import ExportCache
+from ..generate_mod.vertex_cache_optimizer import VertexCacheOptimizer
 
 from ..games.mod_unity_model import ModUnityModel
 from ..games.mod_hsr_model import ModHSRModel
@@ -26,6 +29,9 @@ class SSMTGenerateModUnityVS(bpy.types.Operator):
 
         M_UnityIniModelV2.initialzie()
         M_Counter.initialize()
+        ExportCache.initialize()
+        MemoryUtils.initialize()
+        VertexCacheOptimizer.initialize()
 
         workspace_collection = bpy.context.collection
 
@@ -51,6 +57,9 @@ class SSMTGenerateModUnityVS(bpy.types.Operator):
         # ModModel填充完毕后，开始输出Mod
         M_UnityIniModelV2.generate_unity_vs_config_ini()
 
+        ExportCache.report()
+        MemoryUtils.report()
+        VertexCacheOptimizer.report()
         self.report({'INFO'},"Generate Mod Success!")
         CommandUtils.OpenGeneratedModFolder()
 
@@ -73,6 +82,9 @@ class GenerateModYYSLS(bpy.types.Operator):
 
         M_CTX_IniModel.initialzie()
         M_Counter.initialize()
+        ExportCache.initialize()
+        MemoryUtils.initialize()
+        VertexCacheOptimizer.initialize()
 
         workspace_collection = bpy.context.collection
 
@@ -95,6 +107,9 @@ class GenerateModYYSLS(bpy.types.Operator):
         # ModModel填充完毕后，开始输出Mod
         M_CTX_IniModel.generate_unity_vs_config_ini()
 
+        ExportCache.report()
+        MemoryUtils.report()
+        VertexCacheOptimizer.report()
         self.report({'INFO'},"生成 YYSLS Mod完成")
 
         CommandUtils.OpenGeneratedModFolder()
@@ -112,6 +127,9 @@ class GenerateModIdentityV(bpy.types.Operator):
 
         M_IniModel_IdentityV.initialzie()
         M_Counter.initialize()
+        ExportCache.initialize()
+        MemoryUtils.initialize()
+        VertexCacheOptimizer.initialize()
 
         workspace_collection = bpy.context.collection
 
@@ -134,6 +152,9 @@ class GenerateModIdentityV(bpy.types.Operator):
         # ModModel填充完毕后，开始输出Mod
         M_IniModel_IdentityV.generate_unity_vs_config_ini()
 
+        ExportCache.report()
+        MemoryUtils.report()
+        VertexCacheOptimizer.report()
         self.report({'INFO'},"生成 IdentityV Mod完成")
 
         CommandUtils.OpenGeneratedModFolder()
@@ -152,6 +173,9 @@ class GenerateModWWMI(bpy.types.Operator):
 
         M_WWMIIniModel.initialzie()
         M_Counter.initialize()
+        ExportCache.initialize()
+        MemoryUtils.initialize()
+        VertexCacheOptimizer.initialize()
 
         workspace_collection = bpy.context.collection
 
@@ -174,6 +198,9 @@ class GenerateModWWMI(bpy.types.Operator):
         # ModModel填充完毕后，开始输出Mod
         M_WWMIIniModel.generate_unreal_vs_config_ini()
 
+        ExportCache.report()
+        MemoryUtils.report()
+        VertexCacheOptimizer.report()
         self.report({'INFO'},"Generate Mod Success!")
 
         CommandUtils.OpenGeneratedModFolder()
@@ -192,6 +219,9 @@ class SSMTGenerateModUnityCSV2(bpy.types.Operator):
         TimerUtils.Start("GenerateMod UnityCS")
 
         M_Counter.initialize()
+        ExportCache.initialize()
+        MemoryUtils.initialize()
+        VertexCacheOptimizer.initialize()
 
         # 先校验当前选中的工作空间是不是一个有效的工作空间集合
         workspace_collection = bpy.context.collection
@@ -203,6 +233,9 @@ class SSMTGenerateModUnityCSV2(bpy.types.Operator):
         migoto_mod_model = ModUnityModel(workspace_collection=workspace_collection)
         migoto_mod_model.generate_unity_cs_config_ini()
 
+        ExportCache.report()
+        MemoryUtils.report()
+        VertexCacheOptimizer.report()
         self.report({'INFO'},"Generate Mod Success!")
         CommandUtils.OpenGeneratedModFolder()
 
@@ -219,6 +252,9 @@ class SSMTGenerateModUnityVSV2(bpy.types.Operator):
         TimerUtils.Start("GenerateMod UnityVS")
 
         M_Counter.initialize()
+        ExportCache.initialize()
+        MemoryUtils.initialize()
+        VertexCacheOptimizer.initialize()
 
         # 先校验当前选中的工作空间是不是一个有效的工作空间集合
         workspace_collection = bpy.context.collection
@@ -230,6 +266,9 @@ class SSMTGenerateModUnityVSV2(bpy.types.Operator):
         migoto_mod_model = ModUnityModel(workspace_collection=workspace_collection)
         migoto_mod_model.generate_unity_vs_config_ini()
 
+        ExportCache.report()
+        MemoryUtils.report()
+        VertexCacheOptimizer.report()
         self.report({'INFO'},"Generate Mod Success!")
         CommandUtils.OpenGeneratedModFolder()
 
@@ -245,6 +284,9 @@ class SSMTGenerateModHSRV3(bpy.types.Operator):
         TimerUtils.Start("GenerateMod HSR V3")
 
         M_Counter.initialize()
+        ExportCache.initialize()
+        MemoryUtils.initialize()
+        VertexCacheOptimizer.initialize()
 
         # 先校验当前选中的工作空间是不是一个有效的工作空间集合
         workspace_collection = bpy.context.collection
@@ -256,6 +298,9 @@ class SSMTGenerateModHSRV3(bpy.types.Operator):
         migoto_mod_model = ModHSRModel(workspace_collection=workspace_collection)
         migoto_mod_model.generate_unity_cs_config_ini()
 
+        ExportCache.report()
+        MemoryUtils.report()
+        VertexCacheOptimizer.report()
         self.report({'INFO'},"Generate Mod Success!")
         CommandUtils.OpenGeneratedModFolder()
 
@@ -10,6 +10,7 @@ from ..config.main_config import *
 from .generate_mod_ui import *
 
 from ..properties.properties_dbmt_path import Properties_DBMT_Path
+from ..properties.properties_import_model import Properties_ImportModel
 from ..migoto.mesh_import_utils import MeshImportUtils
 from ..migoto.migoto_binary_file import MigotoBinaryFile
 
@@ -91,11 +92,15 @@ class Import3DMigotoRaw(bpy.types.Operator, ImportHelper):
                 import_filename_list.append(fmtfile.name)
 
         # 逐个fmt文件导入
-        for fmt_file_name in import_filename_list:
-            fmt_file_path = os.path.join(dirname, fmt_file_name)
-            mbf = MigotoBinaryFile(fmt_path=fmt_file_path)
-            obj_result = MeshImportUtils.create_mesh_obj_from_mbf(mbf=mbf)
-            collection.objects.link(obj_result)
+        try:
+            for fmt_file_name in import_filename_list:
+                fmt_file_path = os.path.join(dirname, fmt_file_name)
+                mbf = MigotoBinaryFile(fmt_path=fmt_file_path, use_memory_map=Properties_ImportModel.use_memory_map_import())
+                obj_result = MeshImportUtils.create_mesh_obj_from_mbf(mbf=mbf)
+                collection.objects.link(obj_result)
+        finally:
+            # 映射只在这次导入中共享，导入结束后释放，避免文件一直被占用
+            MigotoBinaryFile.clear_memory_map_cache()
         
         # Select all objects under collection (因为用户习惯了导入后就是全部选中的状态). 
         CollectionUtils.select_collection_objects(collection)
@@ -162,6 +167,8 @@ class PanelModelImportConfig(bpy.types.Panel):
         layout.prop(context.scene.properties_import_model,"model_scale",text="模型导入大小比例")
         layout.prop(context.scene.properties_import_model,"import_flip_scale_x",text="设置Scale的X分量为-1避免模型镜像")
         layout.prop(context.scene.properties_import_model,"import_flip_scale_y",text="设置Scale的Y分量为-1来改变模型朝向")
+        layout.prop(context.scene.properties_import_model,"use_memory_map_import",text="内存映射导入")
+        layout.prop(context.scene.properties_import_model,"use_parallel_import",text="并行导入")
     
         if GlobalConfig.gamename == "WWMI" or GlobalConfig.gamename == "WuWa":
             layout.prop(context.scene.properties_wwmi,"import_merged_vgmap",text="使用融合统一顶点组")
@@ -209,6 +216,13 @@ class PanelGenerateModConfig(bpy.types.Panel):
             layout.prop(context.scene.properties_generate_mod, "zzz_use_slot_fix")
         
         layout.prop(context.scene.properties_generate_mod, "generate_branch_mod_gui",text="生成分支架构Mod面板(测试中)")
+
+        layout.prop(context.scene.properties_generate_mod, "use_export_cache",text="使用导出缓存")
+        if context.scene.properties_generate_mod.use_export_cache:
+            layout.prop(context.scene.properties_generate_mod, "export_cache_size_limit_mb",text="导出缓存大小上限(MB)")
+        layout.prop(context.scene.properties_generate_mod, "use_parallel_export",text="并行导出")
+        layout.prop(context.scene.properties_generate_mod, "use_streaming_export",text="流式导出(降低内存占用)")
+        layout.prop(context.scene.properties_generate_mod, "use_vertex_cache_optimization",text="顶点缓存优化")
         
     
 
@@ -0,0 +1,116 @@
+import os
+import sys
+
+from .log_utils import LOG
+
+
+class MemoryUtils:
+    '''
+    统计导出过程中的内存占用
+
+    Blender进程本身的峰值内存是从启动开始累计的，不能反映某一次导出的峰值，
+    所以这里在导出的各个阶段调用sample记录当前常驻内存，取最大值作为本次导出的峰值。
+    '''
+    start_memory = 0
+    peak_memory = 0
+    peak_stage = ""
+
+    @classmethod
+    def get_current_memory(cls) -> int:
+        '''
+        当前进程的常驻内存字节数，无法获取时返回0
+        '''
+        try:
+            if sys.platform == "win32":
+                return cls.get_windows_process_memory()[0]
+
+            with open("/proc/self/statm", "r") as statm_file:
+                resident_pages = int(statm_file.read().split()[1])
+            return resident_pages * os.sysconf("SC_PAGE_SIZE")
+        except Exception:
+            return 0
+
+    @classmethod
+    def get_process_peak_memory(cls) -> int:
+        '''
+        操作系统记录的当前进程从启动到现在的峰值常驻内存字节数，无法获取时返回0
+        '''
+        try:
+            if sys.platform == "win32":
+                return cls.get_windows_process_memory()[1]
+
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux下单位是KB，macOS下单位是字节
+            if sys.platform == "darwin":
+                return max_rss
+            return max_rss * 1024
+        except Exception:
+            return 0
+
+    @classmethod
+    def get_windows_process_memory(cls):
+        '''
+        返回(WorkingSetSize, PeakWorkingSetSize)
+        '''
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+
+        get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_process_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        get_process_memory_info.restype = wintypes.BOOL
+
+        current_process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not get_process_memory_info(current_process, ctypes.byref(counters), counters.cb):
+            return 0, 0
+        return counters.WorkingSetSize, counters.PeakWorkingSetSize
+
+    @classmethod
+    def format_bytes(cls, byte_count:int) -> str:
+        return "%.1f MB" % (byte_count / 1024 / 1024)
+
+    @classmethod
+    def initialize(cls):
+        '''
+        每次生成Mod前调用，记录导出开始时的内存
+        '''
+        cls.start_memory = cls.get_current_memory()
+        cls.peak_memory = cls.start_memory
+        cls.peak_stage = "Start"
+
+    @classmethod
+    def sample(cls, stage:str = ""):
+        '''
+        在导出的各个阶段调用，记录目前为止的峰值内存
+        '''
+        current_memory = cls.get_current_memory()
+        if current_memory > cls.peak_memory:
+            cls.peak_memory = current_memory
+            cls.peak_stage = stage
+
+    @classmethod
+    def report(cls):
+        cls.sample("End")
+        if cls.peak_memory == 0:
+            return
+        LOG.info("导出内存: 开始时 " + cls.format_bytes(cls.start_memory)
+                 + "，峰值 " + cls.format_bytes(cls.peak_memory) + " (" + cls.peak_stage + ")"
+                 + "，峰值增加 " + cls.format_bytes(cls.peak_memory - cls.start_memory)
+                 + "，进程历史峰值 " + cls.format_bytes(cls.get_process_peak_memory()))
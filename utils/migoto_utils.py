@@ -60,6 +60,18 @@ class MigotoUtils:
 
         raise Fatal('Mesh uses an unsupported DXGI Format: %s' % fmt)
 
+    @classmethod
+    def get_index_buffer_format(cls,ib) -> str:
+        '''
+        根据IB中的最大索引选择IB的格式，能用R16_UINT时就用R16_UINT，显存和带宽减半，否则使用R32_UINT
+        0xFFFF在Strip拓扑中是重启图元的特殊值，所以R16_UINT最大只用到0xFFFE
+        写出IB文件时把选择的格式记录到DrawIBModel的PartName_IBFormat_Dict中，生成ini时各个IniModel直接读取，
+        没有IB文件的部分仍然使用R32_UINT
+        '''
+        if ib is not None and len(ib) != 0 and int(numpy.max(ib)) <= 0xFFFE:
+            return "DXGI_FORMAT_R16_UINT"
+        return "DXGI_FORMAT_R32_UINT"
+
     @classmethod
     def EncoderDecoder(cls,fmt):
         '''
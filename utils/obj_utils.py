@@ -643,6 +643,18 @@ class ObjUtils:
         else:
             return False
 
+    @classmethod
+    def get_vertex_group_lock_flags(cls,obj) -> list[bool]:
+        '''
+        按顶点组的index返回每个顶点组是否锁定
+        和Normalize All的默认选项lock_active一样，当前激活的顶点组也视为锁定，规格化时保持不变
+        '''
+        lock_flags = [vg.lock_weight for vg in obj.vertex_groups]
+        active_index = obj.vertex_groups.active_index
+        if 0 <= active_index < len(lock_flags):
+            lock_flags[active_index] = True
+        return lock_flags
+
     @classmethod
     def copy_object(cls,context, obj, name=None, collection=None):
         with OpenObject(context, obj, mode='OBJECT') as obj:
@@ -233,32 +233,44 @@ class ShapeKeyUtils:
 
 
     @classmethod
-    def extract_shapekey_data(cls,merged_obj,index_vertex_id_dict):
+    def extract_shapekey_data(cls,merged_obj,index_vertex_id_ndarray):
         '''
         传入一个Obj，提取出其形态键数据为特定格式
+        index_vertex_id_ndarray的下标是顶点索引，值是顶点ID
         '''
         TimerUtils.Start("process shapekey data")
 
-        shapekey_cache = cls.get_shapekey_cache(merged_obj,index_vertex_id_dict)
+        shapekey_cache = cls.get_shapekey_cache(merged_obj,index_vertex_id_ndarray)
 
-        shapekey_offsets = []
-        shapekey_vertex_ids = []
-        shapekey_vertex_offsets = []
+        shapekey_offsets = numpy.zeros(128, dtype=numpy.int32)
+        shapekey_vertex_ids_list = []
+        shapekey_vertex_offsets_list = []
 
         # 从0到128去获取ShapeKey的Index，有就直接加到
         shapekey_verts_count = 0
         for group_id in range(128):
+            shapekey_offsets[group_id] = shapekey_verts_count
+
             shapekey = shapekey_cache.get(group_id, None)
-            if shapekey is None or len(shapekey_cache[group_id]) == 0:
-                shapekey_offsets.extend([shapekey_verts_count if shapekey_verts_count != 0 else 0])
+            if shapekey is None:
                 continue
 
-            shapekey_offsets.extend([shapekey_verts_count])
+            index_ids, vertex_offsets = shapekey
+            shapekey_vertex_ids_list.append(index_ids)
+
+            # 每个顶点的偏移后面补3个0
+            padded_vertex_offsets = numpy.zeros((len(index_ids), 6), dtype=numpy.float32)
+            padded_vertex_offsets[:, :3] = vertex_offsets
+            shapekey_vertex_offsets_list.append(padded_vertex_offsets.ravel())
+
+            shapekey_verts_count += len(index_ids)
 
-            for draw_index, vertex_offsets in shapekey.items():
-                shapekey_vertex_ids.extend([draw_index])
-                shapekey_vertex_offsets.extend(vertex_offsets + [0, 0, 0])
-                shapekey_verts_count += 1
+        if len(shapekey_vertex_ids_list) != 0:
+            shapekey_vertex_ids = numpy.concatenate(shapekey_vertex_ids_list).astype(numpy.int32)
+            shapekey_vertex_offsets = numpy.concatenate(shapekey_vertex_offsets_list)
+        else:
+            shapekey_vertex_ids = numpy.empty(0, dtype=numpy.int32)
+            shapekey_vertex_offsets = numpy.empty(0, dtype=numpy.float32)
 
         TimerUtils.End("process shapekey data") 
         return shapekey_offsets,shapekey_vertex_ids,shapekey_vertex_offsets
@@ -266,9 +278,12 @@ class ShapeKeyUtils:
 
 
     @classmethod
-    def get_shapekey_cache(cls, merged_obj, index_vertex_id_dict):
+    def get_shapekey_cache(cls, merged_obj, index_vertex_id_ndarray):
         '''
         Numpy优化版本，快很多
+
+        返回字典，key是形态键ID，value是(index_ids, offsets)
+        index_ids按顶点ID、再按顶点索引升序排列，offsets是对应的(N,3)偏移
         '''
         TimerUtils.Start("shapekey_cache")
         obj = merged_obj
@@ -278,14 +293,11 @@ class ShapeKeyUtils:
         if mesh_shapekeys is None:
             print(f"obj: {obj.name} 不含有形态键，跳过处理")
             TimerUtils.End("shapekey_cache")
-            return None, None, None
+            return {}
 
-        # 构建顶点索引到全局index_id的反向映射
-        vertex_to_indices = {}
-        for index_id, vertex_id in index_vertex_id_dict.items():
-            if vertex_id not in vertex_to_indices:
-                vertex_to_indices[vertex_id] = []
-            vertex_to_indices[vertex_id].append(index_id)
+        # 所有顶点索引按照(顶点ID, 顶点索引)排序，这样每个顶点对应的顶点索引都是连续且升序的
+        sorted_index_ids = numpy.argsort(index_vertex_id_ndarray, kind="stable")
+        sorted_vertex_ids = index_vertex_id_ndarray[sorted_index_ids]
 
         # 获取基础坐标
         base_data = mesh_shapekeys.key_blocks['Basis'].data
@@ -321,22 +333,33 @@ class ShapeKeyUtils:
             # 计算向量长度并过滤小偏移
             lengths = numpy.linalg.norm(offsets, axis=1)
             valid_mask = lengths >= 1e-9
-            valid_vertex_ids = numpy.where(valid_mask)[0]
             
-            if not valid_vertex_ids.size:
+            if not valid_mask.any():
                 continue
-                
-            # 按形态键初始化缓存
+
+            # 找出所有关联到有效顶点的顶点索引
+            index_valid_mask = valid_mask[sorted_vertex_ids]
+            index_ids = sorted_index_ids[index_valid_mask]
+            index_offsets = offsets[sorted_vertex_ids[index_valid_mask]]
+
             if shapekey_idx not in shapekey_cache:
-                shapekey_cache[shapekey_idx] = {}
-                
-            # 处理有效顶点
-            for v_idx in valid_vertex_ids:
-                offset_list = offsets[v_idx].tolist()
-                # 获取关联的全局index_id
-                if v_idx in vertex_to_indices:
-                    for index_id in vertex_to_indices[v_idx]:
-                        shapekey_cache[shapekey_idx][index_id] = offset_list
+                shapekey_cache[shapekey_idx] = (index_ids, index_offsets)
+                continue
+
+            # 同一个形态键ID出现多次时，已存在的顶点索引更新偏移并保持原有顺序，新的顶点索引追加到末尾
+            cached_index_ids, cached_offsets = shapekey_cache[shapekey_idx]
+            cached_offsets = cached_offsets.copy()
+            index_position = numpy.full(len(index_vertex_id_ndarray), -1, dtype=numpy.int64)
+            index_position[cached_index_ids] = numpy.arange(len(cached_index_ids))
+
+            positions = index_position[index_ids]
+            exist_mask = positions >= 0
+            cached_offsets[positions[exist_mask]] = index_offsets[exist_mask]
+
+            shapekey_cache[shapekey_idx] = (
+                numpy.concatenate((cached_index_ids, index_ids[~exist_mask])),
+                numpy.concatenate((cached_offsets, index_offsets[~exist_mask]))
+            )
 
         TimerUtils.End("shapekey_cache")
         return shapekey_cache
\ No newline at end of file